@@ -0,0 +1,154 @@
+'''
+Helpers shared by the benchmarks.
+
+Benchmarks are run from the soniferous directory, e.g.
+python3 -m benchmarks.load_test, and use the database profile selected by
+SONIFEROUS_DB. They work on a test database created for the run, so the
+music library itself is never touched.
+'''
+import contextlib
+import os
+import os.path
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import django
+
+def setup():
+  '''Configures Django for a benchmark run outside of manage.py.'''
+  os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'soniferous.settings')
+  django.setup()
+
+@contextlib.contextmanager
+def test_database():
+  '''
+  Creates an empty test database for the duration of a benchmark. SQLite
+  test databases are kept in a file because in-memory databases do not
+  lock like the real one.
+  '''
+  from django.db import connection
+  if connection.vendor == 'sqlite':
+    connection.settings_dict['TEST']['NAME'] = \
+     os.path.join(tempfile.gettempdir(), 'soniferous-benchmark.sl3')
+  old_name = connection.creation.create_test_db(verbosity=0,\
+   autoclobber=True)
+  try:
+    yield
+  finally:
+    connection.creation.destroy_test_db(old_name, verbosity=0)
+
+@contextlib.contextmanager
+def media_root():
+  '''
+  Stores the music files of a benchmark in a temporary directory that is
+  removed afterwards.
+  Yield: str, the directory used as MEDIA_ROOT.
+  '''
+  from django.test.utils import override_settings
+  directory = tempfile.mkdtemp(prefix='soniferous-benchmark-')
+  try:
+    with override_settings(MEDIA_ROOT=directory):
+      yield directory
+  finally:
+    shutil.rmtree(directory, ignore_errors=True)
+
+def create_sparse_file(path, size):
+  '''
+  Creates a file of the given size that takes almost no disk space. Its
+  content reads as zeros, which is enough to stream it.
+  Args:
+   path - str, the path of the file
+   size - int, the size of the file in bytes
+  '''
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  with open(path, 'wb') as file_:
+    file_.truncate(size)
+
+def create_catalog(artists, albums_per_artist, songs_per_album,\
+ file_size=None):
+  '''
+  Fills the database with a synthetic catalog.
+  Args:
+   artists - int, the number of artists
+   albums_per_artist - int, the number of albums of each artist
+   songs_per_album - int, the number of songs on each album
+   file_size - int, creates sparse music files of this many bytes under
+    MEDIA_ROOT. Without it the songs refer to files that do not exist.
+  Return: int, the number of songs created.
+  '''
+  from django.conf import settings
+  from music_player import library
+  from music_player.models import Song, Album, Artist
+  Artist.objects.bulk_create([Artist(artist='Artist {0}'.format(i))\
+   for i in range(artists)])
+  Album.objects.bulk_create([Album(artist_id=artist,\
+   album='Album {0}'.format(i)) for artist in \
+   Artist.objects.values_list('pk', flat=True) \
+   for i in range(albums_per_artist)])
+  songs = []
+  for album in Album.objects.values_list('pk', flat=True):
+    for track in range(1, songs_per_album + 1):
+      name = 'uploaded_music/benchmark-{0}-{1}.mp3'.format(album, track)
+      if file_size is not None:
+        create_sparse_file(os.path.join(settings.MEDIA_ROOT, name), file_size)
+      songs.append(Song(title='Song {0} of {1}'.format(track, album),\
+       track_number=track, album_id=album, time='3:21', duration=201000,\
+       music_file=name))
+      if len(songs) >= 5000:
+        Song.objects.bulk_create(songs)
+        songs = []
+  Song.objects.bulk_create(songs)
+  library.finish_bulk_changes()
+  return Song.objects.count()
+
+def timings(callback, runs):
+  '''
+  Args:
+   callback - function, the operation to time
+   runs - int, the number of times to call it
+  Return: list(float), the seconds taken by each call.
+  '''
+  times = []
+  for i in range(runs):
+    start = time.perf_counter()
+    callback()
+    times.append(time.perf_counter() - start)
+  return times
+
+def peak_memory(callback):
+  '''
+  Args: callback - function, the operation to measure
+  Return: int, the most bytes allocated by Python at once during the call.
+  '''
+  tracemalloc.start()
+  try:
+    callback()
+    return tracemalloc.get_traced_memory()[1]
+  finally:
+    tracemalloc.stop()
+
+def summarize(times):
+  '''
+  Args: times - list(float), the seconds taken by repeated operations
+  Return: dict, the count and the median, p95 and fastest times in ms.
+  '''
+  return {
+   'runs': len(times),
+   'p50_ms': percentile(times, 0.5) * 1000,
+   'p95_ms': percentile(times, 0.95) * 1000,
+   'min_ms': min(times) * 1000,
+  }
+
+def percentile(values, fraction):
+  '''
+  Args:
+   values - list(float), the measurements
+   fraction - float, between 0 and 1
+  Return: float, the measurement at the given fraction of the sorted list.
+  '''
+  if not values:
+    return None
+  values = sorted(values)
+  return values[min(int(len(values) * fraction), len(values) - 1)]
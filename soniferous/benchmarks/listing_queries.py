@@ -0,0 +1,60 @@
+'''
+Times the queries behind the listings on a large synthetic catalog and
+shows their query plans:
+
+  python3 -m benchmarks.listing_queries --artists 1000
+
+The default catalog has 100000 songs. The results are printed as json.
+'''
+import argparse
+import json
+
+from benchmarks import common
+
+def query_plan(queryset):
+  '''Return: list(str), the steps of the query plan of a queryset.'''
+  from django.db import connection
+  sql, params = queryset.query.sql_with_params()
+  explain = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' \
+   else 'EXPLAIN '
+  with connection.cursor() as cursor:
+    cursor.execute(explain + sql, params)
+    return [row[-1] for row in cursor.fetchall()]
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+  parser.add_argument('--artists', type=int, default=1000)
+  parser.add_argument('--albums', type=int, default=10,\
+   help='Albums per artist.')
+  parser.add_argument('--songs', type=int, default=10,\
+   help='Songs per album.')
+  parser.add_argument('--runs', type=int, default=5)
+  args = parser.parse_args()
+  common.setup()
+  from music_player.catalog import song_order, album_order
+  from music_player.models import Song, Album, Artist
+  with common.test_database():
+    songs = common.create_catalog(args.artists, args.albums, args.songs)
+    album = Album.objects.order_by('pk')[songs // args.songs // 2].pk
+    artist = Artist.objects.order_by('pk')[args.artists // 2].pk
+    order = song_order + ('pk',)
+    lookups = [lookup for key, lookup in Song.json_fields]
+    querysets = {
+     'song_list': Song.objects.order_by(*order).values_list(*lookups),
+     'song_page': Song.objects.order_by(*order).values_list(*lookups)[:200],
+     'album_songs': Song.objects.filter(album=album).order_by(*order)\
+      .values_list(*lookups),
+     'artist_songs': Song.objects.filter(album__artist=artist)\
+      .order_by(*order).values_list(*lookups),
+     'album_list': Album.objects.order_by(*album_order + ('pk',))\
+      .values_list(*[lookup for key, lookup in Album.json_fields]),
+    }
+    results = {}
+    for name, queryset in sorted(querysets.items()):
+      results[name] = common.summarize(common.timings(\
+       lambda: sum(1 for row in queryset.iterator()), args.runs))
+      results[name]['plan'] = query_plan(queryset)
+    print(json.dumps({'songs': songs, 'results': results}, indent=2))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,144 @@
+'''
+Measures the read throughput of the listing endpoints while songs are
+being added and deleted, to compare database profiles:
+
+  SONIFEROUS_DB=sqlite python3 -m benchmarks.load_test
+  SONIFEROUS_DB=postgresql python3 -m benchmarks.load_test
+
+Readers and writers are threads of this process, each with its own
+database connection. The results are printed as json.
+'''
+import argparse
+import json
+import random
+import threading
+import time
+
+from benchmarks import common
+
+def read_loop(client, urls, deadline, results):
+  '''
+  Requests random listings until the deadline.
+  Args:
+   client - Client, a logged in test client
+   urls - dict, the urls of each kind of listing
+   deadline - float, the time to stop at
+   results - list, receives (kind, succeeded, seconds) for each request
+  '''
+  from django.db import connection
+  kinds = sorted(urls)
+  try:
+    while time.time() < deadline:
+      kind = random.choice(kinds)
+      start = time.time()
+      try:
+        response = client.get(random.choice(urls[kind]))
+        if response.streaming:
+          b''.join(response.streaming_content)
+        ok = response.status_code == 200
+      except Exception:
+        ok = False
+      results.append((kind, ok, time.time() - start))
+  finally:
+    connection.close()
+
+def write_loop(deadline, results):
+  '''
+  Adds songs and deletes older ones until the deadline.
+  Args:
+   deadline - float, the time to stop at
+   results - list, receives ('write', succeeded, seconds) for each write
+  '''
+  from django.db import connection, transaction
+  from music_player.models import Song, create_song
+  created = []
+  try:
+    while time.time() < deadline:
+      start = time.time()
+      try:
+        with transaction.atomic():
+          song = create_song('Load test {0}'.format(len(created)), '3:21',\
+           1, 'Load test album', 'Load test artist', None)
+        created.append(song.pk)
+        if len(created) > 10:
+          Song.objects.get(pk=created.pop(0)).delete()
+        ok = True
+      except Exception:
+        ok = False
+      results.append(('write', ok, time.time() - start))
+  finally:
+    connection.close()
+
+def summarize(results, seconds):
+  '''Return: dict, requests per second, errors and latency of each kind.'''
+  summary = {}
+  for kind in sorted(set(result[0] for result in results)):
+    times = [elapsed for name, ok, elapsed in results if name == kind]
+    errors = sum(1 for name, ok, elapsed in results \
+     if name == kind and not ok)
+    summary[kind] = {
+     'requests': len(times),
+     'per_second': len(times) / seconds,
+     'errors': errors,
+     'p50_ms': common.percentile(times, 0.5) * 1000,
+     'p95_ms': common.percentile(times, 0.95) * 1000,
+    }
+  return summary
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+  parser.add_argument('--readers', type=int, default=8)
+  parser.add_argument('--writers', type=int, default=1)
+  parser.add_argument('--seconds', type=float, default=20)
+  parser.add_argument('--artists', type=int, default=100)
+  parser.add_argument('--albums', type=int, default=5,\
+   help='Albums per artist.')
+  parser.add_argument('--songs', type=int, default=12,\
+   help='Songs per album.')
+  args = parser.parse_args()
+  common.setup()
+  from django.conf import settings
+  from django.contrib.auth.models import User
+  from django.core.urlresolvers import reverse
+  from django.test import Client
+  from music_player.models import Album, Artist
+  with common.test_database():
+    songs = common.create_catalog(args.artists, args.albums, args.songs)
+    user = User.objects.create_user('benchmark', password='benchmark')
+    album_ids = list(Album.objects.values_list('pk', flat=True)[:50])
+    artist_ids = list(Artist.objects.values_list('pk', flat=True)[:50])
+    urls = {
+     'song_list': [reverse('soniferous:songs')],
+     'album_list': [reverse('soniferous:albums')],
+     'artist_list': [reverse('soniferous:artists')],
+     'album_songs': [reverse('soniferous:albums', kwargs={'pk': pk}) \
+      for pk in album_ids],
+     'artist_songs': [reverse('soniferous:artists', kwargs={'pk': pk}) \
+      for pk in artist_ids],
+    }
+    # Logging in writes a session, so it is done before the writers start.
+    clients = []
+    for i in range(args.readers):
+      clients.append(Client())
+      clients[-1].force_login(user)
+    results = []
+    deadline = time.time() + args.seconds
+    threads = [threading.Thread(target=read_loop,\
+     args=(client, urls, deadline, results)) for client in clients]
+    threads += [threading.Thread(target=write_loop,\
+     args=(deadline, results)) for i in range(args.writers)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    print(json.dumps({
+     'database': settings.DATABASES['default']['ENGINE'],
+     'songs': songs,
+     'readers': args.readers,
+     'writers': args.writers,
+     'seconds': args.seconds,
+     'results': summarize(results, args.seconds),
+    }, indent=2))
+
+if __name__ == '__main__':
+  main()
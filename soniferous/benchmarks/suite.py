@@ -0,0 +1,589 @@
+'''
+Benchmarks the REST and audio endpoints on a synthetic catalog backed by
+sparse music files:
+
+  python3 -m benchmarks.suite --output results.json
+  python3 -m benchmarks.suite --compare results.json
+
+Each benchmark reports the median, p95 and fastest time of its operation
+and, for the listings, the peak memory used to produce a response. The
+results are printed as json. With --compare, the median of every
+benchmark is also shown as a ratio to a previous run, so regressions
+stand out.
+
+Benchmarks:
+ listings - the song, album and artist listings in json and compact form,
+  and the time a client takes to parse them
+ drill_down - the songs of single albums and artists
+ upload - adding a song through CreateSongForm, as the admin does
+ cleanup - deleting songs and the albums and artists they leave unused,
+  one by one and through the admin, with and without
+  SONIFEROUS_DEFERRED_CLEANUP
+ audio - concurrent ranged requests for songs, as a seeking player makes,
+  through session checked and signed urls and with each audio backend
+ queue - loading and editing a long play queue through the REST views
+ streaming - many slow listeners served by the sync and ASGI audio paths
+ search - full-text searches in catalogs of growing size
+'''
+import argparse
+import contextlib
+import json
+import os.path
+import random
+import threading
+import time
+
+from benchmarks import common
+
+test_file = os.path.join(os.path.dirname(__file__), '..', 'music_player',\
+ 'test-data', 'Kappa.mp3')
+
+def read_response(response):
+  '''Return: int, the bytes of a response body, reading streams fully.'''
+  if response.streaming:
+    return sum(len(chunk) for chunk in response.streaming_content)
+  return len(response.content)
+
+def get(client, url, **extra):
+  '''Requests a url and reads the whole response.'''
+  response = client.get(url, **extra)
+  assert response.status_code in (200, 206), (url, response.status_code)
+  return read_response(response)
+
+def clear_cache():
+  '''Drops cached listings so that every request builds its response.'''
+  from django.core.cache import cache
+  cache.clear()
+
+def read_body(response):
+  '''Return: bytes, the body of a response, reading streams fully.'''
+  if response.streaming:
+    return b''.join(response.streaming_content)
+  return response.content
+
+def read_compact(compact):
+  '''
+  Expands a compact listing into the artists, albums and songs of the json
+  listings, as Soniferous.readCompact does in the player.
+  Args: compact - dict, the parsed compact document
+  Return: dict, the list of dicts of each table.
+  '''
+  def table(name):
+    fields = compact[name]['fields']
+    return [dict(zip(fields, row)) for row in compact[name]['rows']]
+  artists = table('artists')
+  albums = table('albums')
+  for album in albums:
+    artist = artists[album['artist']]
+    album['artist_id'] = artist['id']
+    album['artist'] = artist['artist']
+  songs = table('songs')
+  for song in songs:
+    album = albums[song['album']]
+    song['album_id'] = album['id']
+    song['album'] = album['album']
+    song['artist_id'] = album['artist_id']
+    song['artist'] = album['artist']
+  return {'artists': artists, 'albums': albums, 'songs': songs}
+
+def bench_listings(client, args):
+  '''
+  Times each listing with and without the listing cache, and the time a
+  client takes to parse it into song, album or artist dicts.
+  '''
+  from django.core.urlresolvers import reverse
+  results = {}
+  listings = (('songs', 'json', {}),\
+   ('songs', 'compact', {'format': 'compact'}),\
+   ('albums', 'json', {}), ('artists', 'json', {}))
+  for label, form, extra in listings:
+    url = reverse('soniferous:' + label)
+    fetch = lambda: get(client, url, data=extra)
+    def uncached():
+      clear_cache()
+      fetch()
+    result = common.summarize(common.timings(uncached, args.runs))
+    result['cached'] = common.summarize(common.timings(fetch, args.runs))
+    clear_cache()
+    result['peak_bytes'] = common.peak_memory(fetch)
+    result['response_bytes'] = fetch()
+    body = read_body(client.get(url, data=extra)).decode('utf-8')
+    if form == 'compact':
+      parse = lambda: read_compact(json.loads(body))
+    else:
+      parse = lambda: json.loads(body)
+    result['parse'] = common.summarize(common.timings(parse, args.runs))
+    results['{0}_{1}'.format(label, form)] = result
+  return results
+
+def bench_drill_down(client, args):
+  '''Times the songs of random albums and artists, cache excluded.'''
+  from django.core.urlresolvers import reverse
+  from music_player.models import Album, Artist
+  results = {}
+  for label, model in (('albums', Album), ('artists', Artist)):
+    ids = list(model.objects.values_list('pk', flat=True))
+    def fetch():
+      clear_cache()
+      pk = random.choice(ids)
+      get(client, reverse('soniferous:' + label, kwargs={'pk': pk}))
+    results[label] = common.summarize(common.timings(fetch, args.runs))
+  return results
+
+def bench_upload(client, args):
+  '''Times CreateSongForm from tag reading to the stored song.'''
+  from django.core.files.uploadedfile import TemporaryUploadedFile
+  from music_player.forms import CreateSongForm
+  with open(test_file, 'rb') as file_:
+    content = file_.read()
+  created = []
+  def upload():
+    music_file = TemporaryUploadedFile('Kappa.mp3', 'audio/mpeg',\
+     len(content), None)
+    music_file.write(content)
+    music_file.seek(0)
+    form = CreateSongForm(data={}, files={'music_file': music_file})
+    assert form.is_valid(), form.errors
+    created.append(form.save())
+    music_file.close()
+  results = common.summarize(common.timings(upload, args.runs))
+  for song in created:
+    song.delete()
+  return results
+
+@contextlib.contextmanager
+def cleanup_mode(mode):
+  '''
+  Cleans up unused albums and artists in the given mode:
+   full_table - the original signals, which delete every album without
+    songs and every artist without albums after each change
+   immediate - the albums and artists of each change, at once
+   deferred - the same with SONIFEROUS_DEFERRED_CLEANUP, once per commit
+  '''
+  from django.db.models import Q
+  from django.db.models import signals
+  from django.test.utils import override_settings
+  from music_player import signals as handlers
+  from music_player.models import Album, Artist, Song
+  def clean_all_artists(sender, instance, **kwargs):
+    used_artists = Album.objects.all().values('artist')
+    Artist.objects.filter(~Q(pk__in=used_artists)).delete()
+  def clean_all_albums(sender, instance, **kwargs):
+    used_albums = Song.objects.all().values('album')
+    Album.objects.filter(~Q(pk__in=used_albums)).delete()
+  replaced = (
+   (signals.post_delete, Album, handlers.clean_unused_artists),
+   (signals.post_save, Album, handlers.clean_previous_artist),
+   (signals.post_delete, Song, handlers.clean_unused_albums),
+   (signals.post_save, Song, handlers.clean_previous_album),
+  )
+  baseline = (
+   (signals.post_delete, Album, clean_all_artists),
+   (signals.post_save, Album, clean_all_artists),
+   (signals.post_delete, Song, clean_all_albums),
+   (signals.post_save, Song, clean_all_albums),
+  )
+  if mode == 'full_table':
+    for signal, sender, handler in replaced:
+      signal.disconnect(handler, sender=sender)
+    for signal, sender, handler in baseline:
+      signal.connect(handler, sender=sender)
+  try:
+    with override_settings(SONIFEROUS_DEFERRED_CLEANUP=mode == 'deferred'):
+      yield
+  finally:
+    if mode == 'full_table':
+      for signal, sender, handler in baseline:
+        signal.disconnect(handler, sender=sender)
+      for signal, sender, handler in replaced:
+        signal.connect(handler, sender=sender)
+
+def bench_cleanup(client, args):
+  '''
+  Times deleting songs one by one when each delete leaves an album and an
+  artist unused, and the signals have to clean them up. Then times the
+  delete_selected action of the admin on --admin-delete-songs such songs
+  at once. Both run in each of the modes of cleanup_mode.
+  '''
+  from django.conf import settings
+  from django.contrib.auth.models import User
+  from django.core.urlresolvers import reverse
+  from django.db import transaction
+  from django.test import Client
+  from music_player.models import Album, Artist, Song, create_song
+  modes = ('full_table', 'immediate', 'deferred')
+  results = {}
+  for mode in modes:
+    songs = []
+    for i in range(args.cleanup_songs):
+      name = 'uploaded_music/cleanup-{0}.mp3'.format(i)
+      common.create_sparse_file(os.path.join(settings.MEDIA_ROOT, name), 1024)
+      songs.append(create_song('Cleanup {0}'.format(i), '3:21', 1,\
+       'Cleanup album {0}'.format(i), 'Cleanup artist {0}'.format(i), name))
+    start = time.perf_counter()
+    with cleanup_mode(mode):
+      with transaction.atomic():
+        for song in songs:
+          Song.objects.get(pk=song.pk).delete()
+    elapsed = time.perf_counter() - start
+    results[mode] = {
+     'songs': len(songs),
+     'total_ms': elapsed * 1000,
+     'per_song_ms': elapsed * 1000 / max(len(songs), 1),
+    }
+  admin = Client()
+  admin.force_login(User.objects.create_superuser('benchmark-admin',\
+   'admin@example.com', 'benchmark'))
+  url = reverse('admin:music_player_song_changelist')
+  count = args.admin_delete_songs
+  results['admin'] = {}
+  for mode in modes:
+    # Created in bulk, each song with an album and artist of its own.
+    Artist.objects.bulk_create([Artist(artist='Admin artist {0}'.format(i)) \
+     for i in range(count)])
+    artists = Artist.objects.filter(artist__startswith='Admin artist ')\
+     .values_list('pk', flat=True)
+    Album.objects.bulk_create([Album(album='Admin album', artist_id=pk) \
+     for pk in artists])
+    names = []
+    for i in range(count):
+      names.append('uploaded_music/admin-{0}.mp3'.format(i))
+      common.create_sparse_file(\
+       os.path.join(settings.MEDIA_ROOT, names[-1]), 1024)
+    Song.objects.bulk_create([Song(title='Admin', track_number=1,\
+     album_id=pk, time='3:21', music_file=name) for pk, name in \
+     zip(Album.objects.filter(album='Admin album')\
+     .values_list('pk', flat=True), names)])
+    first = Song.objects.filter(title='Admin').values_list('pk', flat=True)[0]
+    start = time.perf_counter()
+    with cleanup_mode(mode):
+      # Selecting every song of the filtered list, as the ids of 10000
+      # checked boxes exceed DATA_UPLOAD_MAX_NUMBER_FIELDS.
+      response = admin.post(url + '?title=Admin', {\
+       'action': 'delete_selected', '_selected_action': [first],\
+       'select_across': '1', 'post': 'yes'})
+    elapsed = time.perf_counter() - start
+    assert response.status_code == 302, response.status_code
+    assert not Album.objects.filter(album='Admin album').exists()
+    results['admin'][mode] = {
+     'songs': count,
+     'total_ms': elapsed * 1000,
+     'per_song_ms': elapsed * 1000 / max(count, 1),
+    }
+  return results
+
+def bench_audio(client, args):
+  '''
+  Streams random ranges of random songs from several threads at once and
+  reports the latency of the requests, the requests and bytes sent per
+  second and the worker occupancy, for the session checked song urls and
+  for signed urls. The session checked urls are then served by each
+  SONIFEROUS_AUDIO_BACKEND. Occupancy is the time a request holds its
+  worker thread per MiB asked for. With x_sendfile and x_accel_redirect
+  the bytes are left to the web server, which is not part of the run.
+  '''
+  from django.test.utils import override_settings
+  from music_player.audio import BACKENDS
+  from django.core.urlresolvers import reverse
+  from django.db import connection
+  from django.test import Client
+  from music_player.models import Song
+  from music_player.views import signed_audio_url
+  songs = Song.objects.only('music_file', 'file_size', 'file_mtime')
+  urls = {
+   'session': [reverse('soniferous:audio', kwargs={'pk': song.pk}) \
+    for song in songs],
+   'signed': [signed_audio_url(song)[0] for song in songs],
+  }
+  size = args.file_size
+  # The threads share the session of the logged in client.
+  clients = []
+  for i in range(args.streams):
+    clients.append(Client())
+    clients[-1].cookies.update(client.cookies)
+  def run(urls):
+    results = []
+    total = [0, 0]
+    lock = threading.Lock()
+    def stream(client):
+      try:
+        for i in range(args.runs):
+          first = random.randrange(size)
+          last = min(first + args.range_size, size) - 1
+          start = time.perf_counter()
+          length = get(client, random.choice(urls),\
+           HTTP_RANGE='bytes={0}-{1}'.format(first, last))
+          with lock:
+            results.append(time.perf_counter() - start)
+            total[0] += length
+            total[1] += last - first + 1
+      finally:
+        connection.close()
+    threads = [threading.Thread(target=stream, args=(client,)) \
+     for client in clients]
+    start = time.perf_counter()
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    elapsed = time.perf_counter() - start
+    summary = common.summarize(results)
+    summary['streams'] = args.streams
+    summary['requests_per_second'] = len(results) / elapsed
+    summary['bytes_per_second'] = total[0] / elapsed
+    summary['worker_ms_per_mib'] = sum(results) * 1000 * 1024 * 1024 / \
+     max(total[1], 1)
+    return summary
+  results = {mode: run(urls[mode]) for mode in ('session', 'signed')}
+  results['backends'] = {}
+  for backend in BACKENDS:
+    with override_settings(SONIFEROUS_AUDIO_BACKEND=backend):
+      results['backends'][backend] = run(urls['session'])
+  return results
+
+def bench_queue(client, args):
+  '''
+  Fills the play queue with --queue-size songs, then times loading it and
+  editing single entries, which should not depend on its length, as well
+  as replacing and reordering the whole queue.
+  '''
+  from django.core.urlresolvers import reverse
+  from music_player.models import Song
+  songs = list(Song.objects.values_list('pk', flat=True)[:args.queue_size])
+  songs = (songs * (args.queue_size // max(len(songs), 1) + 1))\
+   [:args.queue_size]
+  url = reverse('soniferous:queue')
+  entries_url = reverse('soniferous:queue-entries')
+  def send(method, url, body):
+    response = getattr(client, method)(url, json.dumps(body),\
+     content_type='application/json')
+    assert response.status_code in (200, 201), (url, response.status_code)
+    return json.loads(response.content.decode())
+  results = {}
+  results['replace'] = common.summarize(common.timings(\
+   lambda: send('put', entries_url, {'songs': songs}), max(args.runs // 4, 1)))
+  results['load'] = common.summarize(common.timings(\
+   lambda: get(client, url), args.runs))
+  ids = [row[0] for row in json.loads(client.get(url).content.decode())\
+   ['entries']['rows']]
+  def insert():
+    rows = send('post', entries_url,\
+     {'songs': [songs[0]], 'after': random.choice(ids)})['entries']['rows']
+    ids.append(rows[0][0])
+  results['insert'] = common.summarize(common.timings(insert, args.runs))
+  def move():
+    send('put', '{0}/{1}'.format(entries_url, random.choice(ids)),\
+     {'after': random.choice(ids)})
+  results['move'] = common.summarize(common.timings(move, args.runs))
+  def remove():
+    entry = ids.pop(random.randrange(len(ids)))
+    client.delete('{0}/{1}'.format(entries_url, entry))
+  results['remove'] = common.summarize(common.timings(remove, args.runs))
+  def reorder():
+    random.shuffle(ids)
+    send('put', entries_url, {'entries': ids})
+  results['reorder'] = common.summarize(common.timings(\
+   reorder, max(args.runs // 4, 1)))
+  results['entries'] = len(ids)
+  return results
+
+def bench_streaming(client, args):
+  '''
+  Compares the sync and ASGI audio paths. --listeners requests for signed
+  urls arrive at once and are read at --client-rate bytes per second. A
+  sync request holds one of --workers threads for its whole transfer, as
+  in a threaded WSGI server. The ASGI application only uses as many
+  threads for reading files.
+  '''
+  import asyncio
+  from concurrent.futures import ThreadPoolExecutor
+  from django.test import Client
+  from music_player.async_audio import AudioApplication
+  from music_player.models import Song
+  from music_player.views import signed_audio_url
+  urls = [signed_audio_url(song)[0] for song in \
+   Song.objects.only('music_file', 'file_size', 'file_mtime')]
+  size = args.file_size
+  def ranged():
+    first = random.randrange(size)
+    last = min(first + args.range_size, size) - 1
+    return random.choice(urls), 'bytes={0}-{1}'.format(first, last)
+  requests = [ranged() for i in range(args.listeners)]
+  results = {}
+
+  def sync_request(url, header, queued):
+    response = Client().get(url, HTTP_RANGE=header)
+    length = 0
+    for chunk in response.streaming_content:
+      length += len(chunk)
+      time.sleep(len(chunk) / args.client_rate)
+    response.close()
+    return time.perf_counter() - queued, length
+  start = time.perf_counter()
+  with ThreadPoolExecutor(max_workers=args.workers) as executor:
+    done = list(executor.map(sync_request, *zip(*[(url, header, start) \
+     for url, header in requests])))
+  results['sync'] = (done, time.perf_counter() - start)
+
+  application = AudioApplication(None, threads=args.workers)
+  async def async_request(url, header):
+    length = [0]
+    async def receive():
+      await asyncio.Future()
+    async def send(message):
+      if message['type'] == 'http.response.body':
+        length[0] += len(message['body'])
+        await asyncio.sleep(len(message['body']) / args.client_rate)
+    await application({'type': 'http', 'method': 'GET', 'path': url,\
+     'query_string': b'', 'headers': [(b'range', header.encode())]},\
+     receive, send)
+    return time.perf_counter() - start, length[0]
+  async def listen():
+    return await asyncio.gather(*[async_request(url, header) \
+     for url, header in requests])
+  loop = asyncio.new_event_loop()
+  try:
+    start = time.perf_counter()
+    done = loop.run_until_complete(listen())
+    results['async'] = (done, time.perf_counter() - start)
+  finally:
+    loop.close()
+    application.executor.shutdown()
+
+  for mode, (done, elapsed) in results.items():
+    summary = common.summarize([seconds for seconds, length in done])
+    summary['total_ms'] = elapsed * 1000
+    summary['bytes_per_second'] = sum(length for seconds, length in done)\
+     / elapsed
+    summary['threads'] = args.workers
+    results[mode] = summary
+  return results
+
+def bench_search(client, args):
+  '''
+  Grows the catalog to each of --search-sizes songs and times searches
+  for one and two word prefixes of the titles and for artist names. Runs
+  last since it leaves the added songs in the catalog.
+  '''
+  from django.core.urlresolvers import reverse
+  from music_player import library, search
+  from music_player.models import Album, Song
+  syllables = ('ka', 'lo', 'mi', 'ne', 'ru', 'so', 'ta', 'vi', 'ze', 'po',\
+   'da', 'fu')
+  words = [a + b for a in syllables for b in syllables]
+  rng = random.Random(0)
+  albums = list(Album.objects.values_list('pk', flat=True))
+  url = reverse('soniferous:search')
+  queries = (
+   ('one_word', lambda: rng.choice(words)[:3]),
+   ('two_words', lambda: '{0} {1}'.format(rng.choice(words),\
+    rng.choice(words)[:2])),
+   ('artist', lambda: 'artist {0}'.format(rng.randrange(args.artists))),
+  )
+  results = {'fts': search.fts_enabled()}
+  for size in sorted(int(size) for size in args.search_sizes.split(',')):
+    count = Song.objects.count()
+    while count < size:
+      batch = min(5000, size - count)
+      Song.objects.bulk_create([Song(title=' '.join(rng.sample(words, 3)),\
+       track_number=i % 20 + 1, album_id=albums[i % len(albums)],\
+       time='3:21', duration=201000, music_file='uploaded_music/none.mp3') \
+       for i in range(count, count + batch)])
+      count += batch
+    library.finish_bulk_changes()
+    results[str(size)] = {label: common.summarize(common.timings(\
+     lambda: get(client, url, data={'q': query()}), args.runs)) \
+     for label, query in queries}
+  return results
+
+benchmarks = (
+ ('listings', bench_listings),
+ ('drill_down', bench_drill_down),
+ ('upload', bench_upload),
+ ('cleanup', bench_cleanup),
+ ('audio', bench_audio),
+ ('queue', bench_queue),
+ ('streaming', bench_streaming),
+ ('search', bench_search),
+)
+
+def compare(results, baseline, prefix=''):
+  '''
+  Args:
+   results - dict, the results of this run
+   baseline - dict, the results of a previous run
+  Return: dict, the ratio of each median time to the one of the baseline.
+  '''
+  ratios = {}
+  for key, value in sorted(results.items()):
+    previous = baseline.get(key)
+    if isinstance(value, dict) and isinstance(previous, dict):
+      ratios.update(compare(value, previous, prefix + key + '.'))
+    elif key in ('p50_ms', 'total_ms') and previous:
+      ratios[prefix + key] = value / previous
+  return ratios
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+  parser.add_argument('--artists', type=int, default=100)
+  parser.add_argument('--albums', type=int, default=10,\
+   help='Albums per artist.')
+  parser.add_argument('--songs', type=int, default=10,\
+   help='Songs per album.')
+  parser.add_argument('--file-size', type=int, default=5 * 1024 * 1024,\
+   help='Bytes of each sparse music file.')
+  parser.add_argument('--runs', type=int, default=20)
+  parser.add_argument('--streams', type=int, default=8,\
+   help='Concurrent audio streams.')
+  parser.add_argument('--range-size', type=int, default=256 * 1024,\
+   help='Bytes asked for by each audio request.')
+  parser.add_argument('--cleanup-songs', type=int, default=200)
+  parser.add_argument('--admin-delete-songs', type=int, default=10000,\
+   help='Songs deleted at once through the admin.')
+  parser.add_argument('--queue-size', type=int, default=10000)
+  parser.add_argument('--listeners', type=int, default=200,\
+   help='Concurrent listeners of the streaming benchmark.')
+  parser.add_argument('--workers', type=int, default=8,\
+   help='Threads of the streaming benchmark.')
+  parser.add_argument('--client-rate', type=int, default=1024 * 1024,\
+   help='Bytes each listener reads per second.')
+  parser.add_argument('--search-sizes', default='10000,100000,1000000',\
+   help='Comma separated catalog sizes of the search benchmark.')
+  parser.add_argument('--only', action='append',\
+   choices=[name for name, bench in benchmarks],\
+   help='Runs only the given benchmark. May be repeated.')
+  parser.add_argument('--output', help='Also writes the results to a file.')
+  parser.add_argument('--compare', help='The results of a previous run.')
+  args = parser.parse_args()
+  common.setup()
+  from django.conf import settings
+  from django.contrib.auth.models import User
+  from django.test import Client
+  with common.test_database(), common.media_root():
+    songs = common.create_catalog(args.artists, args.albums, args.songs,\
+     args.file_size)
+    user = User.objects.create_user('benchmark', password='benchmark')
+    client = Client()
+    client.force_login(user)
+    results = {
+     'database': settings.DATABASES['default']['ENGINE'],
+     'songs': songs,
+     'file_size': args.file_size,
+     'results': {},
+    }
+    for name, bench in benchmarks:
+      if not args.only or name in args.only:
+        results['results'][name] = bench(client, args)
+  if args.compare:
+    with open(args.compare) as file_:
+      baseline = json.load(file_)
+    results['compared_to'] = args.compare
+    results['ratios'] = compare(results['results'], baseline['results'])
+  output = json.dumps(results, indent=2, sort_keys=True)
+  if args.output:
+    with open(args.output, 'w') as file_:
+      file_.write(output + '\n')
+  print(output)
+
+if __name__ == '__main__':
+  main()
@@ -1,6 +1,13 @@
+import os.path
+
+from django.conf import settings
 from django.contrib import admin
-from music_player.forms import CreateSongForm, ModifySongForm
-from music_player.models import Album, Artist, Song
+from django.core.urlresolvers import reverse
+from django.shortcuts import redirect
+
+from music_player import jobs
+from music_player.forms import CreateSongForm, ModifySongForm, UploadJobForm
+from music_player.models import Album, Artist, Song, UploadJob
 
 class SongAdmin(admin.ModelAdmin):
   '''
@@ -19,5 +26,44 @@ class SongAdmin(admin.ModelAdmin):
     else:
       self.form = CreateSongForm 
     return super(SongAdmin, self).get_form(request, obj, **kwargs)
+  def add_view(self, request, form_url='', extra_context=None):
+    '''Sends uploads to the background workers when they are enabled.'''
+    if getattr(settings, 'SONIFEROUS_ASYNC_UPLOADS', False):
+      return redirect(reverse('admin:music_player_uploadjob_add'))
+    return super(SongAdmin, self).add_view(request, form_url, extra_context)
 
 admin.site.register(Song, SongAdmin)
+
+class UploadJobAdmin(admin.ModelAdmin):
+  '''
+  New model: Accepts one or more MP3 files to process in the background.
+  Change model: Displays the status of the processing.
+  '''
+  form = UploadJobForm
+  list_display = ('file_name', 'status', 'error', 'song', 'updated',)
+  list_filter = ('status',)
+  ordering = ('-created',)
+  readonly_fields = ('file_name', 'status', 'error', 'song',)
+  actions = ['retry_jobs']
+  def save_model(self, request, obj, form, change):
+    '''Creates a job for every uploaded file and queues them.'''
+    if change:
+      return super(UploadJobAdmin, self).save_model(request, obj, form, change)
+    uploads = request.FILES.getlist('music_file')
+    obj.file_name = os.path.basename(uploads[0].name)
+    super(UploadJobAdmin, self).save_model(request, obj, form, change)
+    jobs.submit_job(obj.pk)
+    for upload in uploads[1:]:
+      job = UploadJob.objects.create(\
+       music_file=upload, file_name=os.path.basename(upload.name))
+      jobs.submit_job(job.pk)
+  def retry_jobs(self, request, queryset):
+    '''Queues failed jobs again.'''
+    failed = list(queryset.filter(status=UploadJob.FAILED)\
+     .values_list('pk', flat=True))
+    UploadJob.objects.filter(pk__in=failed).update(status=UploadJob.PENDING)
+    for pk in failed:
+      jobs.submit_job(pk)
+  retry_jobs.short_description = 'Retry failed uploads'
+
+admin.site.register(UploadJob, UploadJobAdmin)
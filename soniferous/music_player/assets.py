@@ -0,0 +1,212 @@
+'''
+Bundles of the player's scripts and style sheets.
+
+The build_assets command concatenates and minifies the files of each
+bundle into one file named after a hash of its content, next to gzip and,
+when the brotli module is installed, brotli compressed copies. The names
+are recorded in a manifest in STATIC_ROOT. Since a bundle's name changes
+whenever its content does, the web server can let browsers cache bundles
+for as long as it likes (see the README).
+
+Templates include bundles with the bundle tag of soniferous_assets. Until
+the bundles have been built, or if SONIFEROUS_STATIC_BUNDLES is False, the
+tag includes the separate files instead.
+'''
+import gzip
+import hashlib
+import io
+import json
+import os
+import os.path
+import re
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+# The files of each bundle, in order. Style sheets may be limited to a media
+# query, as their link tags were.
+bundles = {
+ 'player.js': (
+  ('soniferous/js/lib/zepto-min.js', None),
+  ('soniferous/js/lib/underscore-min.js', None),
+  ('soniferous/js/lib/backbone-min.js', None),
+  ('soniferous/js/models.js', None),
+  ('soniferous/js/views.js', None),
+ ),
+ 'base.css': (
+  ('soniferous/style/max-600px.css', '(max-width: 600px)'),
+  ('soniferous/style/min-601px.css', '(min-width: 601px)'),
+  ('soniferous/style/soniferous.css', None),
+ ),
+}
+# Where bundles are stored, relative to STATIC_ROOT and STATIC_URL.
+bundle_dir = 'soniferous/bundles'
+manifest_name = 'manifest.json'
+
+# Compiled at module load time.
+js_block_comment_re = re.compile(r'^\s*/\*(?:(?!\*/).)*\*/[ \t]*\n',\
+ re.M | re.S)
+js_line_comment_re = re.compile(r'^\s*//[^\n]*\n', re.M)
+css_comment_re = re.compile(r'/\*.*?\*/', re.S)
+css_space_re = re.compile(r'\s+')
+css_punctuation_re = re.compile(r'\s*([{};,>])\s*')
+
+def minify_js(source):
+  '''
+  Removes the comments that take whole lines, indentation and blank lines
+  from a script. Line breaks are kept so that automatic semicolon
+  insertion is not affected, and code is never rewritten.
+  Args: source - str, the script
+  Return: str, the smaller script.
+  '''
+  source = js_block_comment_re.sub('', source)
+  source = js_line_comment_re.sub('', source)
+  return '\n'.join(line.strip() for line in source.splitlines() \
+   if line.strip()) + '\n'
+
+def minify_css(source):
+  '''
+  Removes comments and the white space that has no meaning from a style
+  sheet.
+  Args: source - str, the style sheet
+  Return: str, the smaller style sheet.
+  '''
+  source = css_comment_re.sub('', source)
+  source = css_space_re.sub(' ', source)
+  source = css_punctuation_re.sub(r'\1', source)
+  return source.replace(';}', '}').strip() + '\n'
+
+def read_source(path):
+  '''
+  Args: path - str, the path of a static file
+  Return: str, the content of the file, found like collectstatic would.
+  Raises: IOError if no app provides the file.
+  '''
+  found = finders.find(path)
+  if not found:
+    raise IOError('Static file {0} was not found.'.format(path))
+  with open(found, encoding='utf-8') as file_:
+    return file_.read()
+
+def build_bundle(name):
+  '''
+  Args: name - str, the name of a bundle in bundles
+  Return: bytes, the minified content of the bundle.
+  '''
+  parts = []
+  for path, media in bundles[name]:
+    source = read_source(path)
+    if name.endswith('.js'):
+      # Files that are already minified are kept as they are.
+      parts.append(source if '-min.' in path else minify_js(source))
+    else:
+      source = minify_css(source)
+      # Style sheets that already limit themselves to their media query
+      # are not wrapped in it again.
+      if media and not source.startswith('@media {0}{{'.format(media)):
+        source = '@media {0}{{{1}}}\n'.format(media, source)
+      parts.append(source)
+  # A semicolon keeps scripts without a final one apart.
+  separator = ';\n' if name.endswith('.js') else ''
+  return separator.join(parts).encode('utf-8')
+
+def compress_gzip(content):
+  '''Return: bytes, the content compressed with gzip, with no timestamp.'''
+  buffer = io.BytesIO()
+  with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=9, mtime=0)\
+   as file_:
+    file_.write(content)
+  return buffer.getvalue()
+
+def hashed_name(name, content):
+  '''
+  Args:
+   name - str, the name of a bundle, e.g. player.js
+   content - bytes, the content of the bundle
+  Return: str, the name with a hash of the content, e.g. player.0123abcd.js
+  '''
+  base, extension = os.path.splitext(name)
+  digest = hashlib.sha256(content).hexdigest()[:12]
+  return '{0}.{1}{2}'.format(base, digest, extension)
+
+def build(output_dir=None):
+  '''
+  Writes every bundle and its compressed copies, then the manifest. The
+  bundles of the previous build are kept for pages that still refer to
+  them, older ones are removed.
+  Args: output_dir - str, the directory to write to. Defaults to the
+   bundle directory in STATIC_ROOT.
+  Return: dict, the file name of each bundle.
+  '''
+  output_dir = output_dir or os.path.join(settings.STATIC_ROOT, bundle_dir)
+  os.makedirs(output_dir, exist_ok=True)
+  path = os.path.join(output_dir, manifest_name)
+  keep = {manifest_name}
+  try:
+    with open(path) as file_:
+      previous = json.load(file_)
+  except (IOError, ValueError):
+    previous = {}
+  for file_name in previous.values():
+    keep.update((file_name, file_name + '.gz', file_name + '.br'))
+  manifest = {}
+  for name in sorted(bundles):
+    content = build_bundle(name)
+    file_name = hashed_name(name, content)
+    manifest[name] = file_name
+    copies = [(file_name, content),\
+     (file_name + '.gz', compress_gzip(content))]
+    if brotli is not None:
+      copies.append((file_name + '.br', brotli.compress(content)))
+    for copy_name, data in copies:
+      with open(os.path.join(output_dir, copy_name), 'wb') as file_:
+        file_.write(data)
+      keep.add(copy_name)
+  for old_name in os.listdir(output_dir):
+    if old_name not in keep:
+      os.remove(os.path.join(output_dir, old_name))
+  # The manifest is written last so that it never names missing files.
+  with open(path + '.tmp', 'w') as file_:
+    json.dump(manifest, file_, indent=1, sort_keys=True)
+  os.replace(path + '.tmp', path)
+  return manifest
+
+# (path, mtime, manifest) of the manifest read last.
+_manifest = (None, None, {})
+
+def get_manifest():
+  '''
+  Return: dict, the file name of each built bundle. Empty if the bundles
+   have not been built or SONIFEROUS_STATIC_BUNDLES is False.
+  '''
+  global _manifest
+  if not getattr(settings, 'SONIFEROUS_STATIC_BUNDLES', True) or \
+   not settings.STATIC_ROOT:
+    return {}
+  path = os.path.join(settings.STATIC_ROOT, bundle_dir, manifest_name)
+  try:
+    mtime = os.stat(path).st_mtime
+  except OSError:
+    return {}
+  if _manifest[:2] != (path, mtime):
+    with open(path) as file_:
+      _manifest = (path, mtime, json.load(file_))
+  return _manifest[2]
+
+def bundle_urls(name):
+  '''
+  Args: name - str, the name of a bundle in bundles
+  Return: list(tuple(str, str)), the url and media query of the built
+   bundle, or of each of its files if it has not been built.
+  '''
+  file_name = get_manifest().get(name)
+  if file_name:
+    return [(staticfiles_storage.url(bundle_dir + '/' + file_name), None)]
+  return [(staticfiles_storage.url(path), media) \
+   for path, media in bundles[name]]
@@ -0,0 +1,165 @@
+'''
+Streaming of signed audio urls for ASGI servers.
+
+AudioApplication is an ASGI application that serves the signed audio
+urls (see music_player.audio) itself and hands every other request to the
+Django application it wraps. A sync worker is held by an audio request
+for as long as the listener takes to download it; here a stream only
+costs a coroutine while it waits for the client. Files are still read with
+blocking calls, but in a small pool of threads, one chunk at a time, and
+the next chunk is only read once the server has accepted the previous one.
+A slow listener thus holds at most one chunk in memory, and thousands of
+them can share a few processes.
+
+The response itself, with its conditional and range handling, comes from
+the signed_audio view, so both paths answer alike. Signed urls need no
+session or database, which is what lets them skip Django's middleware.
+'''
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.urlresolvers import Resolver404, resolve
+from django.http import Http404, HttpRequest, HttpResponseNotFound
+
+from music_player import metrics, views
+
+class AudioApplication(object):
+  '''
+  Serves signed audio urls asynchronously and everything else with the
+  wrapped application.
+  '''
+  def __init__(self, application, threads=None, chunk_size=None):
+    '''
+    Args:
+     application - the ASGI application handling the other requests
+     threads - int, the threads reading files instead of
+      SONIFEROUS_ASGI_THREADS
+     chunk_size - int, the bytes sent at once instead of
+      SONIFEROUS_ASGI_CHUNK_SIZE
+    '''
+    self.application = application
+    self.executor = ThreadPoolExecutor(max_workers=threads or \
+     getattr(settings, 'SONIFEROUS_ASGI_THREADS', 8))
+    self.chunk_size = chunk_size or \
+     getattr(settings, 'SONIFEROUS_ASGI_CHUNK_SIZE', 64 * 1024)
+    self.record_metrics = 'music_player.metrics.MetricsMiddleware' in \
+     getattr(settings, 'MIDDLEWARE_CLASSES', ())
+
+  async def __call__(self, scope, receive, send):
+    token = self.audio_token(scope)
+    if token is None:
+      await self.application(scope, receive, send)
+    else:
+      await self.serve(scope, receive, send, token)
+
+  def audio_token(self, scope):
+    '''
+    Return: str, the token of a request for a signed audio url, or None if
+     the request is for another url.
+    '''
+    if scope['type'] != 'http' or scope['method'] not in ('GET', 'HEAD'):
+      return None
+    path = scope['path']
+    root_path = scope.get('root_path', '')
+    if root_path and path.startswith(root_path):
+      path = path[len(root_path):]
+    try:
+      match = resolve(path)
+    except Resolver404:
+      return None
+    if match.func is not views.signed_audio:
+      return None
+    return match.kwargs['token']
+
+  def make_request(self, scope):
+    '''Return: HttpRequest, the request described by an ASGI scope.'''
+    request = HttpRequest()
+    request.method = scope['method']
+    request.path = request.path_info = scope['path']
+    request.META = {
+     'REQUEST_METHOD': scope['method'],
+     'SCRIPT_NAME': scope.get('root_path', ''),
+     'PATH_INFO': scope['path'],
+     'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+    }
+    for name, value in scope.get('headers', ()):
+      key = 'HTTP_' + name.decode('latin-1').upper().replace('-', '_')
+      value = value.decode('latin-1')
+      # Repeated headers are joined as WSGI servers do.
+      if key in request.META:
+        value = request.META[key] + ',' + value
+      request.META[key] = value
+    return request
+
+  async def serve(self, scope, receive, send, token):
+    '''Sends the response of the signed_audio view for a request.'''
+    loop = asyncio.get_event_loop()
+    start = time.time()
+    request = self.make_request(scope)
+    try:
+      # Opening the file blocks as well.
+      response = await loop.run_in_executor(self.executor,\
+       functools.partial(views.signed_audio, request, token))
+    except Http404:
+      response = HttpResponseNotFound()
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    length = 0
+    try:
+      await send({
+       'type': 'http.response.start',
+       'status': response.status_code,
+       'headers': [(name.encode('latin-1'), value.encode('latin-1')) \
+        for name, value in response.items()],
+      })
+      if scope['method'] == 'HEAD':
+        chunks = iter(())
+      elif response.streaming:
+        chunks = iter(response.streaming_content)
+      else:
+        chunks = iter((response.content,))
+      while not disconnected.done():
+        chunk = await loop.run_in_executor(self.executor, read_chunk,\
+         chunks, self.chunk_size)
+        if not chunk:
+          break
+        length += len(chunk)
+        # Returns once the server has room for more, which is the only
+        # backpressure a stream needs.
+        await send({'type': 'http.response.body', 'body': chunk,\
+         'more_body': True})
+      if not disconnected.done():
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+      disconnected.cancel()
+      await loop.run_in_executor(self.executor, response.close)
+      if self.record_metrics:
+        metrics.registry.record('signed-audio', response.status_code,\
+         time.time() - start, 0, 0.0, length,\
+         metrics.range_kind(request.META.get('HTTP_RANGE')))
+
+def read_chunk(chunks, size):
+  '''
+  Joins the chunks of a response body until there are at least size bytes.
+  Args:
+   chunks - iterator(bytes), the rest of the body
+   size - int, the bytes wanted
+  Return: bytes, the next part of the body, empty at its end.
+  '''
+  parts = []
+  length = 0
+  for chunk in chunks:
+    parts.append(chunk)
+    length += len(chunk)
+    if length >= size:
+      break
+  return b''.join(parts)
+
+async def wait_for_disconnect(receive):
+  '''Returns once the client has gone away.'''
+  while True:
+    message = await receive()
+    if message['type'] == 'http.disconnect':
+      return
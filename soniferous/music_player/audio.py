@@ -0,0 +1,372 @@
+'''
+Delivery backends used to send song files to the user.
+
+The backend is chosen with the SONIFEROUS_AUDIO_BACKEND setting:
+ 'python' - the file is read and streamed by the Django worker.
+ 'file_wrapper' - full files are handed to the WSGI server's
+  wsgi.file_wrapper (sendfile on servers such as Gunicorn).
+ 'x_sendfile' - an X-Sendfile header is returned (Apache, lighttpd).
+ 'x_accel_redirect' - an X-Accel-Redirect header is returned (nginx).
+  SONIFEROUS_X_ACCEL_PREFIX is the internal location that maps to the
+  directory files are stored in.
+Authentication, range validation and conditional requests (RFC 7232 and
+RFC 7233) always happen in Django before a backend is used.
+
+Responses may be kept by the browser's private cache for
+SONIFEROUS_AUDIO_MAX_AGE seconds, so that the warm start range fetched
+ahead of a song (see warm_start_range) is reused when it starts playing.
+
+Players may also be given signed audio urls (see sign_audio_file). The
+token in such a url names the file, its size and modification time and
+when it expires, signed with SECRET_KEY, so that its range requests are
+served without a session or a database query.
+'''
+import os
+import os.path
+import re
+import time
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import ImproperlyConfigured
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.crypto import get_random_string
+from django.utils.http import http_date, parse_http_date_safe
+
+BACKENDS = ('python', 'file_wrapper', 'x_sendfile', 'x_accel_redirect')
+BLOCK_SIZE = 4096
+# Requests asking for more ranges than this are served the full file.
+MAX_RANGES = 16
+# Compiled at module load time. Matches a single byte-range-spec.
+byte_range_spec_re = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+# Keeps audio tokens from being valid signatures for anything else.
+audio_token_salt = 'music_player.audio'
+
+def parse_byte_ranges(header, size):
+  '''
+  Parses the value of a Range header as described in RFC 7233.
+  Overlapping and adjacent ranges are merged.
+  Args:
+   header - str, the value of the Range header
+   size - int, the size of the file in bytes
+  Return: list(tuple(int, int)), the first and last byte of each
+   satisfiable range. The list is empty if no range can be satisfied.
+   None is returned if the header is malformed and must be ignored.
+  '''
+  unit, _, specs = header.partition('=')
+  if unit.strip().lower() != 'bytes' or not specs:
+    return None
+  ranges = []
+  for spec in specs.split(','):
+    match = byte_range_spec_re.match(spec)
+    if not match:
+      return None
+    first, last = match.groups()
+    # Suffix range: the final N bytes of the file
+    if not first:
+      if not last:
+        return None
+      if int(last) > 0 and size > 0:
+        ranges.append((max(0, size - int(last)), size - 1))
+      continue
+    first = int(first)
+    last = int(last) if last else size - 1
+    if match.group(2) and last < first:
+      return None
+    if first < size:
+      ranges.append((first, min(last, size - 1)))
+  # Merge ranges so that no byte is sent twice
+  ranges.sort()
+  merged = []
+  for first, last in ranges:
+    if merged and first <= merged[-1][1] + 1:
+      merged[-1] = (merged[-1][0], max(last, merged[-1][1]))
+    else:
+      merged.append((first, last))
+  if len(merged) > MAX_RANGES:
+    return None
+  return merged
+
+def make_etag(size, mtime):
+  '''
+  Creates a strong entity tag from a file's size and modification time.
+  Args:
+   size - int, the size of the file in bytes
+   mtime - float, the modification time of the file
+  Return: str, the quoted entity tag.
+  '''
+  return '"{0:x}-{1:x}"'.format(size, int(mtime * 1000000))
+
+def etag_matches(header, etag, weak=False):
+  '''
+  Checks whether an If-None-Match, If-Match or If-Range value contains the
+  given entity tag.
+  Args:
+   header - str, the comma separated list of entity tags
+   etag - str, the current quoted entity tag
+   weak - bool, whether weak comparison is used
+  Return: bool, True if the entity tag is listed.
+  '''
+  for tag in header.split(','):
+    tag = tag.strip()
+    if tag == '*':
+      return True
+    if weak and tag.startswith('W/'):
+      tag = tag[2:]
+    if tag == etag:
+      return True
+  return False
+
+def warm_start_range(size, bitrate=None, audio_offset=None, seconds=None):
+  '''
+  Finds the bytes a player needs to start a song without waiting: the tags
+  before the audio and its first seconds. The length of the range comes
+  from SONIFEROUS_PREFETCH_SECONDS and the bitrate, or is
+  SONIFEROUS_PREFETCH_BYTES if the bitrate is not known.
+  Args:
+   size - int, the size of the file in bytes
+   bitrate - int, the bitrate in bits per second or None
+   audio_offset - int, the bytes before the first audio frame or None
+   seconds - float, the seconds of audio to include instead of the setting
+  Return: tuple(int, int), the first and last byte of the range.
+  '''
+  if seconds is None:
+    seconds = getattr(settings, 'SONIFEROUS_PREFETCH_SECONDS', 10)
+  if bitrate:
+    length = (audio_offset or 0) + int(bitrate * seconds) // 8
+  else:
+    length = getattr(settings, 'SONIFEROUS_PREFETCH_BYTES', 256 * 1024)
+  return 0, max(0, min(length, size) - 1)
+
+def sign_audio_file(name, size, mtime, lifetime=None, now=None):
+  '''
+  Creates the token of a signed audio url. Tokens expire at the end of the
+  lifetime period after the current one, so they stay valid for one to two
+  lifetimes, and the same file gets the same token during a period. The
+  browser can then reuse cached responses for the url.
+  Args:
+   name - str, the name of the file in storage
+   size - int, the size of the file in bytes
+   mtime - float, the modification time of the file
+   lifetime - int, seconds instead of SONIFEROUS_AUDIO_URL_LIFETIME
+   now - float, the current time as a timestamp
+  Return: str, the url safe token.
+  '''
+  if lifetime is None:
+    lifetime = getattr(settings, 'SONIFEROUS_AUDIO_URL_LIFETIME', 6 * 60 * 60)
+  lifetime = max(int(lifetime), 1)
+  if now is None:
+    now = time.time()
+  expires = (int(now) // lifetime + 2) * lifetime
+  return signing.dumps([name, size, mtime, expires], salt=audio_token_salt)
+
+def read_audio_token(token, now=None):
+  '''
+  Checks the signature and expiry of a token from sign_audio_file.
+  Args:
+   token - str, the token
+   now - float, the current time as a timestamp
+  Return: tuple(str, int, float), the name, size and modification time of
+   the file.
+  Raises: signing.BadSignature if the token was not signed with SECRET_KEY
+   or has expired (signing.SignatureExpired).
+  '''
+  name, size, mtime, expires = signing.loads(token, salt=audio_token_salt)
+  if (time.time() if now is None else now) >= expires:
+    raise signing.SignatureExpired('Audio token expired.')
+  return name, size, mtime
+
+def file_range_generator(field_file, block_size, start, stop):
+  '''
+  A generator capable of returning a portion of a fieldfile.
+  Args:
+   field_file - fieldfile, the file to read data from
+   block_size - int, the size of the buffer to serve
+   start - int, the first byte served
+   stop - int, the last byte served
+  Yield: The current chunk of bytes to serve
+  '''
+  field_file.seek(start)
+  remaining = stop - start + 1
+  while remaining > 0:
+    if remaining < block_size:
+      block_size = remaining
+    yield field_file.read(block_size)
+    remaining -= block_size
+
+def get_backend():
+  '''
+  Looks up the configured delivery backend.
+  Return: str, the name of the backend.
+  '''
+  backend = getattr(settings, 'SONIFEROUS_AUDIO_BACKEND', 'python')
+  if backend not in BACKENDS:
+    raise ImproperlyConfigured(\
+     'SONIFEROUS_AUDIO_BACKEND must be one of: ' + ', '.join(BACKENDS))
+  return backend
+
+def multipart_generator(field_file, ranges, size, boundary):
+  '''
+  A generator returning a multipart/byteranges body.
+  Args:
+   field_file - fieldfile, the file to read data from
+   ranges - list(tuple(int, int)), the first and last byte of each part
+   size - int, the size of the file in bytes
+   boundary - str, the multipart boundary
+  Yield: The current chunk of bytes to serve
+  '''
+  for start, stop in ranges:
+    yield multipart_header(start, stop, size, boundary)
+    for chunk in file_range_generator(field_file, BLOCK_SIZE, start, stop):
+      yield chunk
+    yield b'\r\n'
+  yield '--{0}--\r\n'.format(boundary).encode()
+
+def multipart_header(start, stop, size, boundary):
+  '''Creates the headers that precede a part of a multipart/byteranges body.'''
+  return ('--{0}\r\nContent-Type: audio/mpeg\r\n'\
+   'Content-Range: bytes {1}-{2}/{3}\r\n\r\n')\
+   .format(boundary, start, stop, size).encode()
+
+def multipart_length(ranges, size, boundary):
+  '''Calculates the length of a multipart/byteranges body.'''
+  length = len('--{0}--\r\n'.format(boundary))
+  for start, stop in ranges:
+    length += len(multipart_header(start, stop, size, boundary))
+    length += stop - start + 1 + 2
+  return length
+
+def python_response(field_file, ranges, size):
+  '''
+  Streams the file from within the Django worker.
+  Args:
+   field_file - fieldfile, the file to serve
+   ranges - list(tuple(int, int)), the byte ranges to serve or None
+   size - int, the size of the file in bytes
+  Return: StreamingHttpResponse, the response containing the data.
+  '''
+  field_file.open()
+  if not ranges:
+    response = StreamingHttpResponse(\
+     iter(lambda: field_file.read(BLOCK_SIZE), b''))
+    response['Content-Length'] = str(size)
+  elif len(ranges) == 1:
+    start, stop = ranges[0]
+    response = StreamingHttpResponse(\
+     file_range_generator(field_file, BLOCK_SIZE, start, stop), status=206)
+    response['Content-Length'] = str(stop - start + 1)
+    response['Content-Range'] = 'bytes {0}-{1}/{2}'.format(start, stop, size)
+  else:
+    boundary = get_random_string(32)
+    response = StreamingHttpResponse(\
+     multipart_generator(field_file, ranges, size, boundary), status=206,\
+     content_type='multipart/byteranges; boundary=' + boundary)
+    response['Content-Length'] = \
+     str(multipart_length(ranges, size, boundary))
+  return response
+
+def file_wrapper_response(field_file, ranges, size):
+  '''
+  Serves full files through wsgi.file_wrapper so that the WSGI server can
+  use zero-copy transfers. Ranges fall back to the python backend since
+  file wrappers are not required to honor a starting offset.
+  '''
+  if ranges:
+    return python_response(field_file, ranges, size)
+  response = FileResponse(open(field_file.path, 'rb'))
+  response['Content-Length'] = str(size)
+  return response
+
+def x_sendfile_response(field_file, ranges, size):
+  '''
+  Asks the web server to send the file using the X-Sendfile header. The
+  web server handles the Range header of the original request itself.
+  '''
+  response = HttpResponse()
+  response['X-Sendfile'] = field_file.path
+  return response
+
+def x_accel_redirect_response(field_file, ranges, size):
+  '''
+  Asks nginx to send the file from an internal location using the
+  X-Accel-Redirect header. nginx handles the Range header itself.
+  '''
+  prefix = getattr(settings, 'SONIFEROUS_X_ACCEL_PREFIX', '/protected/')
+  response = HttpResponse()
+  response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + \
+   quote(field_file.name.lstrip('/'))
+  return response
+
+_responders = {
+ 'python': python_response,
+ 'file_wrapper': file_wrapper_response,
+ 'x_sendfile': x_sendfile_response,
+ 'x_accel_redirect': x_accel_redirect_response,
+}
+
+def audio_response(field_file, size, ranges=None, backend=None):
+  '''
+  Creates the response used to deliver an audio file with the configured
+  backend. The ranges must already have been validated.
+  Args:
+   field_file - fieldfile, the file to serve
+   size - int, the size of the file in bytes
+   ranges - list(tuple(int, int)), the byte ranges to serve or None
+   backend - str, the backend to use instead of the configured one
+  Return: HttpResponse, the response for the audio file.
+  '''
+  response = _responders[backend or get_backend()](field_file, ranges, size)
+  if not response['Content-Type'].startswith('multipart/'):
+    response['Content-Type'] = 'audio/mpeg'
+  response['Accept-Ranges'] = 'bytes'
+  response['Content-Disposition'] = \
+   'attachment; filename="{}"'.format(os.path.basename(field_file.name))
+  return response
+
+def serve_audio(request, field_file, size=None, mtime=None, backend=None):
+  '''
+  Handles the conditional and range headers of a request for an audio file
+  and creates the appropriate response.
+  Args:
+   request - HttpRequest, the request for the file
+   field_file - fieldfile, the file to serve
+   size - int, the size of the file in bytes. Read from disk if None.
+   mtime - float, the modification time of the file. Read from disk if None.
+   backend - str, the backend to use instead of the configured one
+  Return: HttpResponse, a 200, 206, 304 or 416 response.
+  '''
+  if size is None or mtime is None:
+    stat = os.stat(field_file.path)
+    size, mtime = stat.st_size, stat.st_mtime
+  etag = make_etag(size, mtime)
+  last_modified = http_date(mtime)
+  # Conditional requests (RFC 7232)
+  if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+  if_modified_since = parse_http_date_safe(\
+   request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+  if (if_none_match and etag_matches(if_none_match, etag, weak=True)) or \
+   (not if_none_match and if_modified_since and \
+   int(mtime) <= if_modified_since):
+    response = HttpResponse(status=304)
+    response['ETag'] = etag
+    response['Last-Modified'] = last_modified
+    return response
+  # Range requests (RFC 7233)
+  ranges = None
+  if 'HTTP_RANGE' in request.META:
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range or (etag_matches(if_range, etag) if \
+     if_range.strip().startswith('"') else \
+     parse_http_date_safe(if_range) == int(mtime)):
+      ranges = parse_byte_ranges(request.META['HTTP_RANGE'], size)
+      if ranges == []:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */{0}'.format(size)
+        return response
+  response = audio_response(field_file, size, ranges, backend)
+  response['ETag'] = etag
+  response['Last-Modified'] = last_modified
+  response['Cache-Control'] = 'private, max-age={0:d}'.format(\
+   getattr(settings, 'SONIFEROUS_AUDIO_MAX_AGE', 3600))
+  return response
@@ -0,0 +1,244 @@
+'''
+Caching of the serialized song, album and artist listings.
+
+Every listing is cached under the current catalog version, which the
+handlers in signals.py bump whenever a song, album or artist changes.
+Responses carry an ETag derived from the version so that clients holding
+the current listing receive an empty 304 response.
+
+The version is kept in the database, so that the changes made by other
+worker processes and by the management commands are seen at once. The
+listings themselves are cached under the version in the cache named by
+SONIFEROUS_CATALOG_CACHE, which may be private to each process.
+'''
+import gzip
+import hashlib
+import json
+import re
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+
+from music_player.audio import etag_matches
+from music_player.models import CatalogVersion, Song, compact_list
+
+# The order in which each listing is sent.
+song_order = ('album__artist__artist', 'album__album', 'track_number')
+album_order = ('artist__artist', 'album')
+artist_order = ('artist',)
+accept_encoding_re = re.compile(r'\bgzip\b')
+# Song lookups of the albums and artists in the song index.
+group_lookups = {'album': 'album', 'artist': 'album__artist'}
+# Longer id lists are not used as filters since SQLite limits the number
+# of parameters in a query.
+max_id_filter = 500
+# The song index is cached in this many parts per kind of group, so that
+# the number of cache entries does not grow with the catalog.
+song_index_buckets = 64
+
+def get_cache():
+  '''Return: the cache holding the catalog version and listings.'''
+  return caches[getattr(settings, 'SONIFEROUS_CATALOG_CACHE', 'default')]
+
+def get_version():
+  '''
+  Looks up the current catalog version, creating it if needed.
+  Return: str, the catalog version.
+  '''
+  version = CatalogVersion.objects.filter(pk=1)\
+   .values_list('version', flat=True).first()
+  if version is None:
+    version = CatalogVersion.objects.get_or_create(pk=1,\
+     defaults={'version': uuid.uuid4().hex})[0].version
+  # Listings may now be cached under this version, so the next change
+  # has to move past it.
+  transaction.get_connection().soniferous_catalog_dirty = False
+  return version
+
+def _bump_version():
+  '''
+  Moves the catalog to a new version. Versions are random rather than
+  counted, so a rolled back bump never brings back a version whose
+  listings were cached from the uncommitted changes.
+  '''
+  if not CatalogVersion.objects.filter(pk=1)\
+   .update(version=uuid.uuid4().hex):
+    get_version()
+
+def bump_version():
+  '''
+  Invalidates every cached listing. Outside of a transaction the version
+  is bumped at once. Inside one it is bumped by the first change, so that
+  no listing read before the commit is cached under a committed version,
+  and once more when the transaction commits. Later changes only bump it
+  again if the version was read in between.
+  '''
+  connection = transaction.get_connection()
+  if not connection.in_atomic_block:
+    _bump_version()
+    return
+  # The callback is dropped when the transaction or the savepoint that
+  # registered it is rolled back. It is usually the first one, so the
+  # search stops early.
+  pending = any(func is _bump_version \
+   for sids, func in connection.run_on_commit)
+  if not pending or \
+   not getattr(connection, 'soniferous_catalog_dirty', False):
+    _bump_version()
+    connection.soniferous_catalog_dirty = True
+  if not pending:
+    transaction.on_commit(_bump_version)
+
+def cached_response(request, create_response, variant=''):
+  '''
+  Serves a listing from the cache, creating and caching it if needed.
+  Cached listings are also kept gzip compressed and that copy is sent to
+  clients accepting gzip.
+  Args:
+   request - HttpRequest, the request for the listing
+   create_response - callable, creates the uncached response
+   variant - str, the normalized parameters of the listing. The query
+    string is not part of the key.
+  Return: HttpResponse, the listing or a 304 response.
+  '''
+  path = request.path + ' ' + variant
+  version = get_version()
+  key = 'soniferous:catalog:{0}:{1}'.format(\
+   version, hashlib.md5(path.encode()).hexdigest())
+  etag = '"{0}-{1}"'.format(version, key[-16:])
+  if etag_matches(request.META.get('HTTP_IF_NONE_MATCH', ''), etag, True):
+    response = HttpResponse(status=304)
+  else:
+    cache = get_cache()
+    cached = cache.get(key)
+    if cached is not None:
+      content_type, content, compressed = cached
+      if compressed is not None and \
+       accept_encoding_re.search(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+        response = HttpResponse(compressed, content_type=content_type)
+        response['Content-Encoding'] = 'gzip'
+      else:
+        response = HttpResponse(content, content_type=content_type)
+    else:
+      response = create_response()
+      if response.status_code != 200:
+        return response
+      if response.streaming:
+        response = StreamingHttpResponse(_caching_stream(\
+         response.streaming_content, key, response['Content-Type']),\
+         content_type=response['Content-Type'])
+      else:
+        _store(key, response['Content-Type'], response.content)
+  if response.has_header('Content-Encoding'):
+    # The compressed copy is not byte for byte the same listing.
+    etag = 'W/' + etag
+  response['ETag'] = etag
+  # Listings are private to logged in users and must be revalidated.
+  response['Cache-Control'] = 'private, no-cache'
+  patch_vary_headers(response, ('Accept', 'Accept-Encoding'))
+  return response
+
+def snapshot():
+  '''
+  Serializes the whole catalog for embedding in the player page, in the
+  format of compact_list. The snapshot is cached under the catalog version.
+  Return: str, the json document. '<', '>' and '&' are escaped so that it
+   can be placed inside a script element.
+  '''
+  cache = get_cache()
+  key = 'soniferous:snapshot:{0}'.format(get_version())
+  content = cache.get(key)
+  if content is None:
+    keys, lookups = zip(*Song.json_fields)
+    songs = Song.objects.order_by(*song_order + ('pk',))\
+     .values_list(*lookups).iterator()
+    document = compact_list(dict(zip(keys, row)) for row in songs)
+    content = json.dumps(document, separators=(',', ':'))\
+     .replace('<', '\\u003c').replace('>', '\\u003e')\
+     .replace('&', '\\u0026')
+    cache.set(key, content, _timeout())
+  return content
+
+def song_ids(group, pk):
+  '''
+  Looks up the songs of an album or artist in the song index. The index
+  is built once per catalog version, with a single query over all songs,
+  and cached in buckets of groups so that a lookup only reads the songs of
+  a fraction of the groups.
+  Args:
+   group - str, 'album' or 'artist'
+   pk - int, the primary key of the album or artist
+  Return: list(int), the primary keys of the songs in listing order.
+  '''
+  pk = int(pk)
+  cache = get_cache()
+  version = get_version()
+  key = 'soniferous:songs-of:{0}:{1}:{2}'.format(version, group,\
+   pk % song_index_buckets)
+  bucket = cache.get(key)
+  if bucket is None and \
+   cache.get('soniferous:song-index:{0}'.format(version)) is None:
+    _build_song_index(version)
+    bucket = cache.get(key)
+  if bucket is not None:
+    # Groups without songs are not in the index.
+    return bucket.get(pk, [])
+  # Buckets evicted from the cache are looked up directly.
+  return list(Song.objects.filter(**{group_lookups[group]: pk})\
+   .order_by(*song_order + ('pk',)).values_list('pk', flat=True))
+
+def songs_of(group, pk):
+  '''
+  Finds the songs of an album or artist through the song index.
+  Args:
+   group - str, 'album' or 'artist'
+   pk - int, the primary key of the album or artist
+  Return: queryset, the songs.
+  '''
+  ids = song_ids(group, pk)
+  if len(ids) > max_id_filter:
+    return Song.objects.filter(**{group_lookups[group]: pk})
+  return Song.objects.filter(pk__in=ids)
+
+def _build_song_index(version):
+  '''Caches the song ids of every album and artist.'''
+  buckets = {}
+  for group in group_lookups:
+    for i in range(song_index_buckets):
+      buckets['soniferous:songs-of:{0}:{1}:{2}'.format(version, group, i)]\
+       = {}
+  for pk, album, artist in Song.objects.order_by(*song_order + ('pk',))\
+   .values_list('pk', 'album_id', 'album__artist_id').iterator():
+    for group, group_pk in (('album', album), ('artist', artist)):
+      buckets['soniferous:songs-of:{0}:{1}:{2}'.format(version, group,\
+       group_pk % song_index_buckets)].setdefault(group_pk, []).append(pk)
+  cache = get_cache()
+  cache.set_many(buckets, _timeout())
+  cache.set('soniferous:song-index:{0}'.format(version), True, _timeout())
+
+def _caching_stream(chunks, key, content_type):
+  '''
+  Passes through the chunks of a streamed listing and caches the complete
+  listing once the last chunk has been sent.
+  '''
+  content = []
+  for chunk in chunks:
+    content.append(chunk)
+    yield chunk
+  _store(key, content_type, b''.join(content))
+
+def _store(key, content_type, content):
+  '''Caches a listing along with its compressed copy.'''
+  compressed = None
+  # Compressing small listings gains nothing.
+  if len(content) >= 200:
+    compressed = gzip.compress(content)
+  get_cache().set(key, (content_type, content, compressed), _timeout())
+
+def _timeout():
+  '''Return: int, the number of seconds a listing stays cached.'''
+  return getattr(settings, 'SONIFEROUS_CATALOG_CACHE_TIMEOUT', 24 * 60 * 60)
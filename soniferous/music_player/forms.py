@@ -1,6 +1,74 @@
+import re
+
 from django import forms
 from django.core.exceptions import ValidationError
-from music_player.models import Artist, Album, Song
+from music_player.models import Artist, Album, Song, UploadJob,\
+ format_duration
+
+# Compiled at module load time. Reads "3" from track numbers such as "3/12".
+track_number_re = re.compile(r'(\d+)')
+
+# Song fields filled by read_audio_info.
+audio_info_fields = ('duration', 'bitrate', 'sample_rate', 'audio_offset')
+
+def read_audio_info(mp3_file):
+  '''
+  Reads the properties of the audio stream of an MP3 file.
+  Args: mp3_file - MP3, the file opened with mutagen
+  Return: dict, the duration (ms), bitrate (bits per second), sample_rate
+   and audio_offset (bytes before the first frame).
+  '''
+  return {
+   'duration': int(round(mp3_file.info.length * 1000)),
+   'bitrate': mp3_file.info.bitrate,
+   'sample_rate': mp3_file.info.sample_rate,
+   'audio_offset': mp3_file.info.frame_offset,
+  }
+
+def read_id3_info(file_name):
+  '''
+  Reads the ID3 tags and audio properties of an MP3 file. Missing tags
+  are reported as "Unknown" and a track number of 0.
+  Args: file_name - str, the path of the MP3 file
+  Return: dict, the title, album, artist, track_number, time (M:SS) and
+   the audio properties returned by read_audio_info.
+  Raises: Exception if the file cannot be read as an MP3.
+  '''
+  from mutagen.mp3 import EasyMP3
+  mp3_file = EasyMP3(file_name)
+  info = {
+   'title': 'Unknown',
+   'album': 'Unknown',
+   'artist': 'Unknown',
+   'track_number': 0,
+  }
+  if mp3_file.tags:
+    if 'title' in mp3_file.tags:
+      info['title'] = mp3_file.tags['title'][0]
+    if 'album' in mp3_file.tags:
+      info['album'] = mp3_file.tags['album'][0]
+    if 'artist' in mp3_file.tags:
+      info['artist'] = mp3_file.tags['artist'][0]
+    if 'tracknumber' in mp3_file.tags:
+      str_track = mp3_file.tags['tracknumber'][0]
+      info['track_number'] = int(track_number_re.match(str_track).group(1))
+  info.update(read_audio_info(mp3_file))
+  info['time'] = format_duration(info['duration'])
+  return info
+
+def validate_id3_info(info):
+  '''
+  Raises a validation error if the information retreived from a file
+  does not fit within the model constraints.
+  Args: info - dict, the information returned by read_id3_info
+  '''
+  if len(info['title']) > Song._meta.get_field('title').max_length:
+    raise ValidationError('Invalid MP3. Title field too long.')
+  if len(info['album']) > Album._meta.get_field('album').max_length:
+    raise ValidationError('Invalid MP3. Album field too long.')
+  if len(info['artist']) > Artist._meta.get_field('artist').max_length:
+    raise ValidationError('Invalid MP3. Artist field too long.')
+
 
 class CreateSongForm(forms.ModelForm):
   '''
@@ -17,48 +85,17 @@ class CreateSongForm(forms.ModelForm):
     Raises a validation error if the information retreived from the file
     does not fit within the model constraints.
     '''
-    if len(self.cleaned_data['title']) > \
-     Song._meta.get_field('title').max_length:
-      raise ValidationError('Invalid MP3. Title field too long.')
-    if len(self.cleaned_data['album']) > \
-     Album._meta.get_field('album').max_length:
-      raise ValidationError('Invalid MP3. Album field too long.')
-    if len(self.cleaned_data['artist']) > \
-     Artist._meta.get_field('artist').max_length:
-      raise ValidationError('Invalid MP3. Artist field too long.')
-      
+    validate_id3_info(self.cleaned_data)
 
   def clean(self):
     '''
     Checks to see if the file provided has clean input.
     '''
-    import re
-    from mutagen.mp3 import EasyMP3
-    from math import ceil
     super(CreateSongForm, self).clean()
     # Attempt to read id3 tag info
     try:
-      # Read tags
-      mp3_file = EasyMP3(self.files['music_file'].file.name)
-      self.cleaned_data['title'] = 'Unknown'
-      self.cleaned_data['album'] = 'Unknown'
-      self.cleaned_data['artist'] = 'Unknown'
-      self.cleaned_data['track_number'] = 0
-      if mp3_file.tags:
-        if 'title' in mp3_file.tags:
-          self.cleaned_data['title'] = mp3_file.tags['title'][0]
-        if 'album' in mp3_file.tags:
-          self.cleaned_data['album'] = mp3_file.tags['album'][0]
-        if 'artist' in mp3_file.tags:
-          self.cleaned_data['artist'] = mp3_file.tags['artist'][0]
-        if 'tracknumber' in mp3_file.tags:
-          str_track = mp3_file.tags['tracknumber'][0]
-          self.cleaned_data['track_number'] = \
-           int(re.match(r'(\d+)', str_track).groups(0)[0])
-      # Calculate time string
-      seconds = ceil(mp3_file.info.length)
-      self.cleaned_data['time'] = \
-       '{0:d}:{1:02d}'.format(seconds // 60, seconds % 60)
+      self.cleaned_data.update(\
+       read_id3_info(self.files['music_file'].file.name))
     # Invalid file
     except Exception as ex:
       raise ValidationError(\
@@ -79,6 +116,8 @@ class CreateSongForm(forms.ModelForm):
     self.instance.track_number = self.cleaned_data['track_number']
     self.instance.title = self.cleaned_data['title']
     self.instance.time = self.cleaned_data['time']
+    for field in audio_info_fields:
+      setattr(self.instance, field, self.cleaned_data[field])
     self.instance.full_clean()
     self.instance.save()
     return super(CreateSongForm, self).save(commit=commit)
@@ -119,3 +158,19 @@ class ModifySongForm(forms.ModelForm):
     self.instance.save()
     return super(ModifySongForm, self).save(commit=commit)
 
+
+class UploadJobForm(forms.ModelForm):
+  '''
+  Accepts one or more MP3 files. Their tags are read in the background
+  instead of during the request.
+  '''
+  class Meta:
+    fields = ['music_file',]
+    model = UploadJob
+    widgets = {
+     'music_file': forms.ClearableFileInput(attrs={'multiple': True}),
+    }
+
+  def __init__(self, *args, **kwargs):
+    super(UploadJobForm, self).__init__(*args, **kwargs)
+    self.fields['music_file'].required = True
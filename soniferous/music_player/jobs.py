@@ -0,0 +1,98 @@
+'''
+Background processing of uploaded files.
+
+Uploads are stored as pending UploadJobs and handed to a pool of worker
+threads once the request that created them commits. A worker reads the
+tags of the file and adds it to the catalog as a Song. Jobs left pending
+by a restart can be processed with the process_uploads command.
+The number of threads is set with SONIFEROUS_UPLOAD_WORKERS.
+'''
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files import File
+from django.db import connection, transaction
+
+from music_player.forms import audio_info_fields
+from music_player.library import extract_info
+from music_player.models import Song, UploadJob, create_song
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+  '''Return: ThreadPoolExecutor, the pool processing upload jobs.'''
+  global _executor
+  with _executor_lock:
+    if _executor is None:
+      _executor = ThreadPoolExecutor(\
+       max_workers=getattr(settings, 'SONIFEROUS_UPLOAD_WORKERS', 2))
+    return _executor
+
+def submit_job(pk):
+  '''
+  Queues a job for processing once the current transaction commits.
+  Args: pk - int, the primary key of the UploadJob
+  '''
+  transaction.on_commit(lambda: get_executor().submit(run_job, pk))
+
+def run_job(pk):
+  '''Processes a job from a worker thread.'''
+  try:
+    process_job(pk)
+  finally:
+    # Worker threads have their own connections that are never recycled
+    # by the request cycle.
+    connection.close()
+
+def process_job(pk):
+  '''
+  Reads the tags of an uploaded file and adds it to the catalog. Jobs that
+  are not pending, e.g. claimed by another worker, are skipped.
+  Args: pk - int, the primary key of the UploadJob
+  Return: bool, True if the job was processed.
+  '''
+  claimed = UploadJob.objects.filter(pk=pk, status=UploadJob.PENDING)\
+   .update(status=UploadJob.PROCESSING)
+  if not claimed:
+    return False
+  job = UploadJob.objects.get(pk=pk)
+  path, info, error = extract_info(job.music_file.path)
+  if not error:
+    field = Song._meta.get_field('music_file')
+    name = None
+    try:
+      # Stored outside the transaction so that a failure can remove it.
+      with open(path, 'rb') as file_:
+        name = field.storage.save(\
+         field.generate_filename(None, job.file_name), File(file_))
+      with transaction.atomic():
+        job.song = create_song(info['title'], info['time'],\
+         info['track_number'], info['album'], info['artist'], name,\
+         file_hash=info['file_hash'],\
+         **{key: info[key] for key in audio_info_fields})
+        job.status = UploadJob.DONE
+        job.error = ''
+        job.save()
+    except Exception as ex:
+      error = 'The song could not be added: {0}'.format(ex)
+      if name:
+        field.storage.delete(name)
+    else:
+      job.music_file.delete()
+      return True
+  job.song = None
+  job.status = UploadJob.FAILED
+  job.error = error
+  job.save()
+  return True
+
+def process_pending():
+  '''
+  Processes every pending job in the current thread.
+  Return: int, the number of jobs processed.
+  '''
+  pks = UploadJob.objects.filter(status=UploadJob.PENDING)\
+   .order_by('pk').values_list('pk', flat=True)
+  return sum(process_job(pk) for pk in list(pks))
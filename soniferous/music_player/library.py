@@ -0,0 +1,276 @@
+'''
+Bulk operations on the music library used by the management commands.
+'''
+import os
+import os.path
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.db import connection, transaction
+
+from music_player import catalog, search
+from music_player.forms import read_id3_info, validate_id3_info,\
+ audio_info_fields
+from music_player.models import Song, Album, Artist, file_fingerprint
+from music_player.signals import clean_albums
+
+music_extensions = ('.mp3',)
+
+def find_music_files(directory):
+  '''
+  Walks a directory tree looking for music files.
+  Args: directory - str, the directory to search
+  Yield: str, the path of each music file found, in sorted order
+  '''
+  for root, dirs, files in os.walk(directory):
+    dirs.sort()
+    for name in sorted(files):
+      if name.lower().endswith(music_extensions):
+        yield os.path.join(root, name)
+
+def extract_info(path, previous_hash=None, tags=True):
+  '''
+  Reads the fingerprint and validated tags of a music file. Meant to be
+  run in a worker process.
+  Args:
+   path - str, the path of the music file
+   previous_hash - str, the known content hash. Tags are not read if the
+    content has not changed.
+   tags - bool, False to only read the fingerprint
+  Return: tuple(str, dict, str), the path, the information returned by
+   read_id3_info plus file_size, file_mtime and file_hash, and an error
+   message. Either the information or the error message is None.
+  '''
+  try:
+    size, mtime, digest = file_fingerprint(path)
+  except OSError:
+    return path, None, 'The file could not be read.'
+  fingerprint = {'file_size': size, 'file_mtime': mtime, 'file_hash': digest}
+  if previous_hash == digest or not tags:
+    return path, fingerprint, None
+  try:
+    info = read_id3_info(path)
+  except Exception:
+    return path, None, 'The file does not appear to be an MP3.'
+  try:
+    validate_id3_info(info)
+  except ValidationError as ex:
+    return path, None, ' '.join(ex.messages)
+  info.update(fingerprint)
+  return path, info, None
+
+def _extract_changed_info(args):
+  '''Unpacks the arguments of extract_info for Executor.map.'''
+  return extract_info(*args)
+
+
+class CatalogResolver(object):
+  '''
+  Maps artist and album names to primary keys in memory, creating the
+  missing ones in bulk.
+  '''
+  def __init__(self):
+    self.artists = dict(Artist.objects.values_list('artist', 'pk'))
+    self.albums = {(artist, album): pk for album, artist, pk in \
+     Album.objects.values_list('album', 'artist', 'pk')}
+
+  def resolve(self, infos):
+    '''
+    Makes sure that the artists and albums of the given songs exist.
+    Args: infos - list(dict), the information of each song
+    Return: list(int), the album primary key of each song.
+    '''
+    new_artists = {info['artist'] for info in infos} - set(self.artists)
+    if new_artists:
+      Artist.objects.bulk_create(\
+       [Artist(artist=artist) for artist in sorted(new_artists)])
+      self.artists.update(Artist.objects.filter(artist__in=new_artists)\
+       .values_list('artist', 'pk'))
+    keys = [(self.artists[info['artist']], info['album']) for info in infos]
+    new_albums = set(keys) - set(self.albums)
+    if new_albums:
+      Album.objects.bulk_create([Album(artist_id=artist, album=album) \
+       for artist, album in sorted(new_albums)])
+      artist_ids = {artist for artist, album in new_albums}
+      for album, artist, pk in Album.objects.filter(artist__in=artist_ids)\
+       .values_list('album', 'artist', 'pk'):
+        self.albums[(artist, album)] = pk
+    return [self.albums[key] for key in keys]
+
+
+def store_file(path, info):
+  '''
+  Copies a music file into the storage used for uploaded songs and
+  records the modification time of the copy in its information.
+  Args:
+   path - str, the path of the music file
+   info - dict, the information returned by extract_info
+  Return: str, the name of the stored file.
+  '''
+  field = Song._meta.get_field('music_file')
+  with open(path, 'rb') as file_:
+    name = field.storage.save(\
+     field.generate_filename(None, os.path.basename(path)), File(file_))
+  info['file_mtime'] = os.stat(field.storage.path(name)).st_mtime
+  return name
+
+def create_songs(resolver, songs):
+  '''
+  Inserts a batch of songs in a single transaction.
+  Args:
+   resolver - CatalogResolver, maps names to artists and albums
+   songs - list(tuple(dict, str)), the information and stored file name
+    of each song
+  '''
+  with transaction.atomic():
+    album_ids = resolver.resolve([info for info, name in songs])
+    Song.objects.bulk_create([Song(\
+     title=info['title'],\
+     track_number=info['track_number'],\
+     album_id=album_id,\
+     time=info['time'],\
+     music_file=name,\
+     file_size=info['file_size'],\
+     file_mtime=info['file_mtime'],\
+     file_hash=info['file_hash'],\
+     **{field: info[field] for field in audio_info_fields}\
+    ) for (info, name), album_id in zip(songs, album_ids)])
+
+def store_songs(resolver, songs):
+  '''
+  Copies a batch of music files into storage and inserts their songs. The
+  copies are deleted again if the batch fails, so that no file is left in
+  storage without a song.
+  Args:
+   resolver - CatalogResolver, maps names to artists and albums
+   songs - list(tuple(str, dict)), the path and information of each song
+  '''
+  storage = Song._meta.get_field('music_file').storage
+  stored = []
+  try:
+    for path, info in songs:
+      stored.append((info, store_file(path, info)))
+    create_songs(resolver, stored)
+  except Exception:
+    for info, name in stored:
+      storage.delete(name)
+    raise
+
+def _apply_changes(resolver, known, results, counts, updated_albums,\
+ location, errors):
+  '''
+  Records a batch of rescanned files in a single transaction.
+  Args:
+   resolver - CatalogResolver, maps names to artists and albums
+   known - dict, the primary key and album of the song of each known path
+   results - list(tuple), the results of extract_info
+   counts - dict, the counts returned by rescan, updated in place
+   updated_albums - set(int), the albums that may have lost songs,
+    updated in place
+   location - str, the root directory of the storage
+   errors - callable, called with the path and message of unreadable files
+  '''
+  new_songs = []
+  with transaction.atomic():
+    for path, info, error in results:
+      if error:
+        counts['failed'] += 1
+        if errors:
+          errors(path, error)
+      elif os.path.normpath(path) not in known:
+        counts['added'] += 1
+        new_songs.append((info, os.path.relpath(path, location)))
+      elif 'title' not in info:
+        counts['touched'] += 1
+        Song.objects.filter(pk=known[os.path.normpath(path)][0])\
+         .update(**info)
+      else:
+        counts['updated'] += 1
+        pk, album_id = known[os.path.normpath(path)]
+        info['album_id'] = resolver.resolve([info])[0]
+        updated_albums.add(album_id)
+        del info['album'], info['artist']
+        Song.objects.filter(pk=pk).update(**info)
+    if new_songs:
+      create_songs(resolver, new_songs)
+
+def finish_bulk_changes():
+  '''
+  Brings the search index, catalog version and the statistics of the
+  query planner up to date after changes made without model signals,
+  such as bulk_create.
+  '''
+  if search.fts_enabled():
+    search.rebuild_index()
+  catalog.bump_version()
+  # Without statistics SQLite may sort the listings instead of reading
+  # them in order from the indexes.
+  with connection.cursor() as cursor:
+    cursor.execute('ANALYZE')
+
+def rescan(workers=None, chunksize=16, errors=None, batch_size=500):
+  '''
+  Brings the library in line with the files in storage. Only files whose
+  size or modification time changed, or that were never hashed, are
+  hashed, and tags are only read again when the hash changed too. Files
+  added to the music directory are imported in place and songs whose file
+  disappeared are deleted. Changes are committed in batches as the
+  workers return them.
+  Args:
+   workers - int, the number of processes reading files
+   chunksize - int, the number of files sent to a process at once
+   errors - callable, called with the path and message of unreadable files
+   batch_size - int, the number of files handled in each transaction
+  Return: dict, the number of unchanged, touched (only the fingerprint
+   changed), updated, added, removed and failed files.
+  '''
+  field = Song._meta.get_field('music_file')
+  storage = field.storage
+  counts = dict.fromkeys(\
+   ('unchanged', 'touched', 'updated', 'added', 'removed', 'failed'), 0)
+  known = {}
+  changed = []
+  removed = []
+  for pk, name, size, mtime, digest, album_id in Song.objects.values_list(\
+   'pk', 'music_file', 'file_size', 'file_mtime', 'file_hash', 'album')\
+   .iterator():
+    path = os.path.normpath(storage.path(name))
+    known[path] = (pk, album_id)
+    try:
+      stat = os.stat(path)
+    except OSError:
+      removed.append(pk)
+      continue
+    if stat.st_size == size and stat.st_mtime == mtime:
+      if digest:
+        counts['unchanged'] += 1
+      else:
+        # Songs added through the admin are hashed here.
+        changed.append((path, None, False))
+    else:
+      changed.append((path, digest or None))
+  music_dir = storage.path(field.upload_to)
+  if os.path.isdir(music_dir):
+    changed.extend((path, None) for path in find_music_files(music_dir) \
+     if os.path.normpath(path) not in known)
+  resolver = CatalogResolver()
+  updated_albums = set()
+  with ProcessPoolExecutor(max_workers=workers) as pool:
+    results = pool.map(_extract_changed_info, changed, chunksize=chunksize)
+    batch = []
+    for result in results:
+      batch.append(result)
+      if len(batch) >= batch_size:
+        _apply_changes(resolver, known, batch, counts, updated_albums,\
+         storage.location, errors)
+        batch = []
+    _apply_changes(resolver, known, batch, counts, updated_albums,\
+     storage.location, errors)
+  with transaction.atomic():
+    clean_albums(sorted(updated_albums))
+  for i in range(0, len(removed), 500):
+    Song.objects.filter(pk__in=removed[i:i + 500]).delete()
+  counts['removed'] = len(removed)
+  finish_bulk_changes()
+  return counts
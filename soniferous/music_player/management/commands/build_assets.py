@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from music_player import assets
+
+class Command(BaseCommand):
+  '''
+  Builds the hashed and compressed script and style sheet bundles used by
+  the templates. Run it after collectstatic.
+  '''
+  help = 'Concatenates, minifies and compresses the static bundles.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--output',\
+     help='Directory to write to. Defaults to the bundle directory in '\
+     'STATIC_ROOT.')
+
+  def handle(self, *args, **options):
+    try:
+      manifest = assets.build(options['output'])
+    except IOError as ex:
+      raise CommandError(str(ex))
+    for name, file_name in sorted(manifest.items()):
+      self.stdout.write('{0}: {1}'.format(name, file_name))
+    if assets.brotli is None:
+      self.stdout.write('Install the brotli module to create .br copies.')
@@ -0,0 +1,80 @@
+import os
+import os.path
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from music_player import library
+
+class Command(BaseCommand):
+  '''
+  Imports every MP3 found under a directory. Tags are read in a pool of
+  worker processes and songs are inserted in batches. Imported files are
+  listed in a state file so that an interrupted import can be resumed by
+  running the same command again.
+  '''
+  help = 'Imports all MP3 files found under a directory.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('directory')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),\
+     help='Number of processes reading tags.')
+    parser.add_argument('--batch-size', type=int, default=500,\
+     help='Number of songs inserted per transaction.')
+    parser.add_argument('--state-file',\
+     help='File listing imported files. Defaults to '\
+     '.soniferous-import inside the directory.')
+
+  def handle(self, *args, **options):
+    directory = options['directory']
+    if not os.path.isdir(directory):
+      raise CommandError('{0} is not a directory.'.format(directory))
+    state_file = options['state_file'] or \
+     os.path.join(directory, '.soniferous-import')
+    done = set()
+    if os.path.exists(state_file):
+      with open(state_file) as file_:
+        done = set(line.rstrip('\n') for line in file_)
+    paths = [path for path in library.find_music_files(directory)\
+     if path not in done]
+    self.stdout.write('{0} files to import, {1} already imported.'\
+     .format(len(paths), len(done)))
+    resolver = library.CatalogResolver()
+    imported = failed = 0
+    start = time.time()
+    batch = []
+    with ProcessPoolExecutor(max_workers=options['workers']) as pool, \
+     open(state_file, 'a') as state:
+      for path, info, error in \
+       pool.map(library.extract_info, paths, chunksize=16):
+        if error:
+          failed += 1
+          self.stderr.write('{0}: {1}'.format(path, error))
+          continue
+        batch.append((path, info))
+        if len(batch) >= options['batch_size']:
+          imported += self.import_batch(resolver, batch, state)
+          self.report(imported, failed, start)
+          batch = []
+      if batch:
+        imported += self.import_batch(resolver, batch, state)
+    library.finish_bulk_changes()
+    self.report(imported, failed, start)
+
+  def import_batch(self, resolver, batch, state):
+    '''
+    Stores and inserts a batch of songs, then records them as imported.
+    Return: int, the number of songs imported.
+    '''
+    library.store_songs(resolver, batch)
+    for path, info in batch:
+      state.write(path + '\n')
+    state.flush()
+    return len(batch)
+
+  def report(self, imported, failed, start):
+    '''Writes the progress and throughput of the import.'''
+    elapsed = max(time.time() - start, 0.001)
+    self.stdout.write('{0} imported, {1} failed, {2:.1f} files/sec'\
+     .format(imported, failed, (imported + failed) / elapsed))
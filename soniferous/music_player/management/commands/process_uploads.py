@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from music_player import jobs
+from music_player.models import UploadJob
+
+class Command(BaseCommand):
+  '''
+  Processes the upload jobs still pending, e.g. after the server was
+  restarted before its workers finished.
+  '''
+  help = 'Processes pending uploads.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--requeue', action='store_true',\
+     help='Also process jobs interrupted while processing.')
+
+  def handle(self, *args, **options):
+    if options['requeue']:
+      UploadJob.objects.filter(status=UploadJob.PROCESSING)\
+       .update(status=UploadJob.PENDING)
+    self.stdout.write('{0} uploads processed.'.format(jobs.process_pending()))
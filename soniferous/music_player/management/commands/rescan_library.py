@@ -0,0 +1,28 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from music_player import library
+
+class Command(BaseCommand):
+  '''
+  Synchronizes the library with the music files in storage. Tags are only
+  read again for files whose fingerprint changed, new files are added and
+  songs whose file is gone are deleted.
+  '''
+  help = 'Rescans the stored music files for changes.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),\
+     help='Number of processes reading changed files.')
+    parser.add_argument('--batch-size', type=int, default=500,\
+     help='Number of files updated per transaction.')
+
+  def handle(self, *args, **options):
+    counts = library.rescan(workers=options['workers'],\
+     batch_size=options['batch_size'],\
+     errors=lambda path, error: self.stderr.write(\
+     '{0}: {1}'.format(path, error)))
+    self.stdout.write(', '.join('{0} {1}'.format(counts[key], key) \
+     for key in ('unchanged', 'touched', 'updated', 'added', 'removed',\
+     'failed')))
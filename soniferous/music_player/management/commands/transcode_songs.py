@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from music_player import transcode
+from music_player.models import Song
+
+class Command(BaseCommand):
+  '''
+  Fills the transcode cache ahead of time so that listeners asking for a
+  lower bitrate are served finished copies.
+  '''
+  help = 'Pre-generates lower bitrate copies of songs.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('songs', nargs='*', type=int,\
+     help='Primary keys of the songs. Defaults to the newest songs.')
+    parser.add_argument('--bitrate', type=int, action='append',\
+     help='Bitrate to generate. May be repeated. Defaults to all.')
+    parser.add_argument('--limit', type=int, default=100,\
+     help='Number of newest songs used when none are given.')
+
+  def handle(self, *args, **options):
+    bitrates = options['bitrate'] or transcode.get_bitrates()
+    for bitrate in bitrates:
+      if bitrate not in transcode.get_bitrates():
+        raise CommandError('{0} is not an allowed bitrate.'.format(bitrate))
+    if options['songs']:
+      songs = Song.objects.filter(pk__in=options['songs'])
+    else:
+      songs = Song.objects.order_by('-pk')[:options['limit']]
+    created = 0
+    for song in songs:
+      for bitrate in bitrates:
+        if transcode.prepare(song, bitrate):
+          created += 1
+    self.stdout.write('{0} copies created.'.format(created))
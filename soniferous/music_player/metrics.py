@@ -0,0 +1,205 @@
+'''
+Request metrics in the Prometheus text format.
+
+MetricsMiddleware records, for every url name (songs, albums, artists,
+audio, ...), a histogram of the request latency, the number and time of
+database queries and the bytes of the responses. Audio requests, signed
+or not, are also counted by the shape of their Range header. The metrics
+are served to staff at /metrics.
+
+Metrics are kept in the memory of each worker process, so every process
+reports its own counts. Requests slower than SONIFEROUS_SLOW_REQUEST_SECONDS
+are logged to the music_player.metrics logger along with their SQL.
+Responses handed to the web server with X-Sendfile or X-Accel-Redirect
+count as the bytes sent by Django only.
+'''
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.utils.deprecation import MiddlewareMixin
+
+logger = logging.getLogger(__name__)
+
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Registry(object):
+  '''The metrics recorded by one process.'''
+  def __init__(self, buckets=None):
+    self.lock = threading.Lock()
+    self.buckets = tuple(buckets or getattr(settings,\
+     'SONIFEROUS_METRICS_BUCKETS', default_buckets))
+    self.reset()
+
+  def reset(self):
+    '''Forgets all recorded metrics.'''
+    with self.lock:
+      # { view: [count per bucket..., count of all] }
+      self.durations = defaultdict(lambda: [0] * (len(self.buckets) + 1))
+      self.duration_sums = defaultdict(float)
+      self.requests = defaultdict(int)
+      self.queries = defaultdict(int)
+      self.query_seconds = defaultdict(float)
+      self.response_bytes = defaultdict(int)
+      self.audio_ranges = defaultdict(int)
+
+  def record(self, view, status, duration, queries, query_seconds,\
+   response_bytes, range_kind=None):
+    '''
+    Adds a finished request to the metrics.
+    Args:
+     view - str, the url name of the request
+     status - int, the response status code
+     duration - float, the seconds spent handling the request
+     queries - int, the number of database queries
+     query_seconds - float, the seconds spent in the database
+     response_bytes - int, the length of the response body
+     range_kind - str, the shape of the Range header of audio requests
+    '''
+    with self.lock:
+      counts = self.durations[view]
+      for i, bound in enumerate(self.buckets):
+        if duration <= bound:
+          counts[i] += 1
+      counts[-1] += 1
+      self.duration_sums[view] += duration
+      self.requests[(view, status)] += 1
+      self.queries[view] += queries
+      self.query_seconds[view] += query_seconds
+      self.response_bytes[view] += response_bytes
+      if range_kind is not None:
+        self.audio_ranges[(range_kind, status)] += 1
+
+  def render(self):
+    '''Return: str, the metrics in the Prometheus text format.'''
+    lines = []
+    with self.lock:
+      lines += [
+       '# HELP soniferous_request_duration_seconds Time spent handling '\
+        'requests.',
+       '# TYPE soniferous_request_duration_seconds histogram']
+      for view, counts in sorted(self.durations.items()):
+        for bound, count in zip(self.buckets, counts):
+          lines.append('soniferous_request_duration_seconds_bucket'\
+           '{{view="{0}",le="{1}"}} {2}'.format(view, bound, count))
+        lines.append('soniferous_request_duration_seconds_bucket'\
+         '{{view="{0}",le="+Inf"}} {1}'.format(view, counts[-1]))
+        lines.append('soniferous_request_duration_seconds_sum'\
+         '{{view="{0}"}} {1}'.format(view, self.duration_sums[view]))
+        lines.append('soniferous_request_duration_seconds_count'\
+         '{{view="{0}"}} {1}'.format(view, counts[-1]))
+      lines += [
+       '# HELP soniferous_requests_total Requests by response status.',
+       '# TYPE soniferous_requests_total counter']
+      for (view, status), count in sorted(self.requests.items()):
+        lines.append('soniferous_requests_total{{view="{0}",status="{1}"}}'\
+         ' {2}'.format(view, status, count))
+      for name, kind, help_text, values in (\
+       ('soniferous_db_queries_total', 'counter',\
+        'Database queries run by requests.', self.queries),\
+       ('soniferous_db_query_seconds_total', 'counter',\
+        'Time spent in database queries.', self.query_seconds),\
+       ('soniferous_response_bytes_total', 'counter',\
+        'Bytes of response bodies sent by Django.', self.response_bytes)):
+        lines += ['# HELP {0} {1}'.format(name, help_text),\
+         '# TYPE {0} {1}'.format(name, kind)]
+        for view, value in sorted(values.items()):
+          lines.append('{0}{{view="{1}"}} {2}'.format(name, view, value))
+      lines += [
+       '# HELP soniferous_audio_range_requests_total Audio requests by the '\
+        'shape of their Range header.',
+       '# TYPE soniferous_audio_range_requests_total counter']
+      for (kind, status), count in sorted(self.audio_ranges.items()):
+        lines.append('soniferous_audio_range_requests_total'\
+         '{{range="{0}",status="{1}"}} {2}'.format(kind, status, count))
+    return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+def range_kind(header):
+  '''
+  Classifies the Range header of an audio request.
+  Args: header - str, the Range header or None
+  Return: str, 'none', 'start' (bytes=0-), 'seek' (bytes=N-), 'bounded'
+   (bytes=N-M), 'suffix' (bytes=-N), 'multiple' or 'invalid'.
+  '''
+  if header is None:
+    return 'none'
+  unit, sep, specs = header.partition('=')
+  if unit.strip() != 'bytes' or not sep:
+    return 'invalid'
+  if ',' in specs:
+    return 'multiple'
+  first, dash, last = specs.strip().partition('-')
+  if not dash:
+    return 'invalid'
+  if not first:
+    return 'suffix'
+  if last:
+    return 'bounded'
+  return 'start' if first.strip() == '0' else 'seek'
+
+
+class MetricsMiddleware(MiddlewareMixin):
+  '''
+  Records the metrics of every request. Add
+  'music_player.metrics.MetricsMiddleware' near the top of
+  MIDDLEWARE_CLASSES to turn it on. Queries are only logged by Django
+  while a request is being measured.
+  '''
+  def process_request(self, request):
+    request._metrics_start = time.time()
+    request._metrics_debug_cursor = connection.force_debug_cursor
+    connection.force_debug_cursor = True
+    connection.queries_log.clear()
+
+  def process_response(self, request, response):
+    if not hasattr(request, '_metrics_start'):
+      return response
+    match = getattr(request, 'resolver_match', None)
+    view = match.url_name if match and match.url_name else 'other'
+    kind = None
+    if view in ('audio', 'signed-audio'):
+      kind = range_kind(request.META.get('HTTP_RANGE'))
+    if response.streaming and \
+     getattr(response, 'file_to_stream', None) is None:
+      # Streamed bodies are measured once they have been sent.
+      response.streaming_content = self.measure_stream(request, response,\
+       response.streaming_content, view, kind)
+    else:
+      if response.streaming:
+        length = int(response.get('Content-Length', 0))
+      else:
+        length = len(response.content)
+      self.finish(request, response, view, kind, length)
+    return response
+
+  def measure_stream(self, request, response, chunks, view, kind):
+    '''Passes a streamed body through, counting its bytes.'''
+    length = 0
+    try:
+      for chunk in chunks:
+        length += len(chunk)
+        yield chunk
+    finally:
+      self.finish(request, response, view, kind, length)
+
+  def finish(self, request, response, view, kind, length):
+    '''Records a request and logs it if it was slow.'''
+    duration = time.time() - request._metrics_start
+    queries = list(connection.queries_log)
+    connection.force_debug_cursor = request._metrics_debug_cursor
+    query_seconds = sum(float(query['time']) for query in queries)
+    registry.record(view, response.status_code, duration, len(queries),\
+     query_seconds, length, kind)
+    slow = getattr(settings, 'SONIFEROUS_SLOW_REQUEST_SECONDS', None)
+    if slow is not None and duration >= slow:
+      logger.warning('Slow request %s %s took %.3fs with %d queries '\
+       '(%.3fs):\n%s', request.method, request.get_full_path(), duration,\
+       len(queries), query_seconds,\
+       '\n'.join(query['sql'] for query in queries))
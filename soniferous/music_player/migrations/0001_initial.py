@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-18 12:21
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Album',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('album', models.CharField(db_index=True, max_length=128)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Artist',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('artist', models.CharField(db_index=True, max_length=128, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Song',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(db_index=True, max_length=128)),
+                ('track_number', models.IntegerField(db_index=True)),
+                ('time', models.CharField(max_length=16)),
+                ('music_file', models.FileField(upload_to='uploaded_music')),
+                ('album', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='music_player.Album')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='artist',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='music_player.Artist'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='album',
+            unique_together=set([('album', 'artist')]),
+        ),
+    ]
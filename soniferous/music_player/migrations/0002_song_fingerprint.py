@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-18 12:21
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_player', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='song',
+            name='file_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='file_mtime',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='file_size',
+            field=models.BigIntegerField(editable=False, null=True),
+        ),
+    ]
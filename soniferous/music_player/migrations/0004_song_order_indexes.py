@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-18 12:35
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_player', '0003_uploadjob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='album',
+            name='artist',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='music_player.Artist'),
+        ),
+        migrations.AlterField(
+            model_name='song',
+            name='album',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='music_player.Album'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='album',
+            unique_together=set([('artist', 'album')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='song',
+            index_together=set([('album', 'track_number')]),
+        ),
+        # Gives the query planner the statistics it needs to use the new
+        # indexes for the listings.
+        migrations.RunSQL(['ANALYZE'], migrations.RunSQL.noop),
+    ]
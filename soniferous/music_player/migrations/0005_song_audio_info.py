@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-18 12:42
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_player', '0004_song_order_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='song',
+            name='audio_offset',
+            field=models.IntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='bitrate',
+            field=models.IntegerField(editable=False, help_text='Bits per second', null=True),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='duration',
+            field=models.IntegerField(editable=False, help_text='Milliseconds', null=True),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='sample_rate',
+            field=models.IntegerField(editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+
+from django.db import migrations, transaction
+
+# Songs read and saved per transaction.
+batch_size = 200
+
+
+def backfill_audio_info(apps, schema_editor):
+    '''
+    Reads the audio properties of the songs added before they were stored.
+    Each batch is committed on its own, so an interrupted migration keeps
+    its progress. Songs whose file cannot be read are left empty.
+    '''
+    from mutagen.mp3 import MP3
+    from music_player.forms import read_audio_info
+    Song = apps.get_model('music_player', 'Song')
+    db_alias = schema_editor.connection.alias
+    songs = Song.objects.using(db_alias).filter(duration__isnull=True)
+    last_pk = 0
+    while True:
+        batch = list(songs.filter(pk__gt=last_pk).order_by('pk')
+                     .only('pk', 'music_file', 'file_size', 'file_mtime')
+                     [:batch_size])
+        if not batch:
+            break
+        last_pk = batch[-1].pk
+        with transaction.atomic(using=db_alias):
+            for song in batch:
+                try:
+                    path = song.music_file.path
+                    info = read_audio_info(MP3(path))
+                    if song.file_size is None or song.file_mtime is None:
+                        stat = os.stat(path)
+                        info['file_size'] = stat.st_size
+                        info['file_mtime'] = stat.st_mtime
+                except Exception:
+                    continue
+                Song.objects.using(db_alias).filter(pk=song.pk).update(**info)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('music_player', '0005_song_audio_info'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_audio_info, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import DatabaseError, migrations, transaction
+
+FTS_TABLE = 'music_player_song_fts'
+
+
+def create_search_index(apps, schema_editor):
+    '''
+    Creates the FTS5 table of music_player.search and fills it from the
+    songs. Databases other than SQLite, and SQLite builds without FTS5,
+    fall back to substring matching and get no table.
+    '''
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    Song = apps.get_model('music_player', 'Song')
+    Album = apps.get_model('music_player', 'Album')
+    Artist = apps.get_model('music_player', 'Artist')
+    with connection.cursor() as cursor:
+        try:
+            with transaction.atomic(using=connection.alias):
+                cursor.execute(
+                    'CREATE VIRTUAL TABLE {0} USING fts5(title, album, '
+                    'artist, tokenize = "unicode61 remove_diacritics 1", '
+                    'prefix = \'2 3\')'.format(FTS_TABLE))
+        except DatabaseError:
+            # SQLite was built without FTS5. Searches then fall back to
+            # substring matching.
+            return
+        cursor.execute(
+            'INSERT INTO {0} (rowid, title, album, artist) '
+            'SELECT s.id, s.title, al.album, ar.artist '
+            'FROM {1} s JOIN {2} al ON s.album_id = al.id '
+            'JOIN {3} ar ON al.artist_id = ar.id'.format(
+                FTS_TABLE, Song._meta.db_table, Album._meta.db_table,
+                Artist._meta.db_table))
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS {0}'.format(FTS_TABLE))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_player', '0008_catalog_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-18 13:06
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def set_queue_owners(apps, schema_editor):
+    '''
+    Marks the play queue of each user. Of the queues created twice by
+    concurrent requests, the one updated last is kept.
+    '''
+    Playlist = apps.get_model('music_player', 'Playlist')
+    db_alias = schema_editor.connection.alias
+    queues = Playlist.objects.using(db_alias).filter(is_queue=True)
+    kept = set()
+    for pk, owner in queues.order_by('owner', '-updated', '-pk')\
+     .values_list('pk', 'owner'):
+        if owner in kept:
+            Playlist.objects.using(db_alias).filter(pk=pk).delete()
+        else:
+            kept.add(owner)
+            Playlist.objects.using(db_alias).filter(pk=pk)\
+             .update(queue_owner=owner)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('music_player', '0009_song_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='playlist',
+            name='queue_owner',
+            field=models.OneToOneField(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(set_queue_owners, migrations.RunPython.noop),
+    ]
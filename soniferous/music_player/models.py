@@ -1,8 +1,15 @@
+import hashlib
+import json
+import os
+
+from django.conf import settings
 from django.db import models
 
 class Artist(models.Model):
   '''Represents a musical artist'''
   artist = models.CharField(max_length=128, unique=True, db_index=True)
+  # (json key, lookup) pairs matching json_format, used by json_stream.
+  json_fields = (('id', 'pk'), ('artist', 'artist'))
   def __str__(self):
     return str(self.pk) + ' - ' + self.artist
   def json_format(self):
@@ -17,11 +24,21 @@ class Artist(models.Model):
 class Album(models.Model):
   '''Represents an album that belongs to an artist '''
   album = models.CharField(max_length=128, db_index=True)
-  artist = models.ForeignKey(Artist, db_index=True, null=False)
+  # Indexed by the unique index of Meta.unique_together.
+  artist = models.ForeignKey(Artist, db_index=False, null=False)
+  json_fields = (
+   ('id', 'pk'),
+   ('album', 'album'),
+   ('artist_id', 'artist_id'),
+   ('artist', 'artist__artist'),
+  )
   def __str__(self):
     return ' - '.join((str(self.pk), self.album, self.artist.artist))
   class Meta:
-    unique_together = ('album', 'artist')
+    # The artist comes first so that albums can be read in album_order
+    # from the index, and as the index is unique, the songs of each album
+    # can follow in song_order without sorting.
+    unique_together = ('artist', 'album')
   def json_format(self):
     '''
     Converts the Album to a dictionary that includes important information.
@@ -42,9 +59,37 @@ class Song(models.Model):
   '''Represents a song's info and its file.'''
   title = models.CharField(max_length=128, db_index=True)
   track_number = models.IntegerField(db_index=True)
-  album = models.ForeignKey(Album, db_index=True, null=False)
+  # Indexed by the index of Meta.index_together.
+  album = models.ForeignKey(Album, db_index=False, null=False)
+  # Display form of duration, M:SS rounded up.
   time = models.CharField(max_length=16)
   music_file = models.FileField(upload_to='uploaded_music')
+  # Fingerprint of music_file, used to find changed files when rescanning.
+  file_size = models.BigIntegerField(null=True, editable=False)
+  file_mtime = models.FloatField(null=True, editable=False)
+  file_hash = models.CharField(max_length=64, blank=True, editable=False)
+  # Audio properties read when the file is added. Null until known.
+  duration = models.IntegerField(null=True, editable=False,\
+   help_text='Milliseconds')
+  bitrate = models.IntegerField(null=True, editable=False,\
+   help_text='Bits per second')
+  sample_rate = models.IntegerField(null=True, editable=False)
+  # Bytes before the first audio frame, i.e. the ID3v2 tag.
+  audio_offset = models.IntegerField(null=True, editable=False)
+  json_fields = (
+   ('id', 'pk'),
+   ('title', 'title'),
+   ('track_number', 'track_number'),
+   ('time', 'time'),
+   ('duration', 'duration'),
+   ('album', 'album__album'),
+   ('album_id', 'album_id'),
+   ('artist', 'album__artist__artist'),
+   ('artist_id', 'album__artist_id'),
+  )
+  class Meta:
+    # Finds the songs of an album already in song_order.
+    index_together = (('album', 'track_number'),)
   def __str__(self):
     return ' - '.join(\
      (str(self.pk), self.title, self.album.album, self.album.artist.artist))
@@ -54,13 +99,15 @@ class Song(models.Model):
     Args: song - Song, the Song model to convert.
     Return: dict, the dict representing the song.
      { artists: [{ id: int, title: str, track_number: int, time: str,
-       album: str, album_id: int, artist: str, artist_id: int }, ...] }
+       duration: int, album: str, album_id: int, artist: str,
+       artist_id: int }, ...] }
     '''
     song = {
      'id': self.pk,
      'title': self.title,
      'track_number': self.track_number,
      'time': self.time,
+     'duration': self.duration,
      'album': self.album.album,
      'album_id': self.album.pk,
      'artist': self.album.artist.artist,
@@ -69,6 +116,85 @@ class Song(models.Model):
     return song
 
 
+class UploadJob(models.Model):
+  '''
+  An uploaded file waiting for its tags to be read by a worker before it
+  is added to the catalog as a Song.
+  '''
+  PENDING = 'pending'
+  PROCESSING = 'processing'
+  DONE = 'done'
+  FAILED = 'failed'
+  STATUS_CHOICES = (
+   (PENDING, 'Pending'),
+   (PROCESSING, 'Processing'),
+   (DONE, 'Done'),
+   (FAILED, 'Failed'),
+  )
+  music_file = models.FileField(upload_to='pending_uploads', blank=True)
+  file_name = models.CharField(max_length=255, editable=False)
+  status = models.CharField(max_length=16, choices=STATUS_CHOICES,\
+   default=PENDING, db_index=True, editable=False)
+  error = models.TextField(blank=True, editable=False)
+  song = models.ForeignKey(Song, null=True, blank=True, editable=False,\
+   on_delete=models.SET_NULL)
+  created = models.DateTimeField(auto_now_add=True)
+  updated = models.DateTimeField(auto_now=True)
+  def __str__(self):
+    return ' - '.join((str(self.pk), self.file_name, self.status))
+
+
+class Playlist(models.Model):
+  '''
+  A user's list of songs. Each user also has one play queue, a playlist
+  that is not listed with the others.
+  '''
+  owner = models.ForeignKey(settings.AUTH_USER_MODEL)
+  name = models.CharField(max_length=128)
+  is_queue = models.BooleanField(default=False)
+  # Set on play queues only, so that a user cannot have two of them.
+  queue_owner = models.OneToOneField(settings.AUTH_USER_MODEL, null=True,\
+   blank=True, editable=False, related_name='+')
+  created = models.DateTimeField(auto_now_add=True)
+  updated = models.DateTimeField(auto_now=True)
+  class Meta:
+    index_together = (('owner', 'is_queue'),)
+  def __str__(self):
+    return ' - '.join((str(self.pk), self.name))
+  def json_format(self):
+    '''
+    Return: dict, the playlist's information.
+     { id: int, name: str, updated: str }
+    '''
+    return {
+     'id': self.pk,
+     'name': self.name,
+     'updated': self.updated.isoformat(),
+    }
+
+
+class PlaylistEntry(models.Model):
+  '''
+  A song in a playlist. Entries are ordered by rank, see
+  music_player.playlists.
+  '''
+  playlist = models.ForeignKey(Playlist, related_name='entries',\
+   db_index=False)
+  song = models.ForeignKey(Song)
+  rank = models.BigIntegerField()
+  class Meta:
+    # Lists the entries of a playlist in order.
+    index_together = (('playlist', 'rank'),)
+
+
+
+class CatalogVersion(models.Model):
+  '''
+  The version of the cached song, album and artist listings, see
+  music_player.catalog. The table holds a single row.
+  '''
+  version = models.CharField(max_length=32)
+
 def json_list(label, models):
   '''
   Converts models to json-objects (dictionaries) using the json_format method,
@@ -83,7 +209,93 @@ def json_list(label, models):
     results.append(model.json_format())
   return { label: results }
 
-def create_song(title, time, track_number, album, artist, music_file):
+def json_stream(label, queryset, chunk_size=500):
+  '''
+  Serializes a queryset to the same document as json_list, one chunk at a
+  time. Rows are read with values_list so that no model instances are
+  created and the full result is never held in memory.
+  Args:
+   label - string, the name to assign to the list.
+   queryset - queryset, the models to convert. Its model must define
+    json_fields.
+   chunk_size - int, the number of rows serialized per chunk.
+  Yield: bytes, the next piece of the json document.
+  '''
+  keys, lookups = zip(*queryset.model.json_fields)
+  rows = queryset.values_list(*lookups).iterator()
+  separator = ''
+  buffer = []
+  yield '{{{0}: ['.format(json.dumps(label)).encode()
+  for row in rows:
+    buffer.append(json.dumps(dict(zip(keys, row))))
+    if len(buffer) >= chunk_size:
+      yield (separator + ', '.join(buffer)).encode()
+      separator = ', '
+      buffer = []
+  if buffer:
+    yield (separator + ', '.join(buffer)).encode()
+  yield b']}'
+
+def compact_list(songs):
+  '''
+  Converts songs to a normalized document in which each album and artist
+  is listed once. Every table lists its column names once, followed by
+  one array per row. Songs refer to their album and albums refer to their
+  artist by position in the albums and artists rows.
+  Args: songs - iterable(dict), the songs in the format of json_format.
+  Return: dict, the document.
+   { artists: { fields: ['id', 'artist'], rows: [[int, str], ...] },
+     albums: { fields: ['id', 'album', 'artist'], rows: [[int, str, int],
+      ...] },
+     songs: { fields: ['id', 'title', 'track_number', 'time', 'duration',
+      'album'], rows: [[int, str, int, str, int, int], ...] } }
+  '''
+  artists = {}
+  albums = {}
+  artist_rows = []
+  album_rows = []
+  song_rows = []
+  for song in songs:
+    album = albums.get(song['album_id'])
+    if album is None:
+      artist = artists.get(song['artist_id'])
+      if artist is None:
+        artist = artists[song['artist_id']] = len(artist_rows)
+        artist_rows.append((song['artist_id'], song['artist']))
+      album = albums[song['album_id']] = len(album_rows)
+      album_rows.append((song['album_id'], song['album'], artist))
+    song_rows.append((song['id'], song['title'], song['track_number'],\
+     song['time'], song['duration'], album))
+  return {
+   'artists': {'fields': ('id', 'artist'), 'rows': artist_rows},
+   'albums': {'fields': ('id', 'album', 'artist'), 'rows': album_rows},
+   'songs': {'fields': ('id', 'title', 'track_number', 'time', 'duration',\
+    'album'), 'rows': song_rows},
+  }
+
+def file_fingerprint(path):
+  '''
+  Reads the size, modification time and content hash of a file.
+  Args: path - str, the path of the file
+  Return: tuple(int, float, str), the size, mtime and SHA-256 hex digest.
+  '''
+  stat = os.stat(path)
+  digest = hashlib.sha256()
+  with open(path, 'rb') as file_:
+    for block in iter(lambda: file_.read(1 << 20), b''):
+      digest.update(block)
+  return stat.st_size, stat.st_mtime, digest.hexdigest()
+
+def format_duration(duration):
+  '''
+  Args: duration - int, the length of a song in milliseconds
+  Return: str, the length in M:SS format, rounded up to the next second.
+  '''
+  seconds = (duration + 999) // 1000
+  return '{0:d}:{1:02d}'.format(seconds // 60, seconds % 60)
+
+def create_song(title, time, track_number, album, artist, music_file,\
+ **audio_info):
   '''
   Creates a song in the database. Ensures that all dependencies are met
   first (i.e. artist and album) if they do not already exist.
@@ -94,6 +306,8 @@ def create_song(title, time, track_number, album, artist, music_file):
    album - str, the name of the album this song belongs to.
    artist - str, the name of the artist this song belongs to.
    music_file - file, the file containing the song.
+   audio_info - the duration, bitrate, sample_rate and audio_offset of
+    the file, if known.
   '''
   db_art, created = Artist.objects.get_or_create(artist=artist)
   db_alb, created = Album.objects.get_or_create(album=album, artist=db_art)
@@ -104,6 +318,7 @@ def create_song(title, time, track_number, album, artist, music_file):
    album=db_alb,\
    time=time,\
    music_file=music_file,\
+   **audio_info\
   )
   song.save()
   return song
@@ -0,0 +1,227 @@
+'''
+Ordered storage of playlists and play queues.
+
+Entries are ordered by a rank with large gaps between neighbours, so that
+adding, moving or removing one entry writes a single row: a moved or
+inserted entry takes the rank halfway between its new neighbours. Only
+when two neighbours have no rank left between them is the playlist
+renumbered, which spreads the gaps out again. Long lists of entries are
+inserted and renumbered with executemany, since building a model
+instance for each of them costs far more than the SQL.
+'''
+from django.db import connection, transaction
+
+from music_player.models import Playlist, PlaylistEntry, Song
+
+# Distance between the ranks of neighbouring entries after renumbering.
+# 32 entries can be put between two neighbours before they run out.
+rank_gap = 1 << 32
+# Keeps the number of query parameters below the SQLite limit.
+batch_size = 400
+# Order of the entries of a playlist. The primary key settles ties.
+entry_order = ('rank', 'pk')
+
+def get_queue(user):
+  '''
+  Args: user - User, the owner of the queue
+  Return: Playlist, the play queue of the user, created when first needed.
+  '''
+  # queue_owner is unique, so concurrent requests end up with one queue.
+  queue, created = Playlist.objects.get_or_create(queue_owner=user,\
+   defaults={'owner': user, 'is_queue': True, 'name': 'Queue'})
+  return queue
+
+def entry_rows(playlist):
+  '''
+  Args: playlist - Playlist, the playlist to list
+  Return: list(tuple(int, int, int)), the id, rank and song id of each
+   entry in order.
+  '''
+  return list(playlist.entries.order_by(*entry_order)\
+   .values_list('pk', 'rank', 'song_id'))
+
+def upcoming(playlist, position, count=1):
+  '''
+  Finds the entries that play after the one at a position. Like the
+  player, the playlist starts over once its end is reached.
+  Args:
+   playlist - Playlist, the playlist being played
+   position - int, the position of the playing entry, -1 before the start
+   count - int, the number of entries wanted
+  Return: list(tuple(int, int, int)), the position, id and song id of each
+   entry.
+  '''
+  total = playlist.entries.count()
+  if not total:
+    return []
+  entries = playlist.entries.order_by(*entry_order)\
+   .values_list('pk', 'song_id')
+  start = (position + 1) % total
+  rows = list(entries[start:start + count])
+  if len(rows) < count:
+    rows += list(entries[:min(count - len(rows), start)])
+  return [((start + i) % total, pk, song_id) \
+   for i, (pk, song_id) in enumerate(rows)]
+
+def songs_exist(song_ids):
+  '''
+  Args: song_ids - list(int), the songs to look for
+  Return: bool, True if every song exists.
+  '''
+  wanted = set(song_ids)
+  found = 0
+  ids = sorted(wanted)
+  for start in range(0, len(ids), batch_size):
+    found += Song.objects.filter(pk__in=ids[start:start + batch_size]).count()
+  return found == len(wanted)
+
+def _set_ranks(playlist, entry_ids):
+  '''
+  Renumbers the given entries of a playlist in the given order.
+  Args:
+   playlist - Playlist, the playlist of the entries
+   entry_ids - list(int), the entries in their new order
+  '''
+  quote = connection.ops.quote_name
+  with connection.cursor() as cursor:
+    cursor.executemany('UPDATE {0} SET {1} = %s WHERE {2} = %s AND {3} = %s'\
+     .format(quote(PlaylistEntry._meta.db_table), quote('rank'),\
+     quote('id'), quote('playlist_id')), [((i + 1) * rank_gap, pk,\
+     playlist.pk) for i, pk in enumerate(entry_ids)])
+
+def renumber(playlist):
+  '''Spreads the ranks of a playlist evenly, keeping their order.'''
+  _set_ranks(playlist, list(playlist.entries.order_by(*entry_order)\
+   .values_list('pk', flat=True)))
+
+def _neighbours(playlist, after):
+  '''
+  Finds the ranks between which entries placed after an entry go.
+  Args:
+   playlist - Playlist, the playlist of the entry
+   after - int, the entry to follow or None for the start of the playlist
+  Return: tuple(int, int), the rank of the entry to follow and of the one
+   that follows it. Either is None at the ends of the playlist.
+  Raises: PlaylistEntry.DoesNotExist if the entry is not in the playlist.
+  '''
+  entries = playlist.entries.order_by(*entry_order)
+  low = None
+  if after is not None:
+    entry = playlist.entries.values_list('rank', 'pk').get(pk=after)
+    low = entry[0]
+    entries = entries.filter(rank__gt=low) | \
+     entries.filter(rank=low, pk__gt=entry[1])
+  following = entries.values_list('rank', flat=True)[:1]
+  return low, following[0] if following else None
+
+def _free_ranks(low, high, count):
+  '''
+  Spreads count ranks between two ranks.
+  Args:
+   low - int, the rank before the new ones or None
+   high - int, the rank after the new ones or None
+   count - int, the number of ranks needed
+  Return: list(int), the ranks, or None if there is no room for them.
+  '''
+  if low is None and high is None:
+    return [(i + 1) * rank_gap for i in range(count)]
+  if high is None:
+    return [low + (i + 1) * rank_gap for i in range(count)]
+  if low is None:
+    low = high - (count + 1) * rank_gap
+  step = (high - low) // (count + 1)
+  if step < 1:
+    return None
+  return [low + (i + 1) * step for i in range(count)]
+
+def _ranks_after(playlist, after, count):
+  '''
+  Finds ranks for count entries placed after an entry, renumbering the
+  playlist if its neighbours have run out of room.
+  Return: list(int), the ranks in order.
+  '''
+  if after is False:
+    last = playlist.entries.order_by('-rank', '-pk')\
+     .values_list('rank', flat=True)[:1]
+    return _free_ranks(last[0] if last else None, None, count)
+  ranks = _free_ranks(*_neighbours(playlist, after), count=count)
+  if ranks is None:
+    renumber(playlist)
+    ranks = _free_ranks(*_neighbours(playlist, after), count=count)
+  return ranks
+
+@transaction.atomic
+def insert(playlist, song_ids, after=False):
+  '''
+  Adds songs to a playlist.
+  Args:
+   playlist - Playlist, the playlist to add to
+   song_ids - list(int), the songs to add in order
+   after - int, the entry the songs follow. None puts them at the start
+    and False, the default, at the end of the playlist.
+  Return: list(tuple(int, int, int)), the id, rank and song id of each
+   new entry, as in entry_rows.
+  Raises: PlaylistEntry.DoesNotExist if after is not in the playlist.
+  '''
+  if not song_ids:
+    return []
+  ranks = _ranks_after(playlist, after, len(song_ids))
+  quote = connection.ops.quote_name
+  with connection.cursor() as cursor:
+    cursor.executemany('INSERT INTO {0} ({1}, {2}, {3}) VALUES (%s, %s, %s)'\
+     .format(quote(PlaylistEntry._meta.db_table), quote('playlist_id'),\
+     quote('song_id'), quote('rank')), [(playlist.pk, song_id, rank) \
+     for song_id, rank in zip(song_ids, ranks)])
+  playlist.save(update_fields=['updated'])
+  # No other entry is ranked between the first and last new ones.
+  return list(playlist.entries.filter(rank__gte=ranks[0], rank__lte=ranks[-1])\
+   .order_by(*entry_order).values_list('pk', 'rank', 'song_id'))
+
+@transaction.atomic
+def move(entry, after):
+  '''
+  Moves an entry of a playlist.
+  Args:
+   entry - PlaylistEntry, the entry to move
+   after - int, the entry to follow or None for the start of the playlist
+  Raises: PlaylistEntry.DoesNotExist if after is not in the playlist.
+  '''
+  if after == entry.pk:
+    return
+  entry.rank = _ranks_after(entry.playlist, after, 1)[0]
+  entry.save(update_fields=['rank'])
+  entry.playlist.save(update_fields=['updated'])
+
+@transaction.atomic
+def remove(entry):
+  '''Args: entry - PlaylistEntry, the entry to remove from its playlist.'''
+  entry.delete()
+  entry.playlist.save(update_fields=['updated'])
+
+@transaction.atomic
+def reorder(playlist, entry_ids):
+  '''
+  Puts the entries of a playlist in a new order.
+  Args:
+   playlist - Playlist, the playlist to reorder
+   entry_ids - list(int), every entry of the playlist in its new order
+  Return: bool, False if the entries are not exactly those of the playlist.
+  '''
+  current = set(playlist.entries.values_list('pk', flat=True))
+  if len(entry_ids) != len(current) or set(entry_ids) != current:
+    return False
+  _set_ranks(playlist, entry_ids)
+  playlist.save(update_fields=['updated'])
+  return True
+
+@transaction.atomic
+def replace(playlist, song_ids):
+  '''
+  Replaces the songs of a playlist, as when a new list starts playing.
+  Args:
+   playlist - Playlist, the playlist to fill
+   song_ids - list(int), the songs in order
+  Return: list(tuple(int, int, int)), the new entries as in entry_rows.
+  '''
+  playlist.entries.all().delete()
+  return insert(playlist, song_ids)
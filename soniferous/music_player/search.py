@@ -0,0 +1,121 @@
+'''
+Full-text search over song titles, albums and artists.
+
+SQLite databases with FTS5 keep an index in the music_player_song_fts
+virtual table, created by a migration. Its rowids are song primary keys
+and it is kept in sync by the handlers in signals.py. Other databases
+fall back to case-insensitive substring matching.
+'''
+import re
+
+from django.db import DatabaseError, connections, router
+from django.db.models import Q
+
+from music_player.models import Song, Album, Artist
+
+FTS_TABLE = 'music_player_song_fts'
+# Compiled at module load time. Splits a query into indexed tokens.
+token_re = re.compile(r'\w+', re.UNICODE)
+# Relative weights of the title, album and artist columns when ranking.
+rank_weights = (10.0, 4.0, 4.0)
+default_limit = 50
+max_limit = 500
+
+def get_connection():
+  '''Return: the database connection that holds the Song table.'''
+  return connections[router.db_for_write(Song)]
+
+def fts_enabled():
+  '''
+  Checks, once per database connection, whether the FTS5 table created by
+  migration 0009 exists.
+  Return: bool, True if the full-text index is in use.
+  '''
+  connection = get_connection()
+  connection.ensure_connection()
+  checked = getattr(connection, 'soniferous_fts', None)
+  if checked is None or checked[0] is not connection.connection:
+    enabled = False
+    if connection.vendor == 'sqlite':
+      with connection.cursor() as cursor:
+        cursor.execute(\
+         'SELECT 1 FROM sqlite_master WHERE type = %s AND name = %s',\
+         ['table', FTS_TABLE])
+        enabled = cursor.fetchone() is not None
+    checked = (connection.connection, enabled)
+    connection.soniferous_fts = checked
+  return checked[1]
+
+def rebuild_index():
+  '''Refills the full-text index from the Song table.'''
+  connection = get_connection()
+  with connection.cursor() as cursor:
+    cursor.execute('DELETE FROM {0}'.format(FTS_TABLE))
+    try:
+      cursor.execute(\
+       'INSERT INTO {0} (rowid, title, album, artist) '\
+       'SELECT s.id, s.title, al.album, ar.artist '\
+       'FROM {1} s JOIN {2} al ON s.album_id = al.id '\
+       'JOIN {3} ar ON al.artist_id = ar.id'.format(FTS_TABLE,\
+       Song._meta.db_table, Album._meta.db_table, Artist._meta.db_table))
+    except DatabaseError:
+      # The Song table does not exist yet
+      pass
+
+def index_songs(songs):
+  '''
+  Adds or replaces songs in the full-text index.
+  Args: songs - queryset, the songs to index
+  '''
+  if not fts_enabled():
+    return
+  rows = list(songs.values_list(\
+   'pk', 'title', 'album__album', 'album__artist__artist'))
+  with get_connection().cursor() as cursor:
+    cursor.executemany('DELETE FROM {0} WHERE rowid = %s'.format(FTS_TABLE),\
+     [(row[0],) for row in rows])
+    cursor.executemany(\
+     'INSERT INTO {0} (rowid, title, album, artist) VALUES (%s, %s, %s, %s)'\
+     .format(FTS_TABLE), rows)
+
+def unindex_song(pk):
+  '''
+  Removes a song from the full-text index.
+  Args: pk - int, the primary key of the song
+  '''
+  if not fts_enabled():
+    return
+  with get_connection().cursor() as cursor:
+    cursor.execute(\
+     'DELETE FROM {0} WHERE rowid = %s'.format(FTS_TABLE), [pk])
+
+def search_songs(query, limit=default_limit):
+  '''
+  Finds the songs whose title, album or artist contain words starting
+  with every word of the query. Results are ranked by relevance when the
+  full-text index is available.
+  Args:
+   query - str, the text to search for
+   limit - int, the maximum number of songs returned
+  Return: list(int), the primary keys of the matching songs, best first.
+  '''
+  tokens = token_re.findall(query.lower())
+  if not tokens:
+    return []
+  limit = max(1, min(limit, max_limit))
+  if fts_enabled():
+    match = ' '.join('"{0}"*'.format(token) for token in tokens)
+    with get_connection().cursor() as cursor:
+      cursor.execute(\
+       'SELECT rowid FROM {0} WHERE {0} MATCH %s '\
+       'ORDER BY bm25({0}, {1}, {2}, {3}) LIMIT %s'\
+       .format(FTS_TABLE, *rank_weights), [match, limit])
+      return [row[0] for row in cursor.fetchall()]
+  songs = Song.objects.all()
+  for token in tokens:
+    songs = songs.filter(Q(title__icontains=token) |\
+     Q(album__album__icontains=token) |\
+     Q(album__artist__artist__icontains=token))
+  songs = songs.order_by('album__artist__artist', 'album__album',\
+   'track_number')
+  return list(songs.values_list('pk', flat=True)[:limit])
@@ -1,25 +1,177 @@
-from django.db.models import signals, Q
+import os
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models import signals
 from django.dispatch.dispatcher import receiver
 
-from music_player.models import Song, Album, Artist
+from music_player import catalog, search
+from music_player.models import Song, Album, Artist, UploadJob
+
+# Cleanup of albums and artists left without songs or albums
+
+# Pending cleanups of the deferred mode. { Album: set(pk), Artist: set(pk) }
+_pending = threading.local()
+# Keeps the number of query parameters below the SQLite limit.
+cleanup_batch_size = 400
+
+def clean_albums(album_ids):
+  '''
+  Deletes the given albums if they no longer have any songs.
+  Args: album_ids - list(int), the albums to check
+  '''
+  for i in range(0, len(album_ids), cleanup_batch_size):
+    batch = album_ids[i:i + cleanup_batch_size]
+    used_albums = Song.objects.filter(album__in=batch).values('album')
+    Album.objects.filter(pk__in=batch).exclude(pk__in=used_albums).delete()
+
+def clean_artists(artist_ids):
+  '''
+  Deletes the given artists if they no longer have any albums.
+  Args: artist_ids - list(int), the artists to check
+  '''
+  for i in range(0, len(artist_ids), cleanup_batch_size):
+    batch = artist_ids[i:i + cleanup_batch_size]
+    used_artists = Album.objects.filter(artist__in=batch).values('artist')
+    Artist.objects.filter(pk__in=batch).exclude(pk__in=used_artists).delete()
+
+def flush_cleanup():
+  '''
+  Performs the cleanups collected by the deferred mode in one pass. Albums
+  are cleaned first so that the artists they leave unused are collected
+  and cleaned once this pass commits.
+  '''
+  pending = getattr(_pending, 'models', None)
+  _pending.models = None
+  if not pending:
+    return
+  with transaction.atomic():
+    clean_albums(sorted(pending.get(Album, ())))
+    clean_artists(sorted(pending.get(Artist, ())))
+
+def schedule_cleanup(model, pk):
+  '''
+  Cleans up the given album or artist if it is no longer used. With the
+  SONIFEROUS_DEFERRED_CLEANUP setting, the cleanup is merged with the
+  others of the current transaction and performed when it commits.
+  Args:
+   model - Album or Artist, the type of model to clean up
+   pk - int, the primary key of the model
+  '''
+  if pk is None:
+    return
+  if not getattr(settings, 'SONIFEROUS_DEFERRED_CLEANUP', False):
+    if model is Album:
+      clean_albums([pk])
+    else:
+      clean_artists([pk])
+    return
+  if getattr(_pending, 'models', None) is None:
+    _pending.models = {}
+  _pending.models.setdefault(model, set()).add(pk)
+  # Registered every time since callbacks are dropped on rollback.
+  transaction.on_commit(flush_cleanup)
 
 # Signals
 
+@receiver(signals.post_delete, sender=UploadJob)
 @receiver(signals.post_delete, sender=Song)
 def delete_file_from_disk(sender, instance, **kwargs):
   '''Cleans up a music file after it has been deleted from the database'''
   instance.music_file.delete(False)
 
+@receiver(signals.post_save, sender=Song)
+def record_file_stat(sender, instance, **kwargs):
+  '''
+  Records the size and modification time of a newly stored music file.
+  The content hash is left to the upload workers and to rescan, which
+  read the whole file anyway. Files that cannot be read are left for
+  rescan as well.
+  '''
+  if instance.music_file and \
+   (instance.file_size is None or instance.file_mtime is None):
+    try:
+      stat = os.stat(instance.music_file.path)
+    except OSError:
+      return
+    Song.objects.filter(pk=instance.pk)\
+     .update(file_size=stat.st_size, file_mtime=stat.st_mtime)
+    instance.file_size = stat.st_size
+    instance.file_mtime = stat.st_mtime
+
+@receiver(signals.pre_save, sender=Album)
+@receiver(signals.pre_save, sender=Song)
+def remember_parent(sender, instance, **kwargs):
+  '''Records the album or artist a modified model belonged to.'''
+  field = 'album_id' if sender is Song else 'artist_id'
+  instance._previous_parent = None
+  if instance.pk is not None and not instance._state.adding:
+    previous = sender.objects.filter(pk=instance.pk).values_list(field)
+    instance._previous_parent = previous[0][0] if previous else None
+
 @receiver(signals.post_delete, sender=Album)
-@receiver(signals.post_save, sender=Album)
 def clean_unused_artists(sender, instance, **kwargs):
-  '''Used as a trigger to clean up artists with no albums.'''
-  used_artists = Album.objects.all().values('artist')
-  Artist.objects.filter(~Q(pk__in=used_artists)).delete()
+  '''Used as a trigger to clean up the artist of a deleted album.'''
+  schedule_cleanup(Artist, instance.artist_id)
+
+@receiver(signals.post_save, sender=Album)
+def clean_previous_artist(sender, instance, created, **kwargs):
+  '''Used as a trigger to clean up the artist a modified album moved from.'''
+  previous = getattr(instance, '_previous_parent', None)
+  if not created and previous != instance.artist_id:
+    schedule_cleanup(Artist, previous)
 
 @receiver(signals.post_delete, sender=Song)
-@receiver(signals.post_save, sender=Song)
 def clean_unused_albums(sender, instance, **kwargs):
-  '''Used as a trigger to clean up albums with no songs.'''
-  used_albums = Song.objects.all().values('album')
-  Album.objects.filter(~Q(pk__in=used_albums)).delete()
+  '''Used as a trigger to clean up the album of a deleted song.'''
+  schedule_cleanup(Album, instance.album_id)
+
+@receiver(signals.post_save, sender=Song)
+def clean_previous_album(sender, instance, created, **kwargs):
+  '''Used as a trigger to clean up the album a modified song moved from.'''
+  previous = getattr(instance, '_previous_parent', None)
+  if not created and previous != instance.album_id:
+    schedule_cleanup(Album, previous)
+
+@receiver(connection_created)
+def tune_sqlite(sender, connection, **kwargs):
+  '''Runs the PRAGMAs in SONIFEROUS_SQLITE_PRAGMAS on new connections.'''
+  if connection.vendor != 'sqlite':
+    return
+  with connection.cursor() as cursor:
+    for name, value in getattr(settings, 'SONIFEROUS_SQLITE_PRAGMAS', ()):
+      cursor.execute('PRAGMA {0} = {1}'.format(name, value))
+
+@receiver(signals.post_save, sender=Song)
+def index_song(sender, instance, **kwargs):
+  '''Adds a new or modified song to the search index.'''
+  search.index_songs(Song.objects.filter(pk=instance.pk))
+
+@receiver(signals.post_save, sender=Album)
+def index_album(sender, instance, created, **kwargs):
+  '''Updates the search index after an album has been modified.'''
+  if not created:
+    search.index_songs(Song.objects.filter(album=instance))
+
+@receiver(signals.post_save, sender=Artist)
+def index_artist(sender, instance, created, **kwargs):
+  '''Updates the search index after an artist has been modified.'''
+  if not created:
+    search.index_songs(Song.objects.filter(album__artist=instance))
+
+@receiver(signals.post_delete, sender=Song)
+def unindex_song(sender, instance, **kwargs):
+  '''Removes a deleted song from the search index.'''
+  search.unindex_song(instance.pk)
+
+@receiver(signals.post_delete, sender=Song)
+@receiver(signals.post_save, sender=Song)
+@receiver(signals.post_delete, sender=Album)
+@receiver(signals.post_save, sender=Album)
+@receiver(signals.post_delete, sender=Artist)
+@receiver(signals.post_save, sender=Artist)
+def invalidate_catalog(sender, instance, **kwargs):
+  '''Moves the catalog to a new version so cached listings are dropped.'''
+  catalog.bump_version()
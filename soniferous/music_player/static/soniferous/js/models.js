@@ -5,6 +5,58 @@ if(Soniferous === undefined)
 Soniferous.songUrlBase = 'song/';
 Soniferous.artistUrlBase = 'artist/';
 Soniferous.albumUrlBase = 'album/';
+Soniferous.searchUrlBase = 'search';
+Soniferous.queueUrlBase = 'queue';
+// Maximum number of songs returned by a search.
+Soniferous.searchLimit = 200;
+
+/**
+ * Sends a json body to the server with the CSRF token of the page.
+ * Args: method - the HTTP method, url - the url, body - the object to send,
+ *  success - called with the response, error - called if the request fails
+ */
+Soniferous.sendJson = function(method, url, body, success, error){
+  return $.ajax({
+    type: method,
+    url: url,
+    data: JSON.stringify(body),
+    contentType: 'application/json',
+    dataType: 'json',
+    headers: {'X-CSRFToken': $('main').data('csrf-token')},
+    success: success,
+    error: error,
+  });
+};
+
+/**
+ * Reads a listing in the compact format used by the catalog embedded in
+ * the player page and by song listings requested with format=compact.
+ * Artists and albums are listed once and referred to by position, so
+ * their names are copied into the albums and songs that refer to them.
+ * Return: the attributes of the artists, albums and songs.
+ */
+Soniferous.readCompact = function(compact){
+  var table = function(name){
+    var fields = compact[name].fields;
+    return _.map(compact[name].rows, function(row){
+      return _.object(fields, row);
+    });
+  };
+  var artists = table('artists');
+  var albums = _.each(table('albums'), function(album){
+    var artist = artists[album.artist];
+    album.artist_id = artist.id;
+    album.artist = artist.artist;
+  });
+  var songs = _.each(table('songs'), function(song){
+    var album = albums[song.album];
+    song.album_id = album.id;
+    song.album = album.album;
+    song.artist_id = album.artist_id;
+    song.artist = album.artist;
+  });
+  return {artists: artists, albums: albums, songs: songs};
+};
 
 /**
  * Artist model. Represents a single musical artist.
@@ -55,7 +107,28 @@ Soniferous.Song = Backbone.Model.extend({
 Soniferous.SongList = Backbone.Collection.extend({
   url: Soniferous.songUrlBase,
   model: Soniferous.Song,
-  parse: function(songObject) { return songObject.songs; },
+  parse: function(songObject){
+    if(_.isArray(songObject.songs))
+      return songObject.songs;
+    return Soniferous.readCompact(songObject).songs;
+  },
+  initialize: function(){
+    // Songs grouped by album_id and artist_id, built when first needed
+    this.groups = {};
+    this.on('add remove reset sort change:album_id change:artist_id',
+     function(){ this.groups = {}; }, this);
+  },
+  /**
+   * Finds the songs of an album or artist in collection order. The songs
+   * are grouped once, so finding a group does not scan the collection.
+   * The groups are rebuilt after the collection changes.
+   * Args: attribute - 'album_id' or 'artist_id', id - the id to look for
+   */
+  groupedBy: function(attribute, id){
+    if(!this.groups[attribute])
+      this.groups[attribute] = this.groupBy(attribute);
+    return this.groups[attribute][id] || [];
+  },
   /**
    * Sorts songs by artist, album, track_number, and title.
    */
@@ -75,7 +148,7 @@ Soniferous.SongList = Backbone.Collection.extend({
 Soniferous.AlbumList = Backbone.Collection.extend({
   url: Soniferous.albumUrlBase,
   model: Soniferous.Album,
-  parse: function(albumObject) { return albumObject.albums; },
+  parse: function(albumObject){ return albumObject.albums; },
   comparator: function(album){
     return [
       album.get('artist'),
@@ -90,6 +163,6 @@ Soniferous.AlbumList = Backbone.Collection.extend({
 Soniferous.ArtistList = Backbone.Collection.extend({
   url: Soniferous.artistUrlBase,
   model: Soniferous.Artist,
-  parse: function(artistObject) { return artistObject.artists; },
+  parse: function(artistObject){ return artistObject.artists; },
   comparator: 'artist',
 });
@@ -4,74 +4,158 @@
 $(document).ready(function(){
 
   /**
-   * Handles displaying a single song on screen and listens for events.
+   * A single row of a VirtualListView. The row is reused for other models
+   * as the list scrolls.
    */
-  Soniferous.SongView = Backbone.View.extend({
+  Soniferous.RowView = Backbone.View.extend({
     tagName: 'li',
-    template: _.template($('#song-template').html()),
     events: {
-      'add': 'render',
       'click': 'select',
     },
-    initialize: function(){
-      this.listenTo(this.model, 'change:isPlaying',
-       _.bind(this.updatePlaying, this));
+    /**
+     * Displays the given model in this row.
+     */
+    setModel: function(model){
+      if(model === this.model)
+        return this;
+      if(this.model)
+        this.stopListening(this.model);
+      this.model = model;
+      this.bindModel(model);
+      return this.render();
     },
+    /**
+     * Called when the row starts displaying a model.
+     */
+    bindModel: function(model){},
     render: function(){
       this.$el.html(this.template(this.model.toJSON()));
       return this;
     },
-    updatePlaying: function(song, isPlaying){
-      if(isPlaying) this.$el.addClass('selected-song');
-      else this.$el.removeClass('selected-song');
-    },
     select: function(){
       this.model.trigger('select', this.model);
     },
-    remove: function(){
-      this.el.parentNode.removeChild(this.el);
+  });
+
+  /**
+   * Handles displaying a single song on screen and listens for events.
+   */
+  Soniferous.SongView = Soniferous.RowView.extend({
+    template: _.template($('#song-template').html()),
+    bindModel: function(song){
+      this.listenTo(song, 'change:isPlaying', this.updatePlaying);
+      this.updatePlaying(song, song.get('isPlaying'));
+    },
+    updatePlaying: function(song, isPlaying){
+      if(isPlaying) this.$el.addClass('selected-song');
+      else this.$el.removeClass('selected-song');
     },
   });
 
   /**
    * Handles displaying a single album on screen.
    */
-  Soniferous.AlbumView = Backbone.View.extend({
-    tagName: 'li',
+  Soniferous.AlbumView = Soniferous.RowView.extend({
     template: _.template($('#album-template').html()),
-    events: {
-      'add': 'render',
-      'click': 'select',
-    },
-    render: function(){
-      this.$el.html(this.template(this.model.toJSON()));
-      return this;
-    },
-    select: function(){
-      this.model.trigger('select', this.model);
-    },
   });
 
   /**
    * Handles displaying a single artist on screen.
    */
-  Soniferous.ArtistView = Backbone.View.extend({
-    tagName: 'li',
+  Soniferous.ArtistView = Soniferous.RowView.extend({
     template: _.template($('#artist-template').html()),
-    events: {
-      'add': 'render',
-      'click': 'select',
+  });
+
+  /**
+   * Displays a list of models while only rendering the rows on screen and
+   * a few rows beyond each edge of the screen. The list keeps the height
+   * of all its rows so that the page scrolls as if every row was there.
+   * Rows are reused for other models as the page scrolls, so the cost of
+   * displaying a list does not grow with its length.
+   */
+  Soniferous.VirtualListView = Backbone.View.extend({
+    // Rows rendered beyond each edge of the screen
+    buffer: 10,
+    initialize: function(options){
+      this.View = options.View;
+      this.models = [];
+      this.rows = [];
+      this.rowHeight = 0;
+      this.update = _.bind(this.update, this);
+      $(window).on('scroll', this.update);
+      $(window).on('resize', _.bind(function(){
+        // Rows change height with the media queries
+        this.rowHeight = 0;
+        this.update();
+      }, this));
     },
-    render: function(){
-      this.$el.html(this.template(this.model.toJSON()));
-      return this;
+
+    /**
+     * Displays the given models instead of the current ones.
+     */
+    reset: function(models){
+      this.models = models;
+      this.update();
     },
-    select: function(){
-      this.model.trigger('select', this.model);
+
+    /**
+     * Renders the rows that are currently on screen. Does nothing while
+     * the list is hidden, so it must be called once the list is shown.
+     */
+    update: function(){
+      if(this.$el.hasClass('hidden'))
+        return;
+      var rowHeight = this.measureRowHeight();
+      var length = this.models.length;
+      var first = 0;
+      var count = 0;
+      if(rowHeight){
+        var scrolled = -this.el.getBoundingClientRect().top;
+        first = Math.floor(Math.max(scrolled, 0) / rowHeight) - this.buffer;
+        first = Math.min(first, length - 1);
+        // Start on an even row so that the row colors do not alternate
+        first = Math.max(first - first % 2, 0);
+        count = Math.ceil(window.innerHeight / rowHeight) + 2 * this.buffer;
+        count = Math.min(count + 2, length - first);
+      }
+      this.renderRows(first, count);
+      this.el.style.height = (length * rowHeight) + 'px';
+      this.el.style.paddingTop = (first * rowHeight) + 'px';
+    },
+
+    /**
+     * Finds the height of a row, rendering one if there are none yet.
+     * Return: the height in pixels, or 0 if there is nothing to display.
+     */
+    measureRowHeight: function(){
+      if(!this.rowHeight && this.models.length){
+        if(!this.rows.length)
+          this.renderRows(0, 1);
+        this.rowHeight = this.rows[0].el.offsetHeight;
+      }
+      return this.rowHeight;
+    },
+
+    /**
+     * Displays count models starting from first, reusing the existing rows.
+     */
+    renderRows: function(first, count){
+      if(this.rows.length < count){
+        var fragment = document.createDocumentFragment();
+        while(this.rows.length < count){
+          var view = new this.View();
+          this.rows.push(view);
+          fragment.appendChild(view.el);
+        }
+        this.el.appendChild(fragment);
+      }
+      while(this.rows.length > count)
+        this.rows.pop().remove();
+      for(var i=0; i<count; ++i)
+        this.rows[i].setModel(this.models[first + i]);
     },
   });
-  
-  
+
   /**
    * Handles the main user interface and is the driver for the music player.
    */
@@ -94,44 +178,123 @@ $(document).ready(function(){
     initialize: function(){
       this.currentSong = -1;
       this.audioPlayer = $('#audio-player').get(0);
+      // Loads the next song while the current one plays. The two players
+      // swap roles when the next song starts.
+      this.nextPlayer = $('#audio-next').get(0);
+      // The upcoming song loading in nextPlayer, as listed by the server
+      this.prefetched = null;
+      // Whether the server has the current play queue
+      this.queueSaved = false;
+      // The songs of the queue last sent to the server
+      this.sentQueue = null;
       this.searchBar = $('#search-bar');
       // Play the next song in the list when the current playing song ends.
-      this.audioPlayer.addEventListener('ended',
-       _.bind(this.playNextSong, this));
-      // The lists of all information used in the music player
-      this.albumList = new Soniferous.AlbumList();
-      this.artistList = new Soniferous.ArtistList();
-      this.songList = new Soniferous.SongList();
-      // The current playlist of songs to loop through
-      this.playList = null;
-      // The songs to display in the current view
-      this.displayList = new Soniferous.SongList();
-      // Fetch songs
-      this.songList.fetch({
-        // Performed after the list of songs has been fetched
-        success: _.bind(function(collection){
-          this.listenTo(this.displayList, 'reset', this.displaySongs);
-          this.listenTo(this.displayList, 'select', this.selectSong);
-          this.displayList.reset(collection.models);
-          this.playList = collection.clone();
-        }, this)
-      });
-      // Fetch albums
-      this.albumList.fetch({
-        success: _.bind(function(collection){
-          this.listenTo(this.albumList, 'reset', this.displayAlbums);
-          this.listenTo(this.albumList, 'select', this.selectAlbum);
-          this.albumList.reset(collection.models);
-        }, this)
-      });
-      // Fetch artists
-      this.artistList.fetch({
-        success: _.bind(function(collection){
-          this.listenTo(this.artistList, 'reset', this.displayArtists);
-          this.listenTo(this.artistList, 'select', this.selectArtist);
-          this.artistList.reset(collection.models);
-        }, this)
-      });
+      _.each([this.audioPlayer, this.nextPlayer], function(player){
+        player.addEventListener('ended', _.bind(function(){
+          if(player === this.audioPlayer)
+            this.playNextSong();
+        }, this));
+      }, this);
+      // The lists of all information used in the music player, read from
+      // the catalog embedded in the page.
+      var catalog = Soniferous.readCompact(
+       JSON.parse(document.getElementById('catalog-data').textContent));
+      this.albumList = new Soniferous.AlbumList(catalog.albums);
+      this.artistList = new Soniferous.ArtistList(catalog.artists);
+      this.songList = new Soniferous.SongList(catalog.songs);
+      // The current playlist of songs to loop through, kept in the order
+      // it was played in.
+      this.playList = new Soniferous.SongList(this.songList.models,
+       {comparator: false});
+      // The songs to display in the current view, in the order given
+      this.displayList = new Soniferous.SongList([], {comparator: false});
+      this.listenTo(this.displayList, 'reset', this.displaySongs);
+      this.listenTo(this.displayList, 'select', this.selectSong);
+      this.listenTo(this.albumList, 'reset', this.displayAlbums);
+      this.listenTo(this.albumList, 'select', this.selectAlbum);
+      this.listenTo(this.artistList, 'reset', this.displayArtists);
+      this.listenTo(this.artistList, 'select', this.selectArtist);
+      // The on screen rows of each list
+      this.songRows = new Soniferous.VirtualListView({
+        el: '#song-list', View: Soniferous.SongView});
+      this.albumRows = new Soniferous.VirtualListView({
+        el: '#album-list', View: Soniferous.AlbumView});
+      this.artistRows = new Soniferous.VirtualListView({
+        el: '#artist-list', View: Soniferous.ArtistView});
+      this.viewSongs();
+      this.displayList.reset(this.songList.models);
+      this.displayAlbums(this.albumList);
+      this.displayArtists(this.artistList);
+      this.restoreQueue();
+    },
+
+    /**
+     * Continues with the play queue saved on the server, unless a song has
+     * been selected in the meantime.
+     */
+    restoreQueue: function(){
+      $.getJSON(Soniferous.queueUrlBase, _.bind(function(queue){
+        var songs = _.compact(_.map(queue.entries.rows, function(row){
+          return this.songList.get(row[2]);
+        }, this));
+        if(songs.length && this.currentSong == -1){
+          this.playList.reset(songs);
+          this.sentQueue = this.playList.pluck('id');
+          this.queueSaved = true;
+        }
+      }, this));
+    },
+
+    /**
+     * Saves the play queue on the server so that it survives a reload.
+     * Nothing is sent if the server already has, or is being sent, the
+     * same songs.
+     */
+    saveQueue: function(){
+      var songs = this.playList.pluck('id');
+      if(_.isEqual(songs, this.sentQueue))
+        return;
+      this.sentQueue = songs;
+      this.queueSaved = false;
+      Soniferous.sendJson('PUT', Soniferous.queueUrlBase + '/entries',
+       {songs: songs}, _.bind(function(){
+        if(this.sentQueue !== songs)
+          return;
+        this.queueSaved = true;
+        this.prefetchNext();
+      }, this), _.bind(function(){
+        if(this.sentQueue === songs)
+          this.sentQueue = null;
+      }, this));
+    },
+
+    /**
+     * Asks the server which song plays next and loads it in the other
+     * player. Its first seconds are fetched right away into the browser
+     * cache, which the player reads from, so that it starts without a gap
+     * even where preloading is limited.
+     */
+    prefetchNext: function(){
+      if(!this.queueSaved || this.currentSong == -1)
+        return;
+      var position = this.currentSong;
+      $.getJSON(Soniferous.queueUrlBase + '/upcoming', {position: position},
+       _.bind(function(data){
+        var next = data.upcoming[0];
+        var expected = this.playList.at(
+         (position + 1) % this.playList.length);
+        // Skip answers to old requests or for a queue that differs
+        if(!next || position != this.currentSong || !expected ||
+         expected.id != next.song)
+          return;
+        this.prefetched = next;
+        if(window.fetch)
+          fetch(next.url, {credentials: 'same-origin', headers: {
+            Range: 'bytes=' + next.warm_start[0] + '-' + next.warm_start[1]}});
+        this.nextPlayer.preload = 'auto';
+        this.nextPlayer.setAttribute('src', next.url);
+        this.nextPlayer.load();
+      }, this));
     },
 
     /**
@@ -146,7 +309,7 @@ $(document).ready(function(){
      */
     selectArtist: function(artist){
       this.displayList.reset(
-        this.songList.where({ 'artist_id': artist.id }));
+        this.songList.groupedBy('artist_id', artist.id));
       this.viewSongs();
     },
 
@@ -155,7 +318,7 @@ $(document).ready(function(){
      */
     selectAlbum: function(album){
       this.displayList.reset(
-        this.songList.where({ 'album_id': album.id }));
+        this.songList.groupedBy('album_id', album.id));
       this.viewSongs();
     },
 
@@ -167,6 +330,7 @@ $(document).ready(function(){
         this.playList.at(this.currentSong).set('isPlaying', false);
       }
       this.playList.reset(this.displayList.models);
+      this.saveQueue();
       this.playSong(song);
     },
   
@@ -177,6 +341,7 @@ $(document).ready(function(){
     togglePause: function(){
       if(this.currentSong == -1){
         this.currentSong = 0;
+        this.saveQueue();
         this.playSong(this.playList.at(this.currentSong));
       }
       else if(this.audioPlayer.paused)
@@ -226,6 +391,25 @@ $(document).ready(function(){
       this.playSong(this.playList.at(nextSong));
     },
   
+    /**
+     * Asks for a signed url of the song, whose range requests are served
+     * without a session, and plays it unless another song has been picked
+     * in the meantime. The plain audio url is used if signing fails.
+     */
+    loadSong: function(song){
+      var url = Soniferous.songUrlBase + song.id + '/audio';
+      var play = _.bind(function(src){
+        if(this.playList.at(this.currentSong) !== song)
+          return;
+        this.audioPlayer.setAttribute('src', src);
+        this.audioPlayer.play();
+        this.updatePlayButton();
+      }, this);
+      $.ajax({url: url + '/url', dataType: 'json',
+        success: function(data){ play(data.url); },
+        error: function(){ play(url); }});
+    },
+
     /**
      * Plays the given song after setting the previous song to not-playing.
      */
@@ -233,12 +417,24 @@ $(document).ready(function(){
       this.currentSong = this.playList.indexOf(song);
       this.audioPlayer.pause();
       // Set the new song to playing
-      this.audioPlayer.setAttribute('src',
-       Soniferous.songUrlBase + song.id + '/audio');
+      if(this.prefetched && this.prefetched.song == song.id){
+        // The song has already been loaded by the other player
+        var player = this.audioPlayer;
+        this.audioPlayer = this.nextPlayer;
+        this.nextPlayer = player;
+        this.nextPlayer.preload = 'none';
+      }
+      else{
+        this.audioPlayer.removeAttribute('src');
+        this.loadSong(song);
+      }
+      this.prefetched = null;
       song.set('isPlaying', true);
-      this.audioPlayer.play();
+      if(this.audioPlayer.getAttribute('src'))
+        this.audioPlayer.play();
       this.displaySongInfo(song);
       this.updatePlayButton();
+      this.prefetchNext();
     },
   
     /**
@@ -251,49 +447,28 @@ $(document).ready(function(){
     },
 
     /**
-     * Render multiple songs with only one document reflow.
+     * Displays a list of songs.
      */
     displaySongs: function(songCollection){
-      var songList = songCollection.models;
-      var fragment = document.createDocumentFragment();
-      for(var i=0; i<songList.length; ++i){
-        var songView = new Soniferous.SongView({model: songList[i]});
-        fragment.appendChild(songView.render().el);
-      }
-      $('#song-list').empty();
-      $('#song-list').append(fragment);
+      this.songRows.reset(songCollection.models);
     },
 
     /**
-     * Render multiple albums with only one document reflow.
+     * Displays a list of albums.
      */
     displayAlbums: function(albumCollection){
-      var albumList = albumCollection.models;
-      var fragment = document.createDocumentFragment();
-      for(var i=0; i<albumList.length; ++i){
-        var albumView = new Soniferous.AlbumView({model: albumList[i]});
-        fragment.appendChild(albumView.render().el);
-      }
-      $('#album-list').empty();
-      $('#album-list').append(fragment);
+      this.albumRows.reset(albumCollection.models);
     },
 
     /**
-     * Render multiple artists with only one document reflow.
+     * Displays a list of artists.
      */
     displayArtists: function(artistCollection){
-      var artistList = artistCollection.models;
-      var fragment = document.createDocumentFragment();
-      for(var i=0; i<artistList.length; ++i){
-        var artistView = new Soniferous.ArtistView({model: artistList[i]});
-        fragment.appendChild(artistView.render().el);
-      }
-      $('#artist-list').empty();
-      $('#artist-list').append(fragment);
+      this.artistRows.reset(artistCollection.models);
     },
 
     /**
-     * Displays all songs that were loaded during the start of the application.
+     * Displays all songs.
      */
     displayAllSongs: function(){
       this.displayList.reset(this.songList.models);
@@ -301,24 +476,27 @@ $(document).ready(function(){
     },
 
     /**
-     * Displays a listing of songs that match the search. Only updates
-     * after input has completed.
+     * Displays a listing of songs that match the search. Only queries the
+     * server after input has completed.
      */
     displaySearchSongs: _.debounce(function(){
-      var query = this.searchBar.val().toLocaleLowerCase();
-      this.displayList.reset(
-        this.songList.filter(function(song){
-          if(song.get('title').toLocaleLowerCase().indexOf(query) != -1)
-            return true;
-          if(song.get('album').toLocaleLowerCase().indexOf(query) != -1)
-            return true;
-          if(song.get('artist').toLocaleLowerCase().indexOf(query) != -1)
-            return true;
-          else
-            return false;
-        })
-      );
-      this.viewSongs();
+      var query = this.searchBar.val().trim();
+      if(!query)
+        return this.displayAllSongs();
+      // Ignore responses to searches that have since been replaced
+      var searchId = this.searchId = (this.searchId || 0) + 1;
+      // Keep the best first order of the results
+      var results = new Soniferous.SongList([], {comparator: false});
+      results.fetch({
+        url: Soniferous.searchUrlBase,
+        data: {q: query, limit: Soniferous.searchLimit, format: 'compact'},
+        success: _.bind(function(collection){
+          if(searchId != this.searchId)
+            return;
+          this.displayList.reset(collection.models);
+          this.viewSongs();
+        }, this)
+      });
     }, 300),
   
     /**
@@ -328,6 +506,7 @@ $(document).ready(function(){
       $('#album-list').addClass('hidden');
       $('#artist-list').addClass('hidden');
       $('#song-list').removeClass('hidden');
+      this.songRows.update();
     },
   
     /**
@@ -337,6 +516,7 @@ $(document).ready(function(){
       $('#album-list').addClass('hidden');
       $('#song-list').addClass('hidden');
       $('#artist-list').removeClass('hidden');
+      this.artistRows.update();
     },
   
     /**
@@ -346,6 +526,7 @@ $(document).ready(function(){
       $('#artist-list').addClass('hidden');
       $('#song-list').addClass('hidden');
       $('#album-list').removeClass('hidden');
+      this.albumRows.update();
     },
   });
   
@@ -0,0 +1,23 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from music_player import assets
+
+register = template.Library()
+
+@register.simple_tag
+def bundle(name):
+  '''
+  Includes a bundle of music_player.assets: its built file if it has been
+  built, otherwise each of its files.
+  Args: name - str, the name of the bundle, e.g. player.js
+  Return: str, the script or link tags.
+  '''
+  urls = assets.bundle_urls(name)
+  if name.endswith('.js'):
+    return format_html_join('\n', '<script type="text/javascript" '\
+     'src="{0}"></script>', ((url,) for url, media in urls))
+  return format_html_join('\n', '{0}', ((format_html(\
+   '<link rel="stylesheet" media="{0}" href="{1}" />', media, url) \
+   if media else format_html('<link rel="stylesheet" href="{0}" />', url),) \
+   for url, media in urls))
@@ -1,6 +1,9 @@
+from django.core.files import File
 from django.core.urlresolvers import reverse
-from django.test import TestCase, Client
+from django.test import TestCase, TransactionTestCase, Client,\
+ override_settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
 
 import music_player.models as m
 
@@ -31,6 +34,16 @@ class GeneralTests(TestCase):
     '''Ensures Mutagen library is installed for ID3 support'''
     from mutagen.mp3 import EasyMP3
 
+  def test_sqlite_pragmas(self):
+    '''Ensures new SQLite connections are tuned'''
+    from django.db import connection
+    if connection.vendor != 'sqlite':
+      return
+    with connection.cursor() as cursor:
+      cursor.execute('PRAGMA synchronous')
+      # NORMAL
+      self.assertEqual(cursor.fetchone()[0], 1)
+
 
 class ViewTests(TestCase):
 
@@ -49,11 +62,16 @@ class ViewTests(TestCase):
     response = client.get(reverse(page_name, kwargs=kwargs))
     error = 'Page {0} failed tests.'.format(page_name)
     self.assertEqual(response.status_code, status, msg=error)
+    if response.streaming:
+      content = b''.join(response.streaming_content)
+    else:
+      content = response.content
     for string in strings:
-      self.assertTrue(string.encode() in response.content, msg=error)
+      self.assertTrue(string.encode() in content, msg=error)
   
   def setUp(self):
     '''Creates a basic user for testing'''
+    cache.clear()
     self.user_credentials = ('user1', 'pass1')
     self.admin_credentials = ('admin', 'doge')
     User.objects.create_superuser(self.admin_credentials[0],\
@@ -76,6 +94,184 @@ class ViewTests(TestCase):
     for params in page_params:
       self.user_page_contains(*params)
 
+  def test_pagination(self):
+    '''Ensures listings can be walked page by page with next links'''
+    import json
+    client = Client()
+    client.login(username=self.user_credentials[0],\
+     password=self.user_credentials[1])
+    for page_name, label, count in (('soniferous:songs', 'songs', 8),\
+     ('soniferous:albums', 'albums', 4), ('soniferous:artists', 'artists', 2)):
+      full = b''.join(client.get(reverse(page_name)).streaming_content)
+      expected = json.loads(full.decode())[label]
+      self.assertEqual(len(expected), count)
+      results = []
+      url = reverse(page_name) + '?limit=3'
+      while url:
+        page = json.loads(client.get(url).content.decode())
+        self.assertLessEqual(len(page[label]), 3)
+        results.extend(page[label])
+        url = page['next']
+      self.assertEqual(results, expected)
+    response = client.get(reverse('soniferous:songs') + '?after=bad')
+    self.assertEqual(response.status_code, 400)
+
+  def test_search(self):
+    '''Ensures the search endpoint finds songs by word prefixes'''
+    import json
+    client = Client()
+    client.login(username=self.user_credentials[0],\
+     password=self.user_credentials[1])
+    url = reverse('soniferous:search')
+    songs = json.loads(client.get(url, {'q': 'artist2 album1'})\
+     .content.decode())['songs']
+    self.assertEqual(len(songs), 2)
+    self.assertTrue(all(song['artist'] == 'Artist2' for song in songs))
+    songs = json.loads(client.get(url, {'q': 'titl', 'limit': 3})\
+     .content.decode())['songs']
+    self.assertEqual(len(songs), 3)
+    self.assertEqual(client.get(url, {'limit': 'x'}).status_code, 400)
+    from django.db import connection
+    from music_player import search
+    if connection.vendor == 'sqlite':
+      # The index is created by the migrations, and looked up only once
+      self.assertTrue(search.fts_enabled())
+      with self.assertNumQueries(0):
+        search.fts_enabled()
+
+  def test_listing_cache(self):
+    '''Ensures listings are revalidated and invalidated on changes'''
+    import json
+    client = Client()
+    client.login(username=self.user_credentials[0],\
+     password=self.user_credentials[1])
+    url = reverse('soniferous:albums')
+    response = client.get(url)
+    self.assertEqual(response.status_code, 200)
+    b''.join(response.streaming_content)
+    etag = response['ETag']
+    # Served from the cache
+    response = client.get(url)
+    self.assertEqual(response['ETag'], etag)
+    self.assertIn(b'Album2', response.content)
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    self.assertEqual(response.status_code, 304)
+    self.assertEqual(response.content, b'')
+    # Parameters the listing does not read share its cache entry
+    from music_player import catalog
+    cache = catalog.get_cache()
+    entries = len(cache._cache)
+    for junk in range(3):
+      response = client.get(url, {'junk': junk})
+      self.assertEqual(response['ETag'], etag)
+    page = client.get(url, {'limit': 1, 'junk': 1})
+    self.assertEqual(client.get(url, {'limit': '01'})['ETag'],\
+     page['ETag'])
+    self.assertNotIn('junk', json.loads(page.content.decode())['next'])
+    self.assertEqual(len(cache._cache), entries + 1)
+    # Changes create a new version
+    m.create_song('Title3', '3:33', 1, 'Album3', 'Artist1', None)
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    self.assertEqual(response.status_code, 200)
+    self.assertIn(b'Album3', b''.join(response.streaming_content))
+
+  def test_player_snapshot(self):
+    '''Ensures the player page embeds the catalog and caches it'''
+    import json, re
+    from music_player import catalog
+    m.create_song('</script>', '3:33', 1, 'Album3', 'Artist3', None)
+    client = Client()
+    client.login(username=self.user_credentials[0],\
+     password=self.user_credentials[1])
+    content = client.get(reverse('soniferous:player')).content.decode()
+    self.assertNotIn('</script>"', content)
+    data = re.search('<script type="application/json" id="catalog-data">'\
+     '(.*?)</script>', content).group(1)
+    tables = json.loads(data)
+    self.assertEqual(len(tables['artists']['rows']), 3)
+    self.assertEqual(len(tables['albums']['rows']), 5)
+    songs = [dict(zip(tables['songs']['fields'], row)) \
+     for row in tables['songs']['rows']]
+    self.assertEqual(len(songs), 9)
+    self.assertEqual(songs[-1]['title'], '</script>')
+    self.assertEqual(tables['albums']['rows'][songs[-1]['album']][1],\
+     'Album3')
+    # Only the catalog version is read
+    with self.assertNumQueries(1):
+      self.assertEqual(catalog.snapshot(), data)
+
+  def test_catalog_version_shared(self):
+    '''Ensures catalog changes made by other processes are seen at once'''
+    client = Client()
+    client.login(username=self.user_credentials[0],\
+     password=self.user_credentials[1])
+    url = reverse('soniferous:songs')
+    etag = client.get(url)['ETag']
+    # A management command or another worker has a cache of its own
+    with self.settings(CACHES={'default': {'BACKEND':\
+     'django.core.cache.backends.locmem.LocMemCache',\
+     'LOCATION': 'other-process'}}):
+      m.create_song('Title9', '1:00', 1, 'Album9', 'Artist9', None)
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    self.assertEqual(response.status_code, 200)
+    self.assertNotEqual(response['ETag'], etag)
+    content = b''.join(response.streaming_content) if response.streaming \
+     else response.content
+    self.assertIn(b'Album9', content)
+
+  def test_compact_format(self):
+    '''Ensures songs can be listed in the compact, normalized format'''
+    import gzip, json
+    client = Client()
+    client.login(username=self.user_credentials[0],\
+     password=self.user_credentials[1])
+    url = reverse('soniferous:songs')
+    expected = json.loads(b''.join(\
+     client.get(url).streaming_content).decode())['songs']
+    for response in (client.get(url, {'format': 'compact'}),\
+     client.get(url, HTTP_ACCEPT='application/vnd.soniferous.compact+json')):
+      self.assertEqual(response['Content-Type'],\
+       'application/vnd.soniferous.compact+json')
+      compact = json.loads(response.content.decode())
+      self.assertEqual(len(compact['artists']['rows']), 2)
+      self.assertEqual(len(compact['albums']['rows']), 4)
+      songs = []
+      for row in compact['songs']['rows']:
+        song = dict(zip(compact['songs']['fields'], row))
+        album_id, album, artist = compact['albums']['rows'][song['album']]
+        song['album_id'], song['album'] = album_id, album
+        song['artist_id'], song['artist'] = compact['artists']['rows'][artist]
+        songs.append(song)
+      self.assertEqual(songs, expected)
+    # Later requests are served from the cache, compressed if accepted
+    response = client.get(url, {'format': 'compact'},\
+     HTTP_ACCEPT_ENCODING='gzip, deflate')
+    self.assertEqual(response['Content-Encoding'], 'gzip')
+    self.assertTrue(response['ETag'].startswith('W/'))
+    self.assertEqual(json.loads(gzip.decompress(response.content).decode()),\
+     compact)
+    page = json.loads(client.get(url, {'format': 'compact', 'limit': 5})\
+     .content.decode())
+    self.assertEqual(len(page['songs']['rows']), 5)
+    self.assertIn('format=compact', page['next'])
+
+  def test_song_index(self):
+    '''Ensures drill-down listings read their songs from the song index'''
+    from music_player import catalog
+    album = m.Album.objects.get(album='Album1', artist__artist='Artist2')
+    expected = list(m.Song.objects.filter(album=album)\
+     .order_by('track_number', 'pk').values_list('pk', flat=True))
+    self.assertEqual(catalog.song_ids('album', album.pk), expected)
+    with self.assertNumQueries(2):
+      self.assertEqual(catalog.song_ids('album', album.pk), expected)
+      self.assertEqual(len(catalog.song_ids('artist', album.artist_id)), 4)
+    self.assertEqual(catalog.song_ids('album', 0), [])
+    # Changes are visible in the index of the next version
+    song = m.create_song('Title3', '3:33', 3, 'Album1', 'Artist2', None)
+    self.assertEqual(catalog.song_ids('album', album.pk), expected + [song.pk])
+    self.user_page_contains('soniferous:albums', 200, ['Title3'],\
+     {'pk': album.pk})
+
   def song_upload(self):
     '''
     Ensure that MP3 files uploaded can have their tags read and are served.
@@ -122,6 +318,364 @@ class ViewTests(TestCase):
     '''
     self.song_upload()
     self.song_files()
+
+  def create_file_song(self):
+    '''
+    Creates a song backed by one of the test MP3 files.
+    Return: Song, the song created.
+    '''
+    import os.path
+    test_file = os.path.join(os.path.dirname(__file__), 'test-data/Kappa.mp3')
+    with open(test_file, 'rb') as file_:
+      song = m.create_song('Kappa', '0:01', 1, 'Album3', 'Artist3',\
+       File(file_, name='Kappa.mp3'))
+    self.addCleanup(song.delete)
+    return song
+
+  def test_audio_backends(self):
+    '''Ensures each audio delivery backend validates and serves ranges'''
+    song = self.create_file_song()
+    size = song.music_file.size
+    url = '/song/{0}/audio'.format(song.pk)
+    client = Client()
+    client.login(username=self.user_credentials[0],\
+     password=self.user_credentials[1])
+    # Python streaming
+    response = client.get(url, HTTP_RANGE='bytes=2-9')
+    self.assertEqual(response.status_code, 206)
+    self.assertEqual(len(b''.join(response.streaming_content)), 8)
+    self.assertEqual(response['Content-Range'],\
+     'bytes 2-9/{0}'.format(size))
+    response = client.get(url, HTTP_RANGE='bytes={0}-'.format(size))
+    self.assertEqual(response.status_code, 416)
+    # Offloaded to the web server
+    with override_settings(SONIFEROUS_AUDIO_BACKEND='x_accel_redirect'):
+      response = client.get(url)
+      self.assertEqual(response['X-Accel-Redirect'],\
+       '/protected/' + song.music_file.name)
+      response = client.get(url, HTTP_RANGE='bytes={0}-'.format(size))
+      self.assertEqual(response.status_code, 416)
+    with override_settings(SONIFEROUS_AUDIO_BACKEND='x_sendfile'):
+      response = client.get(url)
+      self.assertEqual(response['X-Sendfile'], song.music_file.path)
+    with override_settings(SONIFEROUS_AUDIO_BACKEND='file_wrapper'):
+      response = client.get(url)
+      self.assertEqual(len(b''.join(response.streaming_content)), size)
+
+  def test_metrics(self):
+    '''Ensures the metrics middleware measures requests for staff to read'''
+    from music_player.metrics import registry, range_kind
+    self.assertEqual([range_kind(header) for header in (None, 'bytes=0-',\
+     'bytes=10-', 'bytes=1-5', 'bytes=-5', 'bytes=1-2,4-5', 'lines=1-')],\
+     ['none', 'start', 'seek', 'bounded', 'suffix', 'multiple', 'invalid'])
+    song = self.create_file_song()
+    size = song.music_file.size
+    registry.reset()
+    client = Client()
+    client.login(username=self.user_credentials[0],\
+     password=self.user_credentials[1])
+    with self.modify_settings(MIDDLEWARE_CLASSES={\
+     'prepend': 'music_player.metrics.MetricsMiddleware'}):
+      response = client.get(reverse('soniferous:songs'))
+      length = len(b''.join(response.streaming_content))
+      response = client.get(reverse('soniferous:audio',\
+       kwargs={'pk': song.pk}), HTTP_RANGE='bytes=0-')
+      b''.join(response.streaming_content)
+      self.assertEqual(client.get(reverse('soniferous:metrics')).status_code,\
+       302)
+      with self.settings(SONIFEROUS_METRICS_TOKEN='secret'):
+        response = client.get(reverse('soniferous:metrics'),\
+         HTTP_AUTHORIZATION='Bearer secret')
+    self.assertEqual(response.status_code, 200)
+    content = response.content.decode()
+    for line in (\
+     'soniferous_request_duration_seconds_count{view="songs"} 1',\
+     'soniferous_requests_total{view="songs",status="200"} 1',\
+     'soniferous_response_bytes_total{{view="songs"}} {0}'.format(length),\
+     'soniferous_response_bytes_total{{view="audio"}} {0}'.format(size),\
+     'soniferous_audio_range_requests_total{range="start",status="206"} 1'):
+      self.assertIn(line + '\n', content)
+    queries = int(content.split('soniferous_db_queries_total{view="songs"} ')\
+     [1].split()[0])
+    self.assertGreater(queries, 0)
+
+  def test_audio_info(self):
+    '''Ensures audio properties are read, backfilled and used for audio'''
+    import importlib
+    import json
+    from django.apps import apps
+    from django.db import connection
+    from music_player.forms import read_id3_info
+    song = self.create_file_song()
+    info = read_id3_info(song.music_file.path)
+    self.assertEqual((info['duration'], info['bitrate'], info['sample_rate'],\
+     info['audio_offset'], info['time']), (7621, 157417, 48000, 0, '0:08'))
+    self.assertEqual(m.format_duration(60000), '1:00')
+    self.assertIsNone(song.duration)
+    backfill = importlib.import_module(\
+     'music_player.migrations.0006_backfill_song_audio_info')
+    backfill.backfill_audio_info(apps, connection.schema_editor())
+    song.refresh_from_db()
+    self.assertEqual(song.duration, 7621)
+    self.assertEqual(song.audio_offset, 0)
+    # Audio requests rely on the stored size rather than the file's
+    m.Song.objects.filter(pk=song.pk).update(file_size=song.file_size - 10)
+    client = Client()
+    client.login(username=self.user_credentials[0],\
+     password=self.user_credentials[1])
+    response = client.get('/song/{0}/audio'.format(song.pk),\
+     HTTP_RANGE='bytes=-5')
+    self.assertTrue(response['Content-Range'].endswith(\
+     '/{0}'.format(song.file_size - 10)))
+    response = client.get('/song/{0}'.format(song.pk))
+    self.assertEqual(json.loads(response.content.decode())['duration'], 7621)
+
+  def test_playlists(self):
+    '''Ensures playlists and the queue can be edited and kept private'''
+    import json
+    client = Client()
+    client.login(username=self.user_credentials[0],\
+     password=self.user_credentials[1])
+    songs = list(m.Song.objects.order_by('pk').values_list('pk', flat=True))
+    def send(method, url, body):
+      response = getattr(client, method)(url, json.dumps(body),\
+       content_type='application/json')
+      content = json.loads(response.content.decode()) \
+       if response.status_code < 300 and response.content else None
+      return response.status_code, content
+    def song_order(url):
+      return [row[2] for row in json.loads(client.get(url).content\
+       .decode())['entries']['rows']]
+    status, playlist = send('post', reverse('soniferous:playlists'),\
+     {'name': 'Mix', 'songs': songs[:3]})
+    self.assertEqual(status, 201)
+    url = reverse('soniferous:playlists', kwargs={'pk': playlist['id']})
+    entries_url = reverse('soniferous:playlist-entries',\
+     kwargs={'pk': playlist['id']})
+    first, second, third = [row[0] for row in playlist['entries']['rows']]
+    # Insert at the start and after an entry, move and remove
+    self.assertEqual(send('post', entries_url,\
+     {'songs': [songs[3]], 'after': None})[0], 201)
+    self.assertEqual(send('post', entries_url,\
+     {'songs': [songs[4]], 'after': first})[0], 201)
+    self.assertEqual(song_order(url),\
+     [songs[3], songs[0], songs[4], songs[1], songs[2]])
+    self.assertEqual(send('put', entries_url + '/{0}'.format(third),\
+     {'after': None})[0], 200)
+    self.assertEqual(client.delete(entries_url + '/{0}'.format(second))\
+     .status_code, 200)
+    self.assertEqual(song_order(url), [songs[2], songs[3], songs[0], songs[4]])
+    # Bulk reorder must list every entry
+    rows = json.loads(client.get(url).content.decode())['entries']['rows']
+    ids = [row[0] for row in reversed(rows)]
+    self.assertEqual(send('put', entries_url, {'entries': ids[1:]})[0], 400)
+    self.assertEqual(send('put', entries_url, {'entries': ids})[0], 200)
+    self.assertEqual(song_order(url), [songs[4], songs[0], songs[3], songs[2]])
+    # Invalid songs and entries
+    self.assertEqual(send('post', entries_url, {'songs': [0]})[0], 400)
+    self.assertEqual(send('post', entries_url,\
+     {'songs': [songs[0]], 'after': second})[0], 400)
+    # The queue is kept apart from the playlists
+    queue_url = reverse('soniferous:queue-entries')
+    self.assertEqual(send('put', queue_url, {'songs': songs[:2]})[0], 200)
+    self.assertEqual(song_order(reverse('soniferous:queue')), songs[:2])
+    listing = json.loads(client.get(reverse('soniferous:playlists'))\
+     .content.decode())['playlists']
+    self.assertEqual([item['name'] for item in listing], ['Mix'])
+    # Other users cannot see the playlist
+    client.logout()
+    client.login(username=self.admin_credentials[0],\
+     password=self.admin_credentials[1])
+    self.assertEqual(client.get(url).status_code, 404)
+    self.assertEqual(song_order(reverse('soniferous:queue')), [])
+    # A user can only have one queue
+    from django.db import IntegrityError, transaction
+    from music_player import playlists
+    user = User.objects.get(username=self.user_credentials[0])
+    queue = playlists.get_queue(user)
+    self.assertEqual(playlists.get_queue(user), queue)
+    with self.assertRaises(IntegrityError), transaction.atomic():
+      m.Playlist.objects.create(owner=user, queue_owner=user, is_queue=True,\
+       name='Queue')
+
+  def test_queue_upcoming(self):
+    '''Ensures the songs after the playing one are listed for prefetching'''
+    import json
+    from music_player import playlists
+    first, second = self.create_file_song(), self.create_file_song()
+    m.Song.objects.filter(pk=second.pk).update(bitrate=128000,\
+     audio_offset=100)
+    user = User.objects.get(username=self.user_credentials[0])
+    playlists.replace(playlists.get_queue(user), [first.pk, second.pk])
+    client = Client()
+    client.login(username=self.user_credentials[0],\
+     password=self.user_credentials[1])
+    url = reverse('soniferous:queue-upcoming')
+    with self.settings(SONIFEROUS_PREFETCH_SECONDS=1):
+      upcoming = json.loads(client.get(url, {'position': 0, 'count': 5})\
+       .content.decode())['upcoming']
+    # The queue starts over after its last song
+    self.assertEqual([(song['position'], song['song']) for song in upcoming],\
+     [(1, second.pk), (0, first.pk)])
+    self.assertEqual(upcoming[0]['warm_start'], [0, 16099])
+    self.assertEqual(upcoming[1]['warm_start'], [0, first.file_size - 1])
+    response = client.get(upcoming[0]['url'], HTTP_RANGE='bytes={0}-{1}'\
+     .format(*upcoming[0]['warm_start']))
+    self.assertEqual(response.status_code, 206)
+    self.assertTrue(response['Cache-Control'].startswith('private'))
+    self.assertEqual(client.get(url, {'position': 'x'}).status_code, 400)
+
+  def test_signed_audio_urls(self):
+    '''Ensures signed audio urls work without a session or the database'''
+    import json
+    import os
+    import time
+    from django.core import signing
+    from music_player.audio import read_audio_token, sign_audio_file
+    song = self.create_file_song()
+    client = Client()
+    client.login(username=self.user_credentials[0],\
+     password=self.user_credentials[1])
+    signed = json.loads(client.get(reverse('soniferous:audio-url',\
+     kwargs={'pk': song.pk})).content.decode())
+    self.assertEqual(signed['size'], song.file_size)
+    anonymous = Client()
+    with self.assertNumQueries(0):
+      response = anonymous.get(signed['url'], HTTP_RANGE='bytes=0-99')
+    self.assertEqual(response.status_code, 206)
+    self.assertEqual(b''.join(response.streaming_content),\
+     song.music_file.read(100))
+    # Tokens are stable within a lifetime and expire after the next one
+    token = sign_audio_file('a.mp3', 1, 2.0, lifetime=100, now=1050)
+    self.assertEqual(token,\
+     sign_audio_file('a.mp3', 1, 2.0, lifetime=100, now=1099))
+    self.assertEqual(read_audio_token(token, now=1199), ('a.mp3', 1, 2.0))
+    with self.assertRaises(signing.SignatureExpired):
+      read_audio_token(token, now=1200)
+    forged = sign_audio_file('../settings.py', 1, 2.0)[:-1] + 'x'
+    for url in ('/audio/' + forged, '/audio/' + sign_audio_file('a.mp3',\
+     1, 2.0, lifetime=1, now=time.time() - 10)):
+      self.assertEqual(anonymous.get(url).status_code, 403)
+    # The file was replaced after the url was signed
+    for backend in ('python', 'x_sendfile'):
+      with override_settings(SONIFEROUS_AUDIO_BACKEND=backend):
+        with open(song.music_file.path, 'ab') as file_:
+          file_.write(b'\0')
+        self.assertEqual(anonymous.get(signed['url']).status_code, 410)
+        os.truncate(song.music_file.path, song.file_size)
+        os.utime(song.music_file.path, (0, 0))
+        self.assertEqual(anonymous.get(signed['url']).status_code, 410)
+    # The file of a removed song is gone
+    song.music_file.storage.delete(song.music_file.name)
+    self.assertEqual(anonymous.get(signed['url']).status_code, 404)
+
+  def test_async_audio(self):
+    '''Ensures the ASGI application streams signed audio urls itself'''
+    import asyncio
+    from music_player.async_audio import AudioApplication
+    from music_player.views import signed_audio_url
+    song = self.create_file_song()
+    url, size = signed_audio_url(song)
+    others = []
+    async def fallback(scope, receive, send):
+      others.append(scope['path'])
+    application = AudioApplication(fallback, threads=2, chunk_size=4096)
+    def request(path, headers=(), disconnect_after=None):
+      messages = []
+      async def receive():
+        if disconnect_after is None:
+          await asyncio.Future()
+        while len(messages) <= disconnect_after:
+          await asyncio.sleep(0)
+        return {'type': 'http.disconnect'}
+      async def send(message):
+        messages.append(message)
+        await asyncio.sleep(0)
+      loop = asyncio.new_event_loop()
+      try:
+        loop.run_until_complete(application({'type': 'http',\
+         'method': 'GET', 'path': path, 'query_string': b'',\
+         'headers': headers}, receive, send))
+      finally:
+        loop.close()
+      return messages
+    messages = request(url, [(b'range', b'bytes=100-9099')])
+    self.assertEqual(messages[0]['status'], 206)
+    self.assertIn((b'Content-Range',\
+     'bytes 100-9099/{0}'.format(size).encode()), messages[0]['headers'])
+    body = [message['body'] for message in messages[1:]]
+    self.assertEqual([len(chunk) for chunk in body], [4096, 4096, 808, 0])
+    song.music_file.open()
+    song.music_file.seek(100)
+    self.assertEqual(b''.join(body), song.music_file.read(9000))
+    song.music_file.close()
+    # Streams stop once the listener is gone
+    self.assertLess(len(request(url, disconnect_after=2)), 6)
+    self.assertEqual(request('/audio/x:y')[0]['status'], 403)
+    request(reverse('soniferous:queue'))
+    self.assertEqual(others, [reverse('soniferous:queue')])
+
+  def test_static_bundles(self):
+    '''Ensures pages use the hashed bundles once they have been built'''
+    import gzip
+    import os.path
+    import shutil
+    import tempfile
+    from music_player import assets
+    self.assertEqual(assets.minify_js(\
+     '/* a */ keep();\n  /**\n   * Doc\n   */\n  x = 1; // note\n\n'),\
+     '/* a */ keep();\nx = 1; // note\n')
+    self.assertEqual(assets.minify_css('/* a */\na > b ,\nc {\n  x: 1;\n}\n'),\
+     'a>b,c{x: 1}\n')
+    static_root = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, static_root)
+    client = Client()
+    client.login(username=self.user_credentials[0],\
+     password=self.user_credentials[1])
+    with self.settings(STATIC_ROOT=static_root):
+      content = client.get(reverse('soniferous:player')).content.decode()
+      self.assertIn('soniferous/js/views.js', content)
+      manifest = assets.build()
+      content = client.get(reverse('soniferous:player')).content.decode()
+    self.assertNotIn('soniferous/js/views.js', content)
+    for name in ('player.js', 'base.css'):
+      self.assertIn('/static/soniferous/bundles/' + manifest[name], content)
+      path = os.path.join(static_root, 'soniferous', 'bundles', manifest[name])
+      with open(path, 'rb') as file_, gzip.open(path + '.gz') as compressed:
+        self.assertEqual(file_.read(), compressed.read())
+    self.assertEqual(content.count('<script type="text/javascript" src='), 1)
+
+  def test_audio_conditional_ranges(self):
+    '''Ensures suffix, multiple and conditional ranges are honored'''
+    song = self.create_file_song()
+    size = song.music_file.size
+    url = '/song/{0}/audio'.format(song.pk)
+    client = Client()
+    client.login(username=self.user_credentials[0],\
+     password=self.user_credentials[1])
+    response = client.get(url)
+    etag = response['ETag']
+    # Suffix range
+    response = client.get(url, HTTP_RANGE='bytes=-5')
+    self.assertEqual(response['Content-Range'],\
+     'bytes {0}-{1}/{2}'.format(size - 5, size - 1, size))
+    # Multiple ranges
+    response = client.get(url, HTTP_RANGE='bytes=0-1, 4-5')
+    self.assertEqual(response.status_code, 206)
+    self.assertTrue(response['Content-Type'].startswith('multipart/'))
+    body = b''.join(response.streaming_content)
+    self.assertEqual(len(body), int(response['Content-Length']))
+    self.assertIn('bytes 4-5/{0}'.format(size).encode(), body)
+    # Revalidation
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    self.assertEqual(response.status_code, 304)
+    response = client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+    self.assertEqual(response.status_code, 304)
+    # Stale If-Range sends the whole file
+    response = client.get(url, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"old"')
+    self.assertEqual(response.status_code, 200)
+    response = client.get(url, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE=etag)
+    self.assertEqual(response.status_code, 206)
     
 
 
@@ -142,6 +696,10 @@ class ModelTests(TestCase):
     for i in range(1, 4):
       self.assertEqual(songs[0].album.artist, songs[i].album.artist)
       self.assertNotEqual(songs[0].album.artist, songs[i+4].album.artist)
+    # Songs whose file is missing are saved without its size
+    song = m.create_song('Title9', '1:00', 1, 'Album9', 'Artist9',\
+     'uploaded_music/missing.mp3')
+    self.assertIsNone(m.Song.objects.get(pk=song.pk).file_size)
 
   def test_json_formats(self):
     '''Ensure all models have correct fields when represented as JSON'''
@@ -159,6 +717,29 @@ class ModelTests(TestCase):
     obj = m.json_list('songs', [song,])
     self.assertEqual(obj['songs'][0], song.json_format())
 
+  def test_json_stream(self):
+    '''Ensure streamed listings match the json_list document'''
+    import json
+    create_test_songs()
+    for label, queryset in (('songs', m.Song.objects.order_by('pk')),\
+     ('albums', m.Album.objects.order_by('pk')),\
+     ('artists', m.Artist.objects.order_by('pk'))):
+      streamed = b''.join(m.json_stream(label, queryset, chunk_size=3))
+      self.assertEqual(json.loads(streamed.decode()),\
+       m.json_list(label, queryset))
+
+  def test_search_index_signals(self):
+    '''Ensure the search index follows changes to songs and albums'''
+    from music_player.search import search_songs
+    songs = create_test_songs()
+    self.assertEqual(len(search_songs('Album2 Artist1')), 2)
+    album = songs[2].album
+    album.album = 'Renamed'
+    album.save()
+    self.assertEqual(len(search_songs('renamed')), 2)
+    songs[2].delete()
+    self.assertEqual(search_songs('renamed'), [songs[3].pk])
+
   def test_delete_signals(self):
     '''
     Check that the signals to clean up database entries are active.
@@ -178,3 +759,358 @@ class ModelTests(TestCase):
     songs[3].delete()
     self.assertEqual(m.Artist.objects.count(), 1)
 
+  def test_modify_signals(self):
+    '''An Album left behind by a Song moving to another Album is deleted.'''
+    songs = create_test_songs()
+    album = songs[4].album
+    for song in songs[4:6]:
+      song.album = songs[0].album
+      song.save()
+    self.assertFalse(m.Album.objects.filter(pk=album.pk).exists())
+    self.assertEqual(m.Artist.objects.count(), 2)
+
+
+  def test_playlist_ranks(self):
+    '''Ensures entries are renumbered once their ranks run out'''
+    from music_player import playlists
+    user = User.objects.create_user('ranks')
+    playlist = m.Playlist.objects.create(owner=user, name='Ranks')
+    songs = [song.pk for song in create_test_songs()]
+    first, last = playlists.insert(playlist, songs[:2])
+    expected = [first[0]]
+    # Every insert halves the gap after the first entry
+    for i in range(40):
+      row = playlists.insert(playlist, [songs[2]], after=first[0])[0]
+      expected.insert(1, row[0])
+    expected.append(last[0])
+    self.assertEqual([row[0] for row in playlists.entry_rows(playlist)],\
+     expected)
+    # Moving an entry updates only its own row and the playlist
+    with self.assertNumQueries(7):
+      playlists.move(m.PlaylistEntry.objects.get(pk=last[0]), None)
+    self.assertEqual(playlists.entry_rows(playlist)[0][0], last[0])
+
+  def test_listing_query_plans(self):
+    '''Ensures listings are read in order from indexes, without sorting'''
+    from django.db import connection
+    from music_player.catalog import song_order, album_order
+    if connection.vendor != 'sqlite':
+      return
+    create_test_songs()
+    # Statistics are gathered by the migrations and after bulk changes.
+    with connection.cursor() as cursor:
+      cursor.execute('ANALYZE')
+    order = song_order + ('pk',)
+    querysets = (
+     m.Song.objects.order_by(*order).values_list(*dict(m.Song.json_fields)\
+      .values()),
+     m.Song.objects.filter(album=1).order_by(*order),
+     m.Song.objects.filter(album__artist=1).order_by(*order),
+     m.Album.objects.order_by(*album_order + ('pk',)),
+    )
+    for queryset in querysets:
+      sql, params = queryset.query.sql_with_params()
+      with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        plan = ' '.join(row[-1] for row in cursor.fetchall())
+      self.assertNotIn('TEMP B-TREE', plan, msg=sql)
+
+
+class AudioTests(TestCase):
+
+  def test_transcode_cache(self):
+    '''Ensures copies are streamed, reused and evicted'''
+    import os
+    import os.path
+    import shutil
+    import tempfile
+    from music_player import transcode
+    directory = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, directory)
+    test_file = os.path.join(os.path.dirname(__file__), 'test-data/Kappa.mp3')
+    with open(test_file, 'rb') as file_:
+      song = m.create_song('Kappa', '0:01', 1, 'Album', 'Artist',\
+       File(file_, name='Kappa.mp3'))
+    self.addCleanup(song.delete)
+    User.objects.create_user('user1', 'user1@nobody.nowhere', 'pass1')
+    client = Client()
+    client.login(username='user1', password='pass1')
+    url = '/song/{0}/audio'.format(song.pk)
+    # A copy stands in for the encoder
+    with override_settings(SONIFEROUS_TRANSCODE_DIR=directory,\
+     SONIFEROUS_TRANSCODE_COMMAND=['cp', '{input}', '{output}']):
+      self.assertEqual(client.get(url, {'bitrate': 1}).status_code, 400)
+      response = client.get(url, {'bitrate': 64})
+      self.assertEqual(b''.join(response.streaming_content),\
+       open(test_file, 'rb').read())
+      # Waits for the streamed copy to be moved into place
+      transcode.prepare(song, 64)
+      self.assertTrue(os.path.exists(transcode.cache_path(song, 64)))
+      self.assertFalse(transcode.prepare(song, 64))
+      response = client.get(url, {'bitrate': 64}, HTTP_RANGE='bytes=0-9')
+      self.assertEqual(response.status_code, 206)
+      # Least recently used copies go first
+      self.assertTrue(transcode.prepare(song, 96))
+      os.utime(transcode.cache_path(song, 64), (0, 0))
+      transcode.evict(os.path.getsize(test_file))
+      self.assertEqual(os.listdir(directory),\
+       [os.path.basename(transcode.cache_path(song, 96))])
+      # Followers give up on copies whose encoder died elsewhere
+      part_path = transcode.cache_path(song, 128) + '.part'
+      open(part_path, 'wb').close()
+      path, finished = transcode.start_transcode(test_file,\
+       transcode.cache_path(song, 128), 128)
+      self.assertFalse(finished())
+      os.utime(part_path, (0, 0))
+      self.assertTrue(finished())
+      self.assertTrue(transcode.prepare(song, 128))
+      self.assertFalse(os.path.exists(part_path))
+    # Without an encoder the original file is served
+    with override_settings(SONIFEROUS_TRANSCODE_DIR=directory,\
+     SONIFEROUS_TRANSCODE_COMMAND=['/nonexistent/encoder']),\
+     self.assertLogs('music_player.transcode', 'ERROR'):
+      response = client.get(url, {'bitrate': 64}, HTTP_RANGE='bytes=0-9')
+    self.assertEqual(response.status_code, 206)
+    self.assertEqual(b''.join(response.streaming_content),\
+     open(test_file, 'rb').read(10))
+
+  def test_parse_byte_ranges(self):
+    '''Ensures Range headers are parsed as described in RFC 7233'''
+    from music_player.audio import parse_byte_ranges
+    cases = [
+     ('bytes=0-99', [(0, 99)]),
+     ('bytes=10-', [(10, 999)]),
+     ('bytes=-100', [(900, 999)]),
+     ('bytes=-5000', [(0, 999)]),
+     ('bytes=500-2000', [(500, 999)]),
+     ('bytes=0-9,5-19,20-29,50-59', [(0, 29), (50, 59)]),
+     ('bytes=1000-', []),
+     ('bytes=-0', []),
+     ('bytes=9-2', None),
+     ('bytes=abc', None),
+     ('items=0-1', None),
+    ]
+    for header, expected in cases:
+      self.assertEqual(parse_byte_ranges(header, 1000), expected, msg=header)
+
+
+class CommandTests(TestCase):
+
+  def test_import_library(self):
+    '''
+    Ensures a directory of MP3 files can be imported and that imports
+    resume where they stopped.
+    '''
+    import os.path
+    import shutil
+    import tempfile
+    from io import StringIO
+    from django.core.management import call_command
+    directory = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, directory)
+    test_data = os.path.join(os.path.dirname(__file__), 'test-data')
+    os.mkdir(os.path.join(directory, 'nested'))
+    shutil.copy(os.path.join(test_data, 'FrankerZ.mp3'), directory)
+    shutil.copy(os.path.join(test_data, 'Kappa.mp3'),\
+     os.path.join(directory, 'nested'))
+    with open(os.path.join(directory, 'broken.mp3'), 'w') as file_:
+      file_.write('Not an MP3')
+    out = StringIO()
+    call_command('import_library', directory, workers=1, stdout=out,\
+     stderr=StringIO())
+    self.addCleanup(lambda: [song.delete() for song in m.Song.objects.all()])
+    self.assertIn('2 imported, 1 failed', out.getvalue())
+    self.assertEqual(\
+     set(m.Song.objects.values_list('title', flat=True)),\
+     {'FrankerZ', 'Unknown'})
+    for song in m.Song.objects.all():
+      self.assertTrue(os.path.isfile(song.music_file.path))
+    # Files already imported are skipped
+    call_command('import_library', directory, workers=1, stdout=StringIO(),\
+     stderr=StringIO())
+    self.assertEqual(m.Song.objects.count(), 2)
+
+  def test_failed_batch(self):
+    '''Ensures the files of a batch that fails are removed from storage'''
+    import os
+    import os.path
+    import shutil
+    import tempfile
+    from music_player import library
+    media_root = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, media_root)
+    test_data = os.path.join(os.path.dirname(__file__), 'test-data')
+    batch = [library.extract_info(os.path.join(test_data, name))[:2] \
+     for name in ('FrankerZ.mp3', 'Kappa.mp3')]
+    # The second song cannot be inserted
+    del batch[1][1]['time']
+    with override_settings(MEDIA_ROOT=media_root):
+      with self.assertRaises(KeyError):
+        library.store_songs(library.CatalogResolver(), batch)
+      self.assertFalse(m.Song.objects.exists())
+      self.assertEqual(\
+       os.listdir(os.path.join(media_root, 'uploaded_music')), [])
+
+  def test_rescan_library(self):
+    '''Ensures rescans only read changed files and find added/removed ones'''
+    import os
+    import os.path
+    import shutil
+    import tempfile
+    from music_player.library import rescan
+    media_root = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, media_root)
+    test_data = os.path.join(os.path.dirname(__file__), 'test-data')
+    with override_settings(MEDIA_ROOT=media_root):
+      with open(os.path.join(test_data, 'Kappa.mp3'), 'rb') as file_:
+        song = m.create_song('Kappa', '0:01', 1, 'Album', 'Artist',\
+         File(file_, name='Kappa.mp3'))
+      # Songs are hashed by the first rescan, not when they are saved
+      self.assertFalse(song.file_hash)
+      self.assertEqual(song.file_size, os.path.getsize(song.music_file.path))
+      path = song.music_file.path
+      self.assertEqual(rescan(workers=1)['touched'], 1)
+      self.assertTrue(m.Song.objects.get(pk=song.pk).file_hash)
+      counts = rescan(workers=1)
+      self.assertEqual(counts['unchanged'], 1)
+      # Only the modification time changed
+      os.utime(path, (0, 0))
+      self.assertEqual(rescan(workers=1)['touched'], 1)
+      # New contents
+      shutil.copy(os.path.join(test_data, 'FrankerZ.mp3'), path)
+      self.assertEqual(rescan(workers=1)['updated'], 1)
+      self.assertEqual(m.Song.objects.get(pk=song.pk).title, 'FrankerZ')
+      self.assertFalse(m.Album.objects.filter(album='Album').exists())
+      # Added and removed files
+      shutil.copy(os.path.join(test_data, 'Kappa.mp3'),\
+       os.path.join(os.path.dirname(path), 'Added.mp3'))
+      shutil.copy(os.path.join(test_data, 'Kappa.mp3'),\
+       os.path.join(os.path.dirname(path), 'Added2.mp3'))
+      os.remove(path)
+      # Each file in its own transaction
+      counts = rescan(workers=1, batch_size=1)
+      self.assertEqual((counts['added'], counts['removed']), (2, 1))
+      self.assertEqual(list(m.Song.objects.values_list('title', flat=True)),\
+       ['Unknown', 'Unknown'])
+
+
+class UploadJobTests(TestCase):
+
+  def test_process_job(self):
+    '''Ensures upload jobs turn valid MP3s into songs and report failures'''
+    import os.path
+    from django.core.files.base import ContentFile
+    from music_player.jobs import process_job, process_pending
+    test_file = os.path.join(os.path.dirname(__file__),\
+     'test-data/FrankerZ.mp3')
+    with open(test_file, 'rb') as file_:
+      job = m.UploadJob.objects.create(file_name='FrankerZ.mp3',\
+       music_file=File(file_, name='FrankerZ.mp3'))
+    pending_path = job.music_file.path
+    broken = m.UploadJob.objects.create(file_name='broken.mp3',\
+     music_file=ContentFile(b'Not an MP3', name='broken.mp3'))
+    self.addCleanup(broken.delete)
+    self.assertEqual(process_pending(), 2)
+    job.refresh_from_db()
+    self.addCleanup(job.song.delete)
+    self.assertEqual(job.status, m.UploadJob.DONE)
+    self.assertEqual(job.song.title, 'FrankerZ')
+    # The worker hashes the file it reads anyway
+    self.assertEqual(job.song.file_hash, m.file_fingerprint(test_file)[2])
+    self.assertFalse(os.path.isfile(pending_path))
+    broken.refresh_from_db()
+    self.assertEqual(broken.status, m.UploadJob.FAILED)
+    self.assertTrue(broken.error)
+    # Jobs are only processed once
+    self.assertFalse(process_job(job.pk))
+    # A song that cannot be saved leaves no file behind
+    from django.db.models import signals
+    def fail(**kwargs):
+      raise ValueError('Database error')
+    music_dir = os.path.dirname(job.song.music_file.path)
+    stored = set(os.listdir(music_dir))
+    with open(test_file, 'rb') as file_:
+      failing = m.UploadJob.objects.create(file_name='FrankerZ.mp3',\
+       music_file=File(file_, name='FrankerZ.mp3'))
+    self.addCleanup(failing.delete)
+    signals.post_save.connect(fail, sender=m.Song)
+    try:
+      self.assertTrue(process_job(failing.pk))
+    finally:
+      signals.post_save.disconnect(fail, sender=m.Song)
+    failing.refresh_from_db()
+    self.assertEqual(failing.status, m.UploadJob.FAILED)
+    self.assertIn('Database error', failing.error)
+    self.assertEqual(set(os.listdir(music_dir)), stored)
+
+  def test_admin_upload(self):
+    '''Ensures several files can be queued from the admin at once'''
+    import os.path
+    User.objects.create_superuser('admin', 'admin@nobody.nowhere', 'doge')
+    client = Client()
+    client.login(username='admin', password='doge')
+    test_data = os.path.join(os.path.dirname(__file__), 'test-data')
+    with open(os.path.join(test_data, 'FrankerZ.mp3'), 'rb') as file1, \
+     open(os.path.join(test_data, 'Kappa.mp3'), 'rb') as file2:
+      response = client.post('/admin/music_player/uploadjob/add/',\
+       {'music_file': [file1, file2]})
+    self.assertEqual(response.status_code, 302)
+    jobs = m.UploadJob.objects.order_by('pk')
+    for job in jobs:
+      self.addCleanup(job.delete)
+    self.assertEqual([(job.file_name, job.status) for job in jobs],\
+     [('FrankerZ.mp3', 'pending'), ('Kappa.mp3', 'pending')])
+
+
+@override_settings(SONIFEROUS_DEFERRED_CLEANUP=True)
+class DeferredCleanupTests(TransactionTestCase):
+
+  def test_deferred_cleanup(self):
+    '''
+    Check that deferred cleanups happen once the transaction commits.
+    '''
+    from django.db import transaction
+    create_test_songs()
+    with transaction.atomic():
+      m.Song.objects.filter(album__artist__artist='Artist2').delete()
+      self.assertEqual(m.Album.objects.count(), 4)
+      self.assertEqual(m.Artist.objects.count(), 2)
+    self.assertEqual(m.Album.objects.count(), 2)
+    self.assertEqual(m.Artist.objects.count(), 1)
+
+
+class CatalogVersionTests(TransactionTestCase):
+
+  def test_bump_once_per_transaction(self):
+    '''
+    Ensures a transaction moves the catalog version a bounded number of
+    times however many songs it changes.
+    '''
+    from django.db import connection, transaction
+    from django.test.utils import CaptureQueriesContext
+    from music_player import catalog
+    create_test_songs()
+    version = catalog.get_version()
+    def count_bumps(queries):
+      return sum(1 for query in queries.captured_queries \
+       if query['sql'].startswith('UPDATE "music_player_catalogversion"'))
+    with CaptureQueriesContext(connection) as queries:
+      with transaction.atomic():
+        for song in m.Song.objects.all():
+          song.delete()
+    # Once at the first change and once on commit
+    self.assertEqual(count_bumps(queries), 2)
+    self.assertNotEqual(catalog.get_version(), version)
+    # A rolled back transaction does not hide the changes of the next one
+    version = catalog.get_version()
+    with transaction.atomic():
+      m.Artist.objects.create(artist='Rolled back')
+      transaction.set_rollback(True)
+    with transaction.atomic():
+      m.Artist.objects.create(artist='Committed')
+      inside = catalog.get_version()
+      self.assertNotEqual(inside, version)
+      # Read in between, so the next change bumps again
+      m.Artist.objects.create(artist='Committed too')
+      self.assertNotEqual(catalog.get_version(), inside)
+    self.assertNotEqual(catalog.get_version(), version)
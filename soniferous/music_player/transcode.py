@@ -0,0 +1,242 @@
+'''
+Lower bitrate copies of songs for listeners on slow or metered links.
+
+Copies are made by an encoder subprocess (SONIFEROUS_TRANSCODE_COMMAND,
+ffmpeg by default) and kept in SONIFEROUS_TRANSCODE_DIR. The first request
+for a copy is streamed while the encoder writes it. Later requests are
+served from the finished file with range support. The access time of a
+copy is updated whenever it is served and the least recently used copies
+are evicted once the directory grows past
+SONIFEROUS_TRANSCODE_CACHE_SIZE bytes.
+'''
+import logging
+import os
+import os.path
+import subprocess
+import threading
+import time
+
+from django.conf import settings
+from django.core.files import File
+from django.http import HttpResponseServerError, StreamingHttpResponse
+
+from music_player.audio import BLOCK_SIZE, get_backend, serve_audio
+
+logger = logging.getLogger(__name__)
+
+default_command = ('ffmpeg', '-v', 'error', '-y', '-i', '{input}',\
+ '-map', '0:a', '-codec:a', 'libmp3lame', '-b:a', '{bitrate}k',\
+ '-f', 'mp3', '{output}')
+# A partial file that has not grown for this many seconds is abandoned.
+stale_seconds = 60
+# Encoders started by this process. { final path: Popen }
+_running = {}
+_running_lock = threading.Lock()
+
+def get_bitrates():
+  '''Return: tuple(int), the bitrates (kbps) listeners may ask for.'''
+  return getattr(settings, 'SONIFEROUS_TRANSCODE_BITRATES', (64, 96, 128))
+
+def get_directory():
+  '''Return: str, the directory holding the transcoded copies.'''
+  directory = getattr(settings, 'SONIFEROUS_TRANSCODE_DIR',\
+   os.path.join(settings.BASE_DIR, 'transcode_cache'))
+  os.makedirs(directory, exist_ok=True)
+  return directory
+
+def cache_path(song, bitrate):
+  '''
+  Finds where the copy of a song at a bitrate is kept. The name includes
+  the content hash so that changed files are transcoded again.
+  Args:
+   song - Song, the song to transcode
+   bitrate - int, the bitrate in kbps
+  Return: str, the path of the copy.
+  '''
+  key = song.file_hash[:32] if song.file_hash else str(song.pk)
+  return os.path.join(get_directory(),\
+   '{0}-{1}-{2}k.mp3'.format(song.pk, key, bitrate))
+
+def evict(limit=None):
+  '''
+  Removes the least recently used copies until the cache fits its limit.
+  Args: limit - int, the maximum size of the cache in bytes
+  '''
+  if limit is None:
+    limit = getattr(settings, 'SONIFEROUS_TRANSCODE_CACHE_SIZE', 2 << 30)
+  directory = get_directory()
+  files = []
+  for name in os.listdir(directory):
+    if name.endswith('.mp3'):
+      try:
+        stat = os.stat(os.path.join(directory, name))
+      except OSError:
+        continue
+      files.append((stat.st_atime, stat.st_size, name))
+  total = sum(size for atime, size, name in files)
+  for atime, size, name in sorted(files):
+    if total <= limit:
+      break
+    try:
+      os.remove(os.path.join(directory, name))
+    except OSError:
+      pass
+    total -= size
+
+def _finish(process, part_path, path):
+  '''Moves a finished copy into place, or discards a failed one.'''
+  process.wait()
+  if process.returncode == 0:
+    os.replace(part_path, path)
+    evict()
+  else:
+    try:
+      os.remove(part_path)
+    except OSError:
+      pass
+  with _running_lock:
+    _running.pop(path, None)
+
+def start_transcode(source, path, bitrate):
+  '''
+  Starts encoding a copy unless this or another process already is.
+  Args:
+   source - str, the path of the original file
+   path - str, the path of the finished copy
+   bitrate - int, the bitrate in kbps
+  Return: tuple(str, callable), the partial file being written and a
+   function returning True once the encoder has stopped.
+  '''
+  part_path = path + '.part'
+  with _running_lock:
+    process = _running.get(path)
+    if process is None:
+      if os.path.exists(path):
+        # An encoder finished the copy in the meantime.
+        return part_path, lambda: True
+      try:
+        # Abandoned partial files are left by encoders that died.
+        if time.time() - os.stat(part_path).st_mtime > stale_seconds:
+          os.remove(part_path)
+      except OSError:
+        pass
+      try:
+        os.close(os.open(part_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+      except FileExistsError:
+        # Another process is writing the copy.
+        return part_path, lambda: _abandoned(part_path)
+      command = getattr(settings, 'SONIFEROUS_TRANSCODE_COMMAND',\
+       default_command)
+      try:
+        process = subprocess.Popen([arg.format(input=source,\
+         output=part_path, bitrate=bitrate) for arg in command],\
+         stdin=subprocess.DEVNULL)
+      except OSError:
+        os.remove(part_path)
+        raise
+      _running[path] = process
+      threading.Thread(target=_finish, args=(process, part_path, path),\
+       daemon=True).start()
+  # Done once the copy has been moved into place or discarded.
+  return part_path, lambda: _running.get(path) is not process
+
+def _abandoned(part_path):
+  '''
+  Tells whether the encoder of another process has stopped writing a
+  partial file: it is gone, or it has not grown for stale_seconds because
+  that process died before it could clean up.
+  Args: part_path - str, the partial file
+  Return: bool, True if no more data will be written.
+  '''
+  try:
+    return time.time() - os.stat(part_path).st_mtime > stale_seconds
+  except OSError:
+    return True
+
+def follow_file(file_, finished, poll_interval=0.05):
+  '''
+  A generator returning the contents of a file while it is being written.
+  Args:
+   file_ - file, the file being written, opened for reading
+   finished - callable, returns True once the writer has stopped or
+    abandoned the file
+   poll_interval - float, seconds to wait for more data
+  Yield: The current chunk of bytes to serve
+  '''
+  with file_:
+    while True:
+      chunk = file_.read(BLOCK_SIZE * 16)
+      if chunk:
+        yield chunk
+      elif finished():
+        chunk = file_.read()
+        if chunk:
+          yield chunk
+        return
+      else:
+        time.sleep(poll_interval)
+
+def prepare(song, bitrate):
+  '''
+  Creates the copy of a song at a bitrate if it does not exist yet and
+  waits for it to be finished.
+  Args:
+   song - Song, the song to transcode
+   bitrate - int, the bitrate in kbps
+  Return: bool, True if a copy was created.
+  '''
+  path = cache_path(song, bitrate)
+  if os.path.exists(path):
+    return False
+  while True:
+    part_path, finished = start_transcode(song.music_file.path, path,\
+     bitrate)
+    while not finished():
+      time.sleep(0.05)
+    # A stale partial file is removed by the next start_transcode, which
+    # then encodes the copy itself.
+    if os.path.exists(path) or not os.path.exists(part_path):
+      return os.path.exists(path)
+
+def serve_transcoded(request, song, bitrate):
+  '''
+  Serves a copy of a song at a lower bitrate, encoding it if needed. The
+  original file is served if the encoder cannot be started.
+  Args:
+   request - HttpRequest, the request for the song
+   song - Song, the song to serve
+   bitrate - int, the bitrate in kbps
+  Return: HttpResponse, the response containing the copy.
+  '''
+  path = cache_path(song, bitrate)
+  if os.path.exists(path):
+    # Marks the copy as recently used. The mtime is kept for the ETag.
+    os.utime(path, (time.time(), os.stat(path).st_mtime))
+    cached = File(open(path, 'rb'))
+    cached.path = path
+    # nginx only knows the location of the uploaded files.
+    backend = get_backend()
+    if backend == 'x_accel_redirect':
+      backend = 'python'
+    return serve_audio(request, cached, backend=backend)
+  try:
+    part_path, finished = start_transcode(song.music_file.path, path,\
+     bitrate)
+  except OSError:
+    # The encoder is missing or cannot be run.
+    logger.exception('Could not start the encoder for song %s.', song.pk)
+    return serve_audio(request, song.music_file, song.file_size,\
+     song.file_mtime)
+  try:
+    file_ = open(part_path, 'rb')
+  except FileNotFoundError:
+    # The encoder already finished or failed
+    if os.path.exists(path):
+      return serve_transcoded(request, song, bitrate)
+    return HttpResponseServerError()
+  response = StreamingHttpResponse(follow_file(file_, finished),\
+   content_type='audio/mpeg')
+  # The length is unknown until the encoder is done.
+  response['Accept-Ranges'] = 'none'
+  response['Cache-Control'] = 'no-store'
+  return response
@@ -16,13 +16,33 @@ urlpatterns = [
      }, name='password'),
     # Logout
     url(r'^logout$', django_auth.logout_then_login, name='logout'),
+    # Metrics
+    url(r'^metrics$', views.request_metrics, name='metrics'),
+    # Search
+    url(r'^search/?$', views.search_songs, name='search'),
     # Songs
     url(r'^song(?:/(?P<pk>\d+))?/?$', views.SongView.as_view(), name='songs'),
-    url(r'^song/(?P<pk>\d+)/audio$', views.SongView.audio),
+    url(r'^song/(?P<pk>\d+)/audio$', views.SongView.audio, name='audio'),
+    url(r'^song/(?P<pk>\d+)/audio/url$', views.SongView.audio_url,
+     name='audio-url'),
+    url(r'^audio/(?P<token>[-\w:]+)$', views.signed_audio,
+     name='signed-audio'),
     # Albums
     url(r'^album(?:/(?P<pk>\d+))?/?$',
      views.AlbumView.as_view(), name='albums'),
     # Artists
     url(r'^artist(?:/(?P<pk>\d+))?/?$',
      views.ArtistView.as_view(), name='artists'),
+    # Playlists
+    url(r'^playlist(?:/(?P<pk>\d+))?/?$',
+     views.PlaylistView.as_view(), name='playlists'),
+    url(r'^playlist/(?P<pk>\d+)/entries(?:/(?P<entry>\d+))?/?$',
+     views.PlaylistEntryView.as_view(), name='playlist-entries'),
+    # Play queue
+    url(r'^queue/?$', views.PlaylistView.as_view(), {'queue': True},
+     name='queue'),
+    url(r'^queue/upcoming$', views.queue_upcoming, name='queue-upcoming'),
+    url(r'^queue/entries(?:/(?P<entry>\d+))?/?$',
+     views.PlaylistEntryView.as_view(), {'queue': True},
+     name='queue-entries'),
 ]
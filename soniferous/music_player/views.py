@@ -1,45 +1,230 @@
-import os.path
-import re
+import base64
+import json
+import os
 
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib.admin.views.decorators import staff_member_required
+from django.core import signing
+from django.core.urlresolvers import reverse
 from django.db import transaction
-from django.http import HttpResponse, JsonResponse
+from django.db.models import Q
+from django.http import Http404, HttpResponse, HttpResponseBadRequest,\
+ HttpResponseForbidden, HttpResponseGone, JsonResponse, QueryDict,\
+ StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render, redirect
+from django.utils.crypto import constant_time_compare
 from django.utils.decorators import method_decorator
 from django.views.generic import View
 
-from music_player.models import Song, Album, Artist, json_list
+from music_player import catalog, metrics, playlists, search, transcode
+from music_player.audio import get_backend, read_audio_token,\
+ serve_audio, sign_audio_file, warm_start_range
+from music_player.catalog import song_order, album_order, artist_order
+from music_player.models import Song, Album, Artist, Playlist,\
+ PlaylistEntry, compact_list, json_stream
 
-# Left in scope here so that it is compiled at module load time.
-byte_range_re = re.compile(r'bytes=(\d+)-(\d+)?')
-# Used by multiple functions/methods below.
-song_order = ('album__artist__artist', 'album__album', 'track_number')
+# The largest page size a client may request.
+max_page_size = 1000
+# The most upcoming songs of the queue a client may ask for.
+max_upcoming = 5
+# Media type of song listings in the format of compact_list.
+compact_content_type = 'application/vnd.soniferous.compact+json'
 
-def file_range_generator(field_file, block_size, start, stop):
+def encode_cursor(values):
   '''
-  A generator capable of returning a portion of a fieldfile.
+  Encodes the sort values of the last row on a page as an opaque cursor.
+  Args: values - list, the values of the ordering fields
+  Return: str, the url-safe cursor.
+  '''
+  data = json.dumps(values, separators=(',', ':')).encode()
+  return base64.urlsafe_b64encode(data).decode()
+
+def decode_cursor(cursor, length):
+  '''
+  Decodes a cursor created by encode_cursor.
+  Args:
+   cursor - str, the cursor to decode
+   length - int, the number of values the cursor must hold
+  Return: list, the values of the ordering fields or None if invalid.
+  '''
+  try:
+    values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+  except ValueError:
+    return None
+  if not isinstance(values, list) or len(values) != length:
+    return None
+  return values
+
+def keyset_filter(order, values):
+  '''
+  Builds a filter selecting the rows that sort after the given values.
   Args:
-   field_file - fieldfile, the file to read data from
-   block_size - int, the size of the buffer to serve
-   start - int, the first byte served
-   stop - int, the last byte served
-  Yield: The current chunk of bytes to serve
-  '''
-  field_file.seek(start)
-  remaining = stop - start + 1
-  while remaining > 0:
-    if remaining < block_size:
-      block_size = remaining
-    yield field_file.read(block_size)
-    remaining -= block_size
+   order - tuple(str), the ordering lookups, unique when taken together
+   values - list, the values of the ordering lookups to start after
+  Return: Q, the filter.
+  '''
+  query = Q()
+  for i, lookup in enumerate(order):
+    condition = Q(**{lookup + '__gt': values[i]})
+    for j in range(i):
+      condition &= Q(**{order[j]: values[j]})
+    query |= condition
+  return query
+
+def wants_compact(request):
+  '''
+  Checks whether songs should be listed in the format of compact_list,
+  which is selected with format=compact or the Accept header.
+  Args: request - HttpRequest, the request for the listing
+  Return: bool, True if the compact format was asked for.
+  '''
+  return request.GET.get('format') == 'compact' or \
+   compact_content_type in request.META.get('HTTP_ACCEPT', '')
+
+def compact_response(songs, **extra):
+  '''
+  Sends songs to the user in the format of compact_list.
+  Args:
+   songs - iterable(dict), the songs in the format of json_format
+   extra - further members of the json document
+  Return: HttpResponse, the response containing the songs.
+  '''
+  document = compact_list(songs)
+  document.update(extra)
+  return HttpResponse(json.dumps(document, separators=(',', ':')),\
+   content_type=compact_content_type)
+
+def read_page_limit(request):
+  '''
+  Args: request - HttpRequest, the request for a page of a listing
+  Return: int, the page size asked for with the limit parameter, within
+   the allowed range, or None if the parameter is not a number.
+  '''
+  try:
+    limit = int(request.GET.get('limit', max_page_size))
+  except ValueError:
+    return None
+  return max(1, min(limit, max_page_size))
+
+def json_list_response(request, label, queryset, order):
+  '''
+  Sends a json listing of the given models to the user. The full listing
+  is streamed unless the request asks for a page with the limit parameter.
+  Pages are selected with keyset pagination: the after parameter is the
+  cursor found in the next link of the previous page. Songs are sent in
+  the compact format if the request asks for it.
+  Args:
+   request - HttpRequest, the request for the listing
+   label - str, the name of the list in the json document
+   queryset - queryset, the models to list
+   order - tuple(str), the ordering lookups of the listing
+  Return: HttpResponse, the response containing the listing.
+  '''
+  # A primary key tiebreaker makes the ordering total.
+  order = order + ('pk',)
+  queryset = queryset.order_by(*order)
+  compact = queryset.model is Song and wants_compact(request)
+  if 'limit' not in request.GET and 'after' not in request.GET:
+    if compact:
+      keys, lookups = zip(*Song.json_fields)
+      return compact_response(dict(zip(keys, row)) for row in \
+       queryset.values_list(*lookups).iterator())
+    return StreamingHttpResponse(\
+     json_stream(label, queryset), content_type='application/json')
+  limit = read_page_limit(request)
+  if limit is None:
+    return HttpResponseBadRequest()
+  if 'after' in request.GET:
+    after = decode_cursor(request.GET['after'], len(order))
+    if after is None:
+      return HttpResponseBadRequest()
+    queryset = queryset.filter(keyset_filter(order, after))
+  lookups = [lookup for key, lookup in queryset.model.json_fields]
+  rows = [dict(zip(lookups, row)) for row in \
+   queryset.values_list(*lookups)[:limit + 1]]
+  next_url = None
+  if len(rows) > limit:
+    rows = rows[:limit]
+    cursor = encode_cursor([rows[-1][lookup] for lookup in order])
+    # Only the parameters the listing reads, since pages are cached and
+    # shared between requests.
+    params = QueryDict(mutable=True)
+    if 'format' in request.GET:
+      params['format'] = request.GET['format']
+    params['limit'] = limit
+    params['after'] = cursor
+    next_url = request.path + '?' + params.urlencode()
+  models = [{key: row[lookup] for key, lookup in queryset.model.json_fields}\
+   for row in rows]
+  if compact:
+    return compact_response(models, next=next_url)
+  return JsonResponse({label: models, 'next': next_url})
+
+def cached_listing(request, label, queryset, order):
+  '''
+  Serves a json_list_response through the catalog cache. The listing is
+  cached under the parameters it reads, so that other parameters cannot
+  fill the cache with copies of it.
+  '''
+  create_response = lambda: json_list_response(request, label, queryset,\
+   order)
+  variant = 'compact' if queryset.model is Song and wants_compact(request)\
+   else 'json'
+  if 'limit' in request.GET or 'after' in request.GET:
+    limit = read_page_limit(request)
+    if limit is None:
+      return create_response()
+    variant += ' {0} {1}'.format(limit, request.GET.get('after', ''))
+  return catalog.cached_response(request, create_response, variant)
 
 # Misc Views
 @login_required
 def player(request):
-  '''Displays a basic music player view with controls.'''
-  songs = Song.objects.select_related().all().order_by(*song_order)
-  return render(request, 'soniferous/player.html', {'songs':songs})
+  '''
+  Displays a basic music player view with controls. The catalog is
+  embedded in the page so that the player can start without fetching the
+  listings.
+  '''
+  return render(request, 'soniferous/player.html',\
+   {'catalog': catalog.snapshot()})
+
+@login_required
+def search_songs(request):
+  '''
+  Displays a json listing of the songs matching the q parameter, best
+  match first. The number of results can be limited with limit.
+  '''
+  try:
+    limit = int(request.GET.get('limit', search.default_limit))
+  except ValueError:
+    return HttpResponseBadRequest()
+  ids = search.search_songs(request.GET.get('q', ''), limit)
+  lookups = [lookup for key, lookup in Song.json_fields]
+  rows = {row[0]: row for row in \
+   Song.objects.filter(pk__in=ids).values_list(*lookups)}
+  songs = [{key: value for (key, lookup), value in \
+   zip(Song.json_fields, rows[pk])} for pk in ids if pk in rows]
+  if wants_compact(request):
+    return compact_response(songs)
+  return JsonResponse({'songs': songs})
+
+def request_metrics(request):
+  '''
+  Displays the request metrics of this process in the Prometheus text
+  format. Requires a staff user or, for scrapers, the bearer token in
+  SONIFEROUS_METRICS_TOKEN.
+  '''
+  token = getattr(settings, 'SONIFEROUS_METRICS_TOKEN', None)
+  if token and constant_time_compare(\
+   request.META.get('HTTP_AUTHORIZATION', ''), 'Bearer ' + token):
+    return _metrics_response(request)
+  return staff_member_required(_metrics_response)(request)
+
+def _metrics_response(request):
+  '''Return: HttpResponse, the rendered metrics.'''
+  return HttpResponse(metrics.registry.render(),\
+   content_type=metrics.content_type)
 
 # Songs 
 class SongView(View):
@@ -56,8 +241,7 @@ class SongView(View):
       song = get_object_or_404(Song.objects.select_related(), pk=pk)
       return JsonResponse(song.json_format())
     else:
-      songs = Song.objects.select_related().all().order_by(*song_order)
-      return JsonResponse(json_list('songs', songs))
+      return cached_listing(request, 'songs', Song.objects.all(), song_order)
 
   @method_decorator(staff_member_required)
   @method_decorator(transaction.atomic)
@@ -76,44 +260,89 @@ class SongView(View):
   @login_required
   def audio(request, pk):
     '''
-    Serves a song's file to the user. Supports HTTP range requests so that
-    partial files can be sent to the user instead of a bulk transfer.
+    Serves a song's file to the user. Supports HTTP range and conditional
+    requests so that partial files or nothing at all can be sent to the
+    user instead of a bulk transfer. A lower bitrate copy is served if
+    the bitrate parameter names one of the allowed bitrates. The size and
+    modification time stored with the song are used instead of reading
+    them from storage.
     '''
-    block_size = 4096
-    song = get_object_or_404(Song, pk=pk)
-    song.music_file.open()
-    # Attempt to serve partial ranges if necessary
-    if 'HTTP_RANGE' in request.META:
-      match = byte_range_re.match(request.META['HTTP_RANGE'])
-      if not match:
-        return HttpResponse(status=416)
-      ranges = match.groups()
-      start_range = int(ranges[0])
-      if ranges[1]:
-        stop_range = int(ranges[1])
-      else:
-        stop_range = song.music_file.size - 1
-      # Valid ranges get data served
-      if len(ranges) == 2 and (0 <= stop_range < song.music_file.size):
-        file_wrapper = file_range_generator(\
-         song.music_file, block_size, start_range, stop_range)
-        response = HttpResponse(file_wrapper, status=206)
-        response['Content-Length'] = str(stop_range - start_range + 1)
-        response['Content-Range'] = 'bytes {0}-{1}/{2}'.format(\
-        start_range, stop_range, song.music_file.size)
-      # Immediately exit on invalid range
-      else:
-        return HttpResponse(status=416)
-    # Standard file serving
+    song = get_object_or_404(\
+     Song.objects.only('music_file', 'file_size', 'file_mtime', 'file_hash'),\
+     pk=pk)
+    if 'bitrate' in request.GET:
+      try:
+        bitrate = int(request.GET['bitrate'])
+      except ValueError:
+        return HttpResponseBadRequest()
+      if bitrate not in transcode.get_bitrates():
+        return HttpResponseBadRequest()
+      return transcode.serve_transcoded(request, song, bitrate)
+    return serve_audio(request, song.music_file, song.file_size,\
+     song.file_mtime)
+
+  @login_required
+  def audio_url(request, pk):
+    '''
+    Displays a signed url of a song's file, which its range requests can
+    use without a session or a database query.
+    '''
+    song = get_object_or_404(\
+     Song.objects.only('music_file', 'file_size', 'file_mtime'), pk=pk)
+    signed = signed_audio_url(song)
+    if signed is None:
+      return HttpResponse(status=404)
+    return JsonResponse({'url': signed[0], 'size': signed[1]})
+
+def signed_audio_url(song):
+  '''
+  Args: song - Song, with music_file, file_size and file_mtime loaded
+  Return: tuple(str, int), the signed audio url and the size of the song's
+   file, or None if the file cannot be read.
+  '''
+  size, mtime = song.file_size, song.file_mtime
+  if size is None or mtime is None:
+    try:
+      stat = os.stat(song.music_file.path)
+    except (OSError, ValueError):
+      return None
+    size, mtime = stat.st_size, stat.st_mtime
+  token = sign_audio_file(song.music_file.name, size, mtime)
+  return reverse('soniferous:signed-audio', kwargs={'token': token}), size
+
+def signed_audio(request, token):
+  '''
+  Serves the file named by the token of a signed audio url, like
+  SongView.audio does. The signature stands in for the login, so neither
+  the session nor the database is used. The size and modification time in
+  the token are checked against the file, which may have been replaced
+  since the url was signed.
+  '''
+  try:
+    name, size, mtime = read_audio_token(token)
+  except signing.BadSignature:
+    return HttpResponseForbidden()
+  field = Song._meta.get_field('music_file')
+  field_file = field.attr_class(None, field, name)
+  backend = get_backend()
+  try:
+    if backend == 'python':
+      # Checks the file that is actually served.
+      field_file.open()
+      stat = os.fstat(field_file.fileno())
     else:
-      file_wrapper = iter(lambda: song.music_file.read(block_size), b'')
-      response = HttpResponse(file_wrapper)
-      response['Content-Length'] = str(song.music_file.size)
-    response['Accept-Ranges'] = 'bytes'
-    response['Content-Type'] = 'audio/mpeg'
-    response['Content-Disposition'] = \
-     'attachment; filename="{}"'.format(os.path.basename(song.music_file.name))
-    return response
+      stat = os.stat(field_file.path)
+    if stat.st_size != size or stat.st_mtime != mtime:
+      field_file.close()
+      return HttpResponseGone()
+    response = serve_audio(request, field_file, size, mtime, backend)
+  except (IOError, OSError):
+    # The song was removed after the url was signed.
+    field_file.close()
+    raise Http404('Song file not found.')
+  if not response.streaming:
+    field_file.close()
+  return response
 
 
 # Albums
@@ -126,13 +355,11 @@ class AlbumView(View):
     Otherwise, provide a listing of all albums.
     '''
     if pk:
-      songs = Song.objects.select_related()\
-       .filter(album=pk).order_by(*song_order)
-      return JsonResponse(json_list('songs', songs))
+      songs = catalog.songs_of('album', pk)
+      return cached_listing(request, 'songs', songs, song_order)
     else:
-      albums = Album.objects.select_related()\
-       .all().order_by('artist__artist', 'album')
-      return JsonResponse(json_list('albums', albums))
+      return cached_listing(request, 'albums', Album.objects.all(),\
+       album_order)
 
 # Artists
 class ArtistView(View):
@@ -144,10 +371,253 @@ class ArtistView(View):
     Otherwise, displays a json listing of all artists.
     '''
     if pk:
-      songs = Song.objects.select_related()\
-       .filter(album__artist=pk).order_by(*song_order)
-      return JsonResponse(json_list('songs', songs))
+      songs = catalog.songs_of('artist', pk)
+      return cached_listing(request, 'songs', songs, song_order)
     else:
-      artists = Artist.objects.all().order_by('artist')
-      return JsonResponse(json_list('artists', artists))
+      return cached_listing(request, 'artists', Artist.objects.all(),\
+       artist_order)
 
+
+# Playlists
+def read_json_body(request):
+  '''
+  Args: request - HttpRequest, a request with a json object as its body
+  Return: dict, the object, or None if the body is not a json object.
+  '''
+  try:
+    body = json.loads(request.body.decode('utf-8'))
+  except ValueError:
+    return None
+  return body if isinstance(body, dict) else None
+
+def read_ids(body, key):
+  '''
+  Args:
+   body - dict, the json body of a request
+   key - str, the member holding a list of ids
+  Return: list(int), the ids, or None if the member is not a list of ids.
+  '''
+  ids = body.get(key)
+  if not isinstance(ids, list) or not all(isinstance(pk, int) and \
+   not isinstance(pk, bool) for pk in ids):
+    return None
+  return ids
+
+def read_after(body):
+  '''
+  Reads where entries go from the after member of a request body: the id
+  of the entry they follow, null for the start of the playlist or, if the
+  member is missing, the end of it.
+  Return: int, None or False as expected by playlists.insert, or '' if
+   the member is not valid.
+  '''
+  after = body.get('after', False)
+  if after is None or after is False or \
+   (isinstance(after, int) and not isinstance(after, bool)):
+    return after
+  return ''
+
+def get_playlist(request, pk, queue):
+  '''
+  Return: Playlist, the user's queue if queue is set, otherwise the user's
+   playlist with the given pk.
+  Raises: Http404 if the user has no such playlist.
+  '''
+  if queue:
+    return playlists.get_queue(request.user)
+  return get_object_or_404(Playlist, pk=pk, owner=request.user,\
+   is_queue=False)
+
+def playlist_document(playlist, rows):
+  '''
+  Args:
+   playlist - Playlist, the playlist to display
+   rows - list(tuple(int, int, int)), the entries as in entry_rows
+  Return: dict, the playlist with its entries as a table of entry ids,
+   ranks and song ids.
+  '''
+  document = playlist.json_format()
+  document['entries'] = {'fields': ('id', 'rank', 'song'), 'rows': rows}
+  return document
+
+@login_required
+def queue_upcoming(request):
+  '''
+  Displays the songs of the user's queue that play after the one at
+  position, with what the player needs to load them ahead of time: the
+  signed audio url, size, duration and the warm start byte range. count
+  sets how many songs are listed, up to max_upcoming.
+  '''
+  try:
+    position = int(request.GET.get('position', -1))
+    count = int(request.GET.get('count', 1))
+  except ValueError:
+    return HttpResponseBadRequest()
+  count = max(1, min(count, max_upcoming))
+  rows = playlists.upcoming(playlists.get_queue(request.user), position, count)
+  songs = Song.objects.only('music_file', 'file_size', 'file_mtime',\
+   'duration', 'bitrate', 'audio_offset')\
+   .in_bulk([song_id for position, pk, song_id in rows])
+  upcoming = []
+  for position, pk, song_id in rows:
+    # Songs deleted since the queue was read are skipped.
+    song = songs.get(song_id)
+    if song is None:
+      continue
+    signed = signed_audio_url(song)
+    if signed is None:
+      continue
+    url, size = signed
+    upcoming.append({
+     'position': position,
+     'entry': pk,
+     'song': song_id,
+     'url': url,
+     'size': size,
+     'duration': song.duration,
+     'warm_start': warm_start_range(size, song.bitrate, song.audio_offset),
+    })
+  return JsonResponse({'upcoming': upcoming})
+
+class PlaylistView(View):
+  '''
+  Provides a REST interface for a user's playlists, and for the play queue
+  when the url sets queue. Entries are edited through PlaylistEntryView.
+  '''
+  @method_decorator(login_required)
+  def get(self, request, pk=None, queue=False):
+    '''
+    Displays a playlist and its entries if pk is provided or this is the
+    queue. Otherwise, displays a json listing of the user's playlists.
+    '''
+    if pk or queue:
+      playlist = get_playlist(request, pk, queue)
+      return JsonResponse(playlist_document(playlist,\
+       playlists.entry_rows(playlist)))
+    return JsonResponse({'playlists': [playlist.json_format() for \
+     playlist in Playlist.objects.filter(owner=request.user,\
+     is_queue=False).order_by('name', 'pk')]})
+
+  @method_decorator(login_required)
+  @method_decorator(transaction.atomic)
+  def post(self, request, pk=None, queue=False):
+    '''
+    Creates a playlist from { name: str, songs: [int, ...] }. The songs
+    are optional.
+    '''
+    if pk or queue:
+      return HttpResponse(status=405)
+    body = read_json_body(request)
+    if body is None:
+      return HttpResponseBadRequest()
+    name = body.get('name')
+    song_ids = read_ids(body, 'songs') if 'songs' in body else []
+    if not isinstance(name, str) or not name.strip() or \
+     len(name) > Playlist._meta.get_field('name').max_length or \
+     song_ids is None or not playlists.songs_exist(song_ids):
+      return HttpResponseBadRequest()
+    playlist = Playlist.objects.create(owner=request.user, name=name.strip())
+    rows = playlists.insert(playlist, song_ids)
+    return JsonResponse(playlist_document(playlist, rows), status=201)
+
+  @method_decorator(login_required)
+  def put(self, request, pk=None, queue=False):
+    '''Renames a playlist with { name: str }.'''
+    if not pk or queue:
+      return HttpResponse(status=405)
+    playlist = get_playlist(request, pk, queue)
+    body = read_json_body(request)
+    name = body.get('name') if body else None
+    if not isinstance(name, str) or not name.strip() or \
+     len(name) > Playlist._meta.get_field('name').max_length:
+      return HttpResponseBadRequest()
+    playlist.name = name.strip()
+    playlist.save()
+    return JsonResponse(playlist.json_format())
+
+  @method_decorator(login_required)
+  def delete(self, request, pk=None, queue=False):
+    '''Deletes a playlist, or empties the queue.'''
+    if not pk and not queue:
+      return HttpResponse(status=405)
+    playlist = get_playlist(request, pk, queue)
+    if queue:
+      playlists.replace(playlist, [])
+    else:
+      playlist.delete()
+    return HttpResponse()
+
+class PlaylistEntryView(View):
+  '''
+  Provides a REST interface for the entries of a playlist or the queue.
+  Changing a single entry writes a single row, see music_player.playlists.
+  '''
+  @method_decorator(login_required)
+  def post(self, request, pk=None, queue=False, entry=None):
+    '''
+    Adds songs to the playlist from { songs: [int, ...], after: int }.
+    The songs follow the entry named by after, go first if after is null
+    or last if it is missing. Displays the new entries.
+    '''
+    if entry:
+      return HttpResponse(status=405)
+    playlist = get_playlist(request, pk, queue)
+    body = read_json_body(request)
+    if body is None:
+      return HttpResponseBadRequest()
+    song_ids = read_ids(body, 'songs')
+    after = read_after(body)
+    if song_ids is None or after == '' or \
+     not playlists.songs_exist(song_ids):
+      return HttpResponseBadRequest()
+    try:
+      rows = playlists.insert(playlist, song_ids, after)
+    except PlaylistEntry.DoesNotExist:
+      return HttpResponseBadRequest()
+    return JsonResponse({'entries': {'fields': ('id', 'rank', 'song'),\
+     'rows': rows}}, status=201)
+
+  @method_decorator(login_required)
+  def put(self, request, pk=None, queue=False, entry=None):
+    '''
+    With an entry, moves it after the entry named by { after: int }, or to
+    the start if after is null. Without one, reorders the playlist with
+    { entries: [int, ...] }, which must list every entry, or replaces its
+    songs with { songs: [int, ...] }. Displays the changed entries.
+    '''
+    playlist = get_playlist(request, pk, queue)
+    body = read_json_body(request)
+    if body is None:
+      return HttpResponseBadRequest()
+    if entry:
+      entry = get_object_or_404(PlaylistEntry, pk=entry, playlist=playlist)
+      after = read_after(body)
+      if after is False or after == '':
+        return HttpResponseBadRequest()
+      try:
+        playlists.move(entry, after)
+      except PlaylistEntry.DoesNotExist:
+        return HttpResponseBadRequest()
+      return JsonResponse({'entries': {'fields': ('id', 'rank', 'song'),\
+       'rows': [(entry.pk, entry.rank, entry.song_id)]}})
+    if 'entries' in body:
+      entry_ids = read_ids(body, 'entries')
+      if entry_ids is None or not playlists.reorder(playlist, entry_ids):
+        return HttpResponseBadRequest()
+      rows = playlists.entry_rows(playlist)
+    else:
+      song_ids = read_ids(body, 'songs')
+      if song_ids is None or not playlists.songs_exist(song_ids):
+        return HttpResponseBadRequest()
+      rows = playlists.replace(playlist, song_ids)
+    return JsonResponse(playlist_document(playlist, rows))
+
+  @method_decorator(login_required)
+  def delete(self, request, pk=None, queue=False, entry=None):
+    '''Removes an entry from the playlist.'''
+    if not entry:
+      return HttpResponse(status=405)
+    playlist = get_playlist(request, pk, queue)
+    playlists.remove(\
+     get_object_or_404(PlaylistEntry, pk=entry, playlist=playlist))
+    return HttpResponse()
@@ -0,0 +1,20 @@
+"""
+ASGI config for soniferous project.
+
+It exposes the ASGI callable as a module-level variable named
+``application``. Signed audio urls are streamed asynchronously by
+music_player.async_audio; every other request is handled by the WSGI
+application in a thread, through asgiref.
+
+Run it with an ASGI server, e.g. ``uvicorn soniferous.asgi:application``.
+"""
+
+import os
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "soniferous.settings")
+
+from asgiref.wsgi import WsgiToAsgi
+from django.core.wsgi import get_wsgi_application
+wsgi_application = get_wsgi_application()
+
+from music_player.async_audio import AudioApplication
+application = AudioApplication(WsgiToAsgi(wsgi_application))
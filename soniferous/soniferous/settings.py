@@ -64,13 +64,46 @@ WSGI_APPLICATION = 'soniferous.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/1.7/ref/settings/#databases
-
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'soniferous.sl3'),
-    }
-}
+# The profile is chosen with the SONIFEROUS_DB environment variable:
+# 'sqlite' (default) or 'postgresql'.
+
+SONIFEROUS_DB = os.environ.get('SONIFEROUS_DB', 'sqlite')
+
+if SONIFEROUS_DB == 'postgresql':
+  # Connections are kept open between requests for CONN_MAX_AGE seconds.
+  # Point HOST and PORT at PgBouncer to share connections between worker
+  # processes as well.
+  DATABASES = {
+      'default': {
+          'ENGINE': 'django.db.backends.postgresql',
+          'NAME': os.environ.get('SONIFEROUS_DB_NAME', 'soniferous'),
+          'USER': os.environ.get('SONIFEROUS_DB_USER', ''),
+          'PASSWORD': os.environ.get('SONIFEROUS_DB_PASSWORD', ''),
+          'HOST': os.environ.get('SONIFEROUS_DB_HOST', ''),
+          'PORT': os.environ.get('SONIFEROUS_DB_PORT', ''),
+          'CONN_MAX_AGE':\
+           int(os.environ.get('SONIFEROUS_DB_CONN_MAX_AGE', 600)),
+      }
+  }
+else:
+  DATABASES = {
+      'default': {
+          'ENGINE': 'django.db.backends.sqlite3',
+          'NAME': os.environ.get('SONIFEROUS_DB_NAME',\
+           os.path.join(BASE_DIR, 'soniferous.sl3')),
+          # Seconds a writer waits for a lock before "database is locked".
+          'OPTIONS': {'timeout': 20},
+      }
+  }
+
+# PRAGMAs run on every new SQLite connection. With WAL, readers are not
+# blocked by a writer and commits only sync the log.
+SONIFEROUS_SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('mmap_size', 256 * 1024 * 1024),
+    ('cache_size', -16 * 1024),
+)
 
 # Templates
 TEMPLATES = [{
@@ -105,8 +138,64 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
+# Use the bundles written to STATIC_ROOT by the build_assets command, once
+# they have been built, instead of the separate scripts and style sheets.
+SONIFEROUS_STATIC_BUNDLES = True
 
 LOGIN_URL = 'soniferous:login'
 LOGIN_REDIRECT_URL = 'soniferous:player'
 FILE_UPLOAD_MAX_MEMORY_SIZE = 0
 
+
+# Audio delivery
+# 'python', 'file_wrapper', 'x_sendfile' or 'x_accel_redirect'.
+# See music_player/audio.py for the web server setup each one needs.
+SONIFEROUS_AUDIO_BACKEND = 'python'
+# nginx internal location that aliases the directory music is stored in.
+SONIFEROUS_X_ACCEL_PREFIX = '/protected/'
+# Seconds the browser may reuse audio responses without asking again.
+SONIFEROUS_AUDIO_MAX_AGE = 3600
+# Seconds signed audio urls stay valid for, at least. A song keeps the same
+# url during each period, so it should be longer than the max age above.
+SONIFEROUS_AUDIO_URL_LIFETIME = 6 * 60 * 60
+# Threads reading files for the audio streams of soniferous.asgi, and the
+# bytes read and sent at once.
+SONIFEROUS_ASGI_THREADS = 8
+SONIFEROUS_ASGI_CHUNK_SIZE = 64 * 1024
+
+# Gapless playback
+# The player fetches this many seconds of the next song ahead of time.
+SONIFEROUS_PREFETCH_SECONDS = 10
+# Bytes fetched ahead of songs whose bitrate is not known.
+SONIFEROUS_PREFETCH_BYTES = 256 * 1024
+
+# Catalog listing cache
+# Listings are cached under the catalog version, which is kept in the
+# database, so the cache may be private to each worker process.
+SONIFEROUS_CATALOG_CACHE = 'default'
+SONIFEROUS_CATALOG_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Clean up albums and artists left unused in one pass when the transaction
+# commits instead of after every deleted or modified song.
+SONIFEROUS_DEFERRED_CLEANUP = False
+
+# Read the tags of uploaded songs in background threads. The "Add song"
+# admin page then leads to the upload jobs page.
+SONIFEROUS_ASYNC_UPLOADS = False
+SONIFEROUS_UPLOAD_WORKERS = 2
+
+# Lower bitrate copies served for song/<pk>/audio?bitrate=N
+SONIFEROUS_TRANSCODE_BITRATES = (64, 96, 128)
+SONIFEROUS_TRANSCODE_DIR = os.path.join(BASE_DIR, 'transcode_cache')
+# Bytes of disk used by copies before the least recently used are evicted.
+SONIFEROUS_TRANSCODE_CACHE_SIZE = 2 * 1024 * 1024 * 1024
+
+# Request metrics, recorded when 'music_player.metrics.MetricsMiddleware'
+# is added to MIDDLEWARE_CLASSES and served to staff at /metrics.
+# Latency histogram buckets in seconds.
+SONIFEROUS_METRICS_BUCKETS = \
+    (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Lets scrapers read /metrics with "Authorization: Bearer <token>".
+SONIFEROUS_METRICS_TOKEN = None
+# Log requests slower than this many seconds along with their SQL.
+SONIFEROUS_SLOW_REQUEST_SECONDS = None